@@ -1,16 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
 from decimal import Decimal
+from collections import deque
+import codecs
+import csv
+import json
 
 from app.db.session import SessionLocal
 from app.models.billing import RateCard
+from app.services.rate_card_import import RateCardImport, CONFLICT_MODES
+from app.services.rating_snapshot import rating_snapshots
 
 router = APIRouter()
 
+MAX_BATCH_NUMBERS = 100_000
+# Tope de bytes del cuerpo de /rate/batch: un número E.164 con comillas, coma y espacios
+# cabe de sobra en 32 bytes, así que el límite de números acota también el tamaño
+MAX_BATCH_BYTES = MAX_BATCH_NUMBERS * 32
+
 def get_db():
     db = SessionLocal()
     try:
@@ -116,6 +127,7 @@ def create_rate_card(data: RateCardCreate, db: Session = Depends(get_db)):
     db.add(rate)
     db.commit()
     db.refresh(rate)
+    rating_snapshots.schedule_rebuild()
     
     return rate
 
@@ -149,6 +161,7 @@ def update_rate_card(
     
     db.commit()
     db.refresh(rate)
+    rating_snapshots.schedule_rebuild()
     
     return rate
 
@@ -165,67 +178,138 @@ def delete_rate_card(rate_id: int, db: Session = Depends(get_db)):
     rate.updated_at = datetime.utcnow()
     
     db.commit()
+    rating_snapshots.schedule_rebuild()
     
     return {"status": "ok", "message": "Rate card deactivated"}
 
 @router.post("/rate-cards/bulk", status_code=201)
-def bulk_create_rate_cards(
-    rates: List[RateCardCreate], 
+async def bulk_create_rate_cards(
+    request: Request,
+    on_conflict: str = "supersede",
     db: Session = Depends(get_db)
 ):
-    """Bulk create rate cards (for importing CSV)"""
-    created = []
-    errors = []
+    """
+    Bulk import rate cards (carrier decks).
+    Body: JSON list of rate cards, NDJSON (application/x-ndjson) or CSV (text/csv)
+    with a header row. NDJSON and CSV are streamed and staged in batches.
+    on_conflict=supersede closes the active rate of each imported prefix;
+    on_conflict=skip reports those rows as duplicates instead.
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise HTTPException(status_code=400, detail=f"on_conflict must be one of {list(CONFLICT_MODES)}")
     
-    for idx, data in enumerate(rates):
-        try:
-            # Check for duplicate
-            existing = db.query(RateCard).filter(
-                RateCard.destination_prefix == data.destination_prefix,
-                (RateCard.effective_end.is_(None)) | 
-                (RateCard.effective_end > datetime.utcnow())
-            ).first()
-            
-            if existing:
-                errors.append({
-                    "index": idx,
-                    "prefix": data.destination_prefix,
-                    "error": "Duplicate active prefix"
-                })
+    importer = await run_in_threadpool(RateCardImport, db, on_conflict)
+    try:
+        async for index, row in _iter_import_rows(request):
+            importer.add(index, row)
+            if importer.needs_flush:
+                await run_in_threadpool(importer.flush)
+        result = await run_in_threadpool(importer.finish)
+    except Exception:
+        db.rollback()
+        raise
+    
+    if result["created"] or result["superseded"]:
+        rating_snapshots.schedule_rebuild()
+    
+    return result
+
+async def _iter_import_lines(request: Request):
+    """Decode the request body as a stream of text lines"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield pending.rstrip("\r")
+
+class _CsvFeed:
+    """Line iterator for a single csv.reader fed incrementally from the request stream"""
+    
+    def __init__(self):
+        self.lines = deque()
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+async def _iter_import_rows(request: Request):
+    """Yield (index, row dict) from a JSON, NDJSON or CSV body"""
+    content_type = request.headers.get("content-type", "")
+    
+    if "ndjson" in content_type:
+        index = 0
+        async for line in _iter_import_lines(request):
+            if not line.strip():
                 continue
-            
-            rate = RateCard(
-                destination_prefix=data.destination_prefix,
-                destination_name=data.destination_name,
-                rate_per_minute=data.rate_per_minute,
-                billing_increment=data.billing_increment,
-                connection_fee=data.connection_fee,
-                effective_start=datetime.utcnow(),
-                priority=data.priority,
-            )
-            
-            db.add(rate)
-            created.append(data.destination_prefix)
-            
-        except Exception as e:
-            errors.append({
-                "index": idx,
-                "prefix": data.destination_prefix,
-                "error": str(e)
-            })
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield index, row if isinstance(row, dict) else {}
+            index += 1
     
-    db.commit()
+    elif "json" in content_type:
+        try:
+            payload = json.loads(await request.body() or b"[]")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON list of rate cards")
+        for index, row in enumerate(payload):
+            yield index, row if isinstance(row, dict) else {}
     
-    return {
-        "created": len(created),
-        "errors": len(errors),
-        "created_prefixes": created,
-        "errors_detail": errors
-    }
+    else:
+        # One csv.reader for the whole body; it is only fed complete records, so
+        # quoted fields may contain newlines (an odd quote count means the record continues)
+        feed = _CsvFeed()
+        reader = None
+        header = None
+        index = 0
+        quotes = 0
+        async for line in _iter_import_lines(request):
+            if not quotes % 2 and not line.strip():
+                continue
+            if reader is None:
+                delimiter = ";" if ";" in line and "," not in line else ","
+                reader = csv.reader(feed, delimiter=delimiter)
+            feed.lines.append(line + "\n")
+            quotes += line.count('"')
+            if quotes % 2:
+                continue
+            quotes = 0
+            for values in reader:
+                if header is None:
+                    header = [col.strip().lower() for col in values]
+                    missing = {"destination_prefix", "destination_name", "rate_per_minute"} - set(header)
+                    if missing:
+                        raise HTTPException(status_code=400, detail=f"CSV header missing columns: {sorted(missing)}")
+                    continue
+                yield index, dict(zip(header, values))
+                index += 1
+        if reader is not None and header is not None:
+            for values in reader:  # Unterminated quoted field at the end of the body
+                yield index, dict(zip(header, values))
+                index += 1
 
 @router.get("/rate-cards/search/{phone_number}")
-def search_rate_for_number(phone_number: str, db: Session = Depends(get_db)):
-    """Find matching rate for a phone number (Longest Prefix Match)"""
+def search_rate_for_number(
+    phone_number: str,
+    at: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Find matching rate for a phone number (Longest Prefix Match).
+    `at` selects the rate in effect at that instant (UTC); defaults to now.
+    """
     
     # Clean number
     clean_number = ''.join(filter(str.isdigit, phone_number))
@@ -233,19 +317,8 @@ def search_rate_for_number(phone_number: str, db: Session = Depends(get_db)):
     if not clean_number:
         raise HTTPException(status_code=400, detail="Invalid phone number")
     
-    # Generate all possible prefixes (descending length)
-    prefixes = [clean_number[:i] for i in range(len(clean_number), 0, -1)]
-    
-    # Query with LPM
-    rate = db.query(RateCard).filter(
-        RateCard.destination_prefix.in_(prefixes),
-        RateCard.effective_start <= datetime.utcnow(),
-        (RateCard.effective_end.is_(None)) | 
-        (RateCard.effective_end > datetime.utcnow())
-    ).order_by(
-        func.length(RateCard.destination_prefix).desc(),
-        RateCard.priority.desc()
-    ).first()
+    # LPM against the effective-dated index (priority and effective_start/end)
+    rate = rating_snapshots.current(db).match(clean_number, at)
     
     if not rate:
         raise HTTPException(
@@ -257,7 +330,110 @@ def search_rate_for_number(phone_number: str, db: Session = Depends(get_db)):
         "phone_number": phone_number,
         "matched_prefix": rate.destination_prefix,
         "destination_name": rate.destination_name,
-        "rate_per_minute": float(rate.rate_per_minute),
+        "rate_per_minute": rate.rate_per_minute,
         "billing_increment": rate.billing_increment,
         "rate_id": rate.id
     }
+
+@router.post("/rate/batch")
+async def rate_batch(
+    request: Request,
+    at: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Rate a list of destination numbers in one pass (Longest Prefix Match).
+    Body: JSON list, {"numbers": [...]} or one number per line (text/plain).
+    `at` selects the rates in effect at that instant (UTC); defaults to now.
+    """
+    body = await _read_batch_body(request)
+    content_type = request.headers.get("content-type", "")
+    
+    if "json" in content_type:
+        try:
+            payload = json.loads(body or b"[]")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        if isinstance(payload, dict):
+            payload = payload.get("numbers")
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="Expected a list of numbers or {\"numbers\": [...]}")
+        numbers = [str(n).strip() for n in payload if n is not None and str(n).strip()]
+    else:
+        numbers = [line.strip() for line in body.decode("utf-8", errors="ignore").splitlines() if line.strip()]
+    
+    if len(numbers) > MAX_BATCH_NUMBERS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many numbers: {len(numbers)} (max {MAX_BATCH_NUMBERS})"
+        )
+    
+    snapshot = await run_in_threadpool(rating_snapshots.current, db)
+    results = await run_in_threadpool(_rate_numbers, snapshot, numbers, at or datetime.utcnow())
+    matched = sum(1 for r in results if r["matched_prefix"] is not None)
+    
+    return {
+        "snapshot_version": snapshot.version,
+        "total": len(results),
+        "matched": matched,
+        "unmatched": len(results) - matched,
+        "results": results
+    }
+
+async def _read_batch_body(request: Request) -> bytes:
+    """Read the /rate/batch body, rejecting it before buffering more than MAX_BATCH_BYTES"""
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"Request body too large (max {MAX_BATCH_BYTES} bytes, {MAX_BATCH_NUMBERS} numbers)"
+    )
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        try:
+            declared = int(content_length)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+        if declared > MAX_BATCH_BYTES:
+            raise too_large
+    
+    # Content-Length puede faltar (chunked) o mentir: se cuentan los bytes al leer
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_BATCH_BYTES:
+            raise too_large
+    return bytes(body)
+
+def _rate_numbers(snapshot, numbers: List[str], at: datetime) -> List[dict]:
+    """Rate every number against the snapshot; repeated numbers are resolved once"""
+    resolved = {}
+    results = []
+    
+    for phone_number in numbers:
+        clean_number = ''.join(filter(str.isdigit, phone_number))
+        item = resolved.get(clean_number)
+        
+        if item is None:
+            rate = snapshot.match(clean_number, at) if clean_number else None
+            if rate:
+                item = {
+                    "matched_prefix": rate.destination_prefix,
+                    "destination_name": rate.destination_name,
+                    "rate_per_second": rate.rate_per_minute / 60.0,
+                    "rate_per_minute": rate.rate_per_minute,
+                    "billing_increment": rate.billing_increment,
+                    "rate_id": rate.id
+                }
+            else:
+                item = {
+                    "matched_prefix": None,
+                    "destination_name": None,
+                    "rate_per_second": None,
+                    "rate_per_minute": None,
+                    "billing_increment": None,
+                    "rate_id": None
+                }
+            resolved[clean_number] = item
+        
+        results.append({"phone_number": phone_number, **item})
+    
+    return results
@@ -1,43 +1,162 @@
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 import logging
+import time
+from decimal import ROUND_HALF_UP, Decimal
+
+from app.services.rating_snapshot import rating_snapshots
 
 logger = logging.getLogger(__name__)
 
-def sync_rate_cards(db: Session):
+RATE_CARDS_SYNC_LOCK_ID = 815001  # pg_advisory_xact_lock compartido con main.py
+RATE_CARDS_COLUMNS = (
+    "destination_prefix", "destination_name", "rate_per_minute", "billing_increment",
+    "connection_fee", "effective_start", "effective_end", "priority"
+)
+RATE_CARDS_SOURCE_SQL = """
+    FROM prefixes p
+    JOIN zones z ON p.zone_id = z.id
+    JOIN rate_zones t ON z.id = t.zone_id
+    WHERE t.enabled = TRUE AND p.enabled = TRUE
+"""
+
+# Huella de las filas actuales de rate_cards (calculada en SQL): detecta cambios hechos
+# directamente en la tabla (CRUD, importación masiva, sincronización de main.py)
+RATE_CARDS_TARGET_HASH_SQL = """
+    SELECT md5(COALESCE(string_agg(
+        concat_ws('|', id, destination_prefix, destination_name, rate_per_minute, billing_increment,
+                  connection_fee, effective_start, COALESCE(effective_end::text, '-'), priority),
+        E'\\n' ORDER BY id
+    ), ''))
+    FROM rate_cards
+"""
+
+_last_sync_hash = None  # (hash origen, hash destino) que dejó la última sincronización de este proceso
+
+def same_value(current, desired):
+    """Compara con la escala de la columna destino (Postgres redondea al guardar)"""
+    if isinstance(current, Decimal) and desired is not None:
+        return current == Decimal(str(desired)).quantize(current, rounding=ROUND_HALF_UP)
+    return current == desired
+
+def diff_rate_cards(existing, desired):
+    """
+    Calcula (inserts, updates, delete_ids, unchanged) entre rate_cards y las filas deseadas.
+    Identidad: (prefijo, nombre, effective_start, priority); las claves repetidas se emparejan en orden.
+    """
+    current = {}
+    for row in existing:
+        key = (row.destination_prefix, row.destination_name, row.effective_start, row.priority)
+        current.setdefault(key, []).append(row)
+    
+    inserts, updates, unchanged = [], [], 0
+    for row in desired:
+        key = (row.destination_prefix, row.destination_name, row.effective_start, row.priority)
+        candidates = current.get(key)
+        values = {col: getattr(row, col) for col in RATE_CARDS_COLUMNS}
+        
+        if not candidates:
+            inserts.append(values)
+            continue
+        
+        match = candidates.pop(0)
+        if not all(same_value(getattr(match, col), values[col]) for col in RATE_CARDS_COLUMNS):
+            updates.append({"id": match.id, **values})
+        else:
+            unchanged += 1
+    
+    delete_ids = [row.id for rows in current.values() for row in rows]
+    return inserts, updates, delete_ids, unchanged
+
+def sync_rate_cards(db: Session, force: bool = False):
     """
     Sincroniza la tabla rate_cards (usada por Rust) con los datos
     de zones, prefixes y rate_zones (usadas por el Dashboard).
+    
+    Aplica solo el diff (insert/update/delete) en una transacción corta, sin
+    TRUNCATE ni regenerar ids, y se omite si no cambiaron ni el origen ni rate_cards.
+    Devuelve conteos y tiempos.
     """
+    global _last_sync_hash
+    started = time.perf_counter()
+    
     try:
         logger.info("Iniciando sincronización de rate_cards...")
         
-        # 1. Truncate rate_cards (reemplazo completo)
-        db.execute(text("TRUNCATE TABLE rate_cards RESTART IDENTITY"))
+        # 1. Serializar con otros procesos que sincronizan rate_cards
+        db.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": RATE_CARDS_SYNC_LOCK_ID})
+        
+        # 2. Hash del origen y huella de rate_cards: si ninguno cambió, no hay nada que hacer
+        content_hash = db.execute(text(f"""
+            SELECT md5(COALESCE(string_agg(
+                concat_ws('|', p.prefix, z.zone_name, t.rate_per_minute, t.billing_increment,
+                          t.effective_from, t.priority),
+                E'\\n' ORDER BY p.prefix, z.zone_name, t.effective_from, t.priority, t.rate_per_minute
+            ), ''))
+            {RATE_CARDS_SOURCE_SQL}
+        """)).scalar()
+        target_hash = db.execute(text(RATE_CARDS_TARGET_HASH_SQL)).scalar()
+        
+        if not force and (content_hash, target_hash) == _last_sync_hash:
+            db.rollback()  # Libera el advisory lock
+            logger.info(f"✅ rate_cards sin cambios (hash {content_hash[:8]}), sincronización omitida.")
+            return {"skipped": True, "inserted": 0, "updated": 0, "removed": 0,
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)}
         
-        # 2. Insertar datos combinados
-        query = text("""
-            INSERT INTO rate_cards (
-                destination_prefix, destination_name, rate_per_minute,
-                billing_increment, connection_fee, effective_start, priority, created_at
-            )
+        # 3. Calcular diff
+        desired = db.execute(text(f"""
             SELECT 
-                p.prefix, 
-                z.zone_name, 
+                p.prefix AS destination_prefix, 
+                z.zone_name AS destination_name, 
                 t.rate_per_minute,
                 t.billing_increment, 
-                0, 
-                t.effective_from,
-                t.priority,
-                CURRENT_TIMESTAMP
-            FROM prefixes p
-            JOIN zones z ON p.zone_id = z.id
-            JOIN rate_zones t ON z.id = t.zone_id
-            WHERE t.enabled = TRUE AND p.enabled = TRUE
-        """)
-        db.execute(query)
+                0 AS connection_fee, 
+                t.effective_from AS effective_start,
+                NULL AS effective_end,
+                t.priority
+            {RATE_CARDS_SOURCE_SQL}
+        """)).fetchall()
+        existing = db.execute(text(
+            f"SELECT id, {', '.join(RATE_CARDS_COLUMNS)} FROM rate_cards"
+        )).fetchall()
+        
+        diff_ms = (time.perf_counter() - started) * 1000
+        inserts, updates, delete_ids, unchanged = diff_rate_cards(existing, desired)
+        
+        # 4. Aplicar solo los cambios
+        if delete_ids:
+            db.execute(text("DELETE FROM rate_cards WHERE id = ANY(:ids)"), {"ids": delete_ids})
+        if updates:
+            set_clause = ", ".join([f"{col} = :{col}" for col in RATE_CARDS_COLUMNS])
+            db.execute(text(f"UPDATE rate_cards SET {set_clause} WHERE id = :id"), updates)
+        if inserts:
+            columns = ", ".join(RATE_CARDS_COLUMNS)
+            placeholders = ", ".join([f":{col}" for col in RATE_CARDS_COLUMNS])
+            db.execute(text(
+                f"INSERT INTO rate_cards ({columns}, created_at) VALUES ({placeholders}, CURRENT_TIMESTAMP)"
+            ), inserts)
+        
+        if inserts or updates or delete_ids:
+            target_hash = db.execute(text(RATE_CARDS_TARGET_HASH_SQL)).scalar()
         db.commit()
-        logger.info("✅ Sincronización completada exitosamente.")
+        _last_sync_hash = (content_hash, target_hash)
+        
+        result = {
+            "skipped": False,
+            "inserted": len(inserts),
+            "updated": len(updates),
+            "removed": len(delete_ids),
+            "unchanged": unchanged,
+            "diff_ms": round(diff_ms, 2),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+        logger.info(f"✅ Sincronización completada: {result}")
+        
+        # Publicar un snapshot nuevo de tarificación en segundo plano
+        if inserts or updates or delete_ids:
+            rating_snapshots.schedule_rebuild()
+        
+        return result
         
     except Exception as e:
         logger.error(f"❌ Error sincronizando rate_cards: {str(e)}")
@@ -0,0 +1,201 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional
+import io
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FLUSH_ROWS = 10_000   # Filas por COPY a la tabla temporal (memoria acotada)
+MAX_ERROR_DETAILS = 1_000    # Se cuentan todos los errores pero solo se detallan los primeros
+CONFLICT_MODES = ("supersede", "skip")
+
+IMPORT_COLUMNS = (
+    "destination_prefix", "destination_name", "rate_per_minute",
+    "billing_increment", "connection_fee", "priority"
+)
+# Vigente ahora: las tarifas programadas a futuro no se consideran duplicadas ni se cierran
+ACTIVE_RATE_SQL = (
+    "(r.effective_end IS NULL OR r.effective_end > :now)"
+    " AND (r.effective_start IS NULL OR r.effective_start <= :now)"
+)
+
+
+def _copy_escape(value: str) -> str:
+    """Escapa un valor para el formato texto de COPY"""
+    return (value.replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+class RateCardImport:
+    """
+    Importación masiva de rate_cards en una sola transacción.
+
+    Las filas se validan en Python al llegar y se cargan por lotes con COPY a
+    una tabla temporal; los duplicados (dentro del archivo y contra las
+    tarifas activas) se resuelven con joins sobre esa tabla, sin una consulta
+    por fila. Con on_conflict="supersede" las tarifas activas del mismo
+    prefijo se cierran (effective_end = ahora) y se insertan las nuevas; con
+    "skip" se reportan como error, como hacía el endpoint original.
+    """
+
+    def __init__(self, db: Session, on_conflict: str = "supersede"):
+        if on_conflict not in CONFLICT_MODES:
+            raise ValueError(f"on_conflict must be one of {CONFLICT_MODES}")
+        self.db = db
+        self.on_conflict = on_conflict
+        self.now = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.total_rows = 0
+        self.error_count = 0
+        self.errors: List[Dict] = []
+        self._buffer = io.StringIO()
+        self._buffered = 0
+
+        db.execute(text("""
+            CREATE TEMP TABLE rate_cards_import (
+                line INTEGER PRIMARY KEY,
+                destination_prefix VARCHAR NOT NULL,
+                destination_name VARCHAR NOT NULL,
+                rate_per_minute NUMERIC(10,4) NOT NULL,
+                billing_increment INTEGER NOT NULL,
+                connection_fee NUMERIC(10,4) NOT NULL,
+                priority INTEGER NOT NULL
+            ) ON COMMIT DROP
+        """))
+
+    def _error(self, index: int, prefix: Optional[str], error: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_ERROR_DETAILS:
+            self.errors.append({"index": index, "prefix": prefix, "error": error})
+
+    def add(self, index: int, row: Dict) -> bool:
+        """Valida una fila del archivo y la deja en el buffer de COPY"""
+        self.total_rows += 1
+        prefix = str(row.get("destination_prefix") or "").strip()
+        name = str(row.get("destination_name") or "").strip()
+
+        if not prefix or not prefix.isdigit():
+            self._error(index, prefix or None, "destination_prefix must be digits only")
+            return False
+        if not name:
+            self._error(index, prefix, "destination_name is required")
+            return False
+
+        try:
+            rate = Decimal(str(row.get("rate_per_minute")).strip())
+            fee = Decimal(str(row.get("connection_fee") or "0").strip())
+            increment = int(row.get("billing_increment") or 6)
+            priority = int(row.get("priority") or 0)
+        except (InvalidOperation, TypeError, ValueError):
+            self._error(index, prefix, "Invalid numeric value")
+            return False
+
+        if not rate.is_finite() or rate < 0 or not fee.is_finite() or fee < 0:
+            self._error(index, prefix, "rate_per_minute and connection_fee must be >= 0")
+            return False
+        if increment <= 0:
+            self._error(index, prefix, "billing_increment must be > 0")
+            return False
+
+        self._buffer.write(f"{index}\t{prefix}\t{_copy_escape(name)}\t{rate}\t{increment}\t{fee}\t{priority}\n")
+        self._buffered += 1
+        return True
+
+    @property
+    def needs_flush(self) -> bool:
+        return self._buffered >= IMPORT_FLUSH_ROWS
+
+    def flush(self) -> None:
+        """COPY del buffer a la tabla temporal"""
+        if not self._buffered:
+            return
+        self._buffer.seek(0)
+        cursor = self.db.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY rate_cards_import (line, {', '.join(IMPORT_COLUMNS)}) FROM STDIN",
+            self._buffer
+        )
+        self._buffer = io.StringIO()
+        self._buffered = 0
+
+    def finish(self) -> Dict:
+        """Aplica la importación (cierra tarifas reemplazadas e inserta) y hace commit"""
+        db = self.db
+        params = {"now": self.now}
+
+        try:
+            self.flush()
+
+            # Prefijo repetido dentro del archivo: gana la última línea
+            for line, prefix in db.execute(text("""
+                DELETE FROM rate_cards_import i
+                USING rate_cards_import j
+                WHERE i.destination_prefix = j.destination_prefix AND i.line < j.line
+                RETURNING i.line, i.destination_prefix
+            """)).fetchall():
+                self._error(line, prefix, "Duplicate prefix in import (a later row wins)")
+
+            # Idénticas a la tarifa activa: no se tocan
+            unchanged = db.execute(text(f"""
+                DELETE FROM rate_cards_import i
+                USING rate_cards r
+                WHERE r.destination_prefix = i.destination_prefix AND {ACTIVE_RATE_SQL}
+                  AND r.destination_name = i.destination_name
+                  AND r.rate_per_minute = i.rate_per_minute
+                  AND r.billing_increment = i.billing_increment
+                  AND COALESCE(r.connection_fee, 0) = i.connection_fee
+                  AND COALESCE(r.priority, 0) = i.priority
+            """), params).rowcount
+
+            superseded = 0
+            if self.on_conflict == "skip":
+                for line, prefix in db.execute(text(f"""
+                    DELETE FROM rate_cards_import i
+                    USING rate_cards r
+                    WHERE r.destination_prefix = i.destination_prefix AND {ACTIVE_RATE_SQL}
+                    RETURNING i.line, i.destination_prefix
+                """), params).fetchall():
+                    self._error(line, prefix, "Duplicate active prefix")
+            else:
+                superseded = db.execute(text(f"""
+                    UPDATE rate_cards r
+                    SET effective_end = :now
+                    FROM rate_cards_import i
+                    WHERE r.destination_prefix = i.destination_prefix AND {ACTIVE_RATE_SQL}
+                """), params).rowcount
+
+            created_prefixes = [row[0] for row in db.execute(text(f"""
+                INSERT INTO rate_cards ({', '.join(IMPORT_COLUMNS)}, effective_start)
+                SELECT {', '.join(IMPORT_COLUMNS)}, :now
+                FROM rate_cards_import
+                ORDER BY line
+                RETURNING destination_prefix
+            """), params).fetchall()]
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        self.errors.sort(key=lambda e: e["index"])
+        elapsed_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        logger.info(
+            f"Rate card import: {self.total_rows} rows, +{len(created_prefixes)} created, "
+            f"{superseded} superseded, {unchanged} unchanged, {self.error_count} errors ({elapsed_ms} ms)"
+        )
+
+        return {
+            "total_rows": self.total_rows,
+            "created": len(created_prefixes),
+            "superseded": superseded,
+            "unchanged": unchanged,
+            "errors": self.error_count,
+            "elapsed_ms": elapsed_ms,
+            "created_prefixes": created_prefixes,
+            "errors_detail": self.errors,
+            "errors_truncated": self.error_count > len(self.errors),
+        }
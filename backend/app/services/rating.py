@@ -1,10 +1,14 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app.models.billing import RateCard
+from datetime import datetime
+from typing import Optional
+from app.services.rating_snapshot import rating_snapshots
 
-def determinar_zona_y_tarifa(numero_marcado: str, db: Session):
+def determinar_zona_y_tarifa(numero_marcado: str, db: Session, at: Optional[datetime] = None):
     """
     Determina la zona y tarifa usando Longest Prefix Match (LPM) contra RateCard.
+    Resuelve contra el snapshot de rate_cards en memoria; solo consulta la BD
+    la primera vez, para construir el snapshot. Respeta effective_start,
+    effective_end y priority en el instante `at` (por defecto ahora).
     """
     # Limpiar el número (quitar caracteres especiales)
     numero_limpio = ''.join(filter(str.isdigit, numero_marcado))
@@ -21,37 +25,16 @@ def determinar_zona_y_tarifa(numero_marcado: str, db: Session):
             'numero_valido': False
         }
 
-    # Estrategia LPM:
-    # 1. Buscar todos los RateCards cuyo prefijo sea un prefijo del numero_limpio
-    #    Para esto, en SQL puro sería: WHERE :numero_limpio LIKE destination_prefix || '%'
-    #    En python/sqlalchemy es más facil traer candidatos o iterar. 
-    #    Dado que destination_prefix es variable, podemos buscar RateCards donde el numero empiece con el prefijo.
+    best_match = rating_snapshots.current(db).match(numero_limpio, at)
     
-    # Eficiente en SQL: length(destination_prefix) <= length(numero_limpio) AND :numero_limpio LIKE destination_prefix || '%'
-    # Sin embargo, 'LIKE' al revés no es estandar.
-    # Alternativa común: traer todos los rate cards y filtrar en python (lento si son muchos).
-    # Alternativa mejor: Buscar coincidencia exacta de substrings.
-    # SELECT * FROM rate_cards WHERE destination_prefix IN (substring(num, 1, 1), substring(num, 1, 2), ...)
-    
-    # Generar todos los posibles prefijos del número marcado
-    posibles_prefijos = [numero_limpio[:i] for i in range(1, len(numero_limpio) + 1)]
-    
-    # Buscar RateCards que coincidan con alguno de estos prefijos
-    matches = db.query(RateCard).filter(
-        RateCard.destination_prefix.in_(posibles_prefijos)
-    ).order_by(func.length(RateCard.destination_prefix).desc()).all()
-    
-    if matches:
-        # El primero es el match mas largo debido al order_by length desc
-        best_match = matches[0]
-        
+    if best_match:
         return {
             'prefijo_id': best_match.id,
             'zona_id': best_match.id, # Mapping provisional
             'prefijo': best_match.destination_prefix,
             'zona_nombre': best_match.destination_name,
             'zona_descripcion': best_match.destination_name,
-            'tarifa_segundo': float(best_match.rate_per_minute) / 60.0, # RateCard es por minuto
+            'tarifa_segundo': best_match.rate_per_minute / 60.0, # RateCard es por minuto
             'tarifa_id': best_match.id,
             'numero_valido': True
         }
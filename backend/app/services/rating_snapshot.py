@@ -0,0 +1,182 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+from bisect import bisect_right
+import threading
+import logging
+
+from app.db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class RateCardEntry(NamedTuple):
+    id: int
+    destination_prefix: str
+    destination_name: str
+    rate_per_minute: float
+    billing_increment: int
+    connection_fee: float
+    effective_start: Optional[datetime]
+    effective_end: Optional[datetime]
+    priority: int
+
+
+class RateTimeline:
+    """
+    Índice de intervalos de las rate_cards de un mismo prefijo.
+
+    Al construirlo se parte la línea de tiempo en segmentos entre todos los
+    effective_start/effective_end y se precalcula la tarifa ganadora de cada
+    segmento (mayor priority, luego effective_start más reciente). Consultar
+    la tarifa vigente en un instante es una búsqueda binaria sobre los
+    segmentos, así que una tarifa programada a futuro entra en vigor sola en
+    su effective_start, sin resincronizar.
+    """
+
+    def __init__(self, entries: List[RateCardEntry]):
+        boundaries = {datetime.min}
+        for entry in entries:
+            if entry.effective_start is not None:
+                boundaries.add(entry.effective_start)
+            if entry.effective_end is not None:
+                boundaries.add(entry.effective_end)
+
+        self.starts: List[datetime] = sorted(boundaries)
+        self.winners: List[Optional[RateCardEntry]] = []
+        for start in self.starts:
+            covering = [
+                e for e in entries
+                if (e.effective_start is None or e.effective_start <= start)
+                and (e.effective_end is None or e.effective_end > start)
+            ]
+            self.winners.append(max(
+                covering,
+                key=lambda e: (e.priority, e.effective_start or datetime.min, e.id),
+                default=None
+            ))
+
+    def at(self, when: datetime) -> Optional[RateCardEntry]:
+        i = bisect_right(self.starts, when) - 1
+        return self.winners[i] if i >= 0 else None
+
+
+class RatingSnapshot:
+    """
+    Snapshot inmutable y versionado de rate_cards para Longest Prefix Match en memoria.
+    Nunca se modifica: cada cambio publica un snapshot nuevo con versión mayor.
+    Incluye todas las versiones de cada prefijo (pasadas, vigentes y futuras),
+    de modo que se puede tarificar en cualquier instante, no solo "ahora".
+    """
+
+    def __init__(self, version: int, rates: Dict[str, RateTimeline]):
+        self.version = version
+        self.created_at = datetime.utcnow()
+        self.rates = rates
+        self.max_prefix_length = max((len(p) for p in rates), default=0)
+
+    def match(self, clean_number: str, at: Optional[datetime] = None) -> Optional[RateCardEntry]:
+        """
+        Prefijo más largo del número con una tarifa vigente en `at`
+        (por defecto ahora, en UTC como effective_start/effective_end).
+        Un `at` con zona horaria se pasa a UTC naive para compararlo con los límites.
+        """
+        when = at or datetime.utcnow()
+        if when.tzinfo is not None:
+            when = when.astimezone(timezone.utc).replace(tzinfo=None)
+        rates = self.rates
+        for i in range(min(len(clean_number), self.max_prefix_length), 0, -1):
+            timeline = rates.get(clean_number[:i])
+            if timeline is not None:
+                rate = timeline.at(when)
+                if rate is not None:
+                    return rate
+        return None
+
+    @classmethod
+    def load(cls, db: Session, version: int) -> "RatingSnapshot":
+        rows = db.execute(text("""
+            SELECT id, destination_prefix, destination_name, rate_per_minute,
+                   billing_increment, connection_fee, effective_start, effective_end, priority
+            FROM rate_cards
+            ORDER BY destination_prefix
+        """)).fetchall()
+
+        entries: Dict[str, List[RateCardEntry]] = {}
+        for row in rows:
+            entries.setdefault(row[1], []).append(RateCardEntry(
+                id=row[0],
+                destination_prefix=row[1],
+                destination_name=row[2],
+                rate_per_minute=float(row[3] or 0),
+                billing_increment=row[4] or 1,  # Igual que rating/snapshot.py (tarificación en vivo)
+                connection_fee=float(row[5] or 0),
+                effective_start=row[6],
+                effective_end=row[7],
+                priority=row[8] or 0,
+            ))
+
+        rates = {prefix: RateTimeline(versions) for prefix, versions in entries.items()}
+        return cls(version, rates)
+
+
+class RatingSnapshotStore:
+    """
+    Puntero copy-on-write al snapshot publicado: los lectores solo leen una
+    referencia y nunca esperan; las reconstrucciones se hacen en segundo plano.
+    """
+
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
+        self._snapshot: Optional[RatingSnapshot] = None
+        self._version = 0
+        self._build_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._pending = False
+        self._worker_running = False
+
+    def current(self, db: Optional[Session] = None) -> RatingSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.rebuild(db)
+        return snapshot
+
+    def rebuild(self, db: Optional[Session] = None) -> RatingSnapshot:
+        with self._build_lock:
+            own_session = db is None
+            if own_session:
+                db = self._session_factory()
+            try:
+                snapshot = RatingSnapshot.load(db, self._version + 1)
+            finally:
+                if own_session:
+                    db.close()
+            self._version = snapshot.version
+            self._snapshot = snapshot
+
+        logger.info(f"Snapshot de tarificación v{snapshot.version} publicado ({len(snapshot.rates)} prefijos)")
+        return snapshot
+
+    def schedule_rebuild(self) -> None:
+        with self._state_lock:
+            self._pending = True
+            if self._worker_running:
+                return
+            self._worker_running = True
+        threading.Thread(target=self._worker, name="rating-snapshot-rebuild", daemon=True).start()
+
+    def _worker(self) -> None:
+        while True:
+            with self._state_lock:
+                if not self._pending:
+                    self._worker_running = False
+                    return
+                self._pending = False
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.error(f"❌ Error reconstruyendo snapshot de tarificación: {str(e)}")
+
+
+rating_snapshots = RatingSnapshotStore()
@@ -8,7 +8,7 @@ import logging
 
 from .models import CDR, ActiveCall
 from .schemas import CallEvent, CDRFilter, CDRResponse, CDRStats, CDRListResponse, ActiveCallRequest
-from main import SessionLocal, Zona, Prefijo, Tarifa  # Importar del main.py existente
+from main import SessionLocal, Zona, Prefijo, Tarifa, rating_snapshots, rating_cache  # Importar del main.py existente
 
 logger = logging.getLogger(__name__)
 
@@ -70,12 +70,7 @@ class CDRService:
             self.db.commit()
             
             # 10. Obtener información de la zona para respuesta
-            zona_info = self.db.execute(
-                text("SELECT nombre FROM zonas WHERE id = :zona_id"),
-                {"zona_id": zona_id}
-            ).fetchone()
-            
-            zona_nombre = zona_info[0] if zona_info else "Desconocida"
+            zona_nombre = rating_snapshots.current().nombre_zona(zona_id)
             
             logger.info(f"CDR creado: {event.calling_number} -> {event.called_number}, "
                        f"Zona: {zona_nombre}, Costo: ${cost:.4f}")
@@ -109,29 +104,10 @@ class CDRService:
             return 1  # Zona por defecto si no hay dígitos
         
         try:
-            # Obtener todos los prefijos ordenados por longitud descendente
-            # Esto prioriza prefijos más específicos (más largos) sobre los generales
-            query = text("""
-                SELECT zona_id, prefijo, longitud_minima, longitud_maxima
-                FROM prefijos 
-                ORDER BY LENGTH(prefijo) DESC, prefijo
-            """)
-            
-            prefijos = self.db.execute(query).fetchall()
-            
-            for prefijo_row in prefijos:
-                zona_id, prefijo, long_min, long_max = prefijo_row
-                
-                # Verificar si el número empieza con este prefijo
-                if clean_number.startswith(str(prefijo)):
-                    # Verificar longitud del número
-                    if long_min and len(clean_number) < long_min:
-                        continue
-                    if long_max and len(clean_number) > long_max:
-                        continue
-                    
-                    # ¡Encontramos la zona!
-                    return zona_id
+            # Longest Prefix Match contra el snapshot de tarificación en memoria
+            _, entrada = rating_cache.resolver(clean_number)
+            if entrada:
+                return entrada.zona_id
             
             # Si no se encuentra ningún prefijo, usar zona por defecto
             logger.warning(f"No se encontró zona para el número: {called_number}")
@@ -146,22 +122,10 @@ class CDRService:
         Obtiene la tarifa por minuto para una zona específica - Extraído del main.py
         """
         try:
-            query = text("""
-                SELECT tarifa_segundo 
-                FROM tarifas 
-                WHERE zona_id = :zona_id 
-                  AND activa = true
-                ORDER BY fecha_inicio DESC
-                LIMIT 1
-            """)
-            
-            result = self.db.execute(query, {"zona_id": zona_id}).fetchone()
+            tarifa = rating_snapshots.current().tarifa_zona(zona_id)
             
-            if result and result[0] is not None:
-                # Convertir de tarifa por segundo a tarifa por minuto
-                tarifa_por_segundo = float(result[0])
-                tarifa_por_minuto = tarifa_por_segundo * 60
-                return tarifa_por_minuto
+            if tarifa:
+                return float(tarifa.rate_per_minute)
             else:
                 logger.warning(f"No se encontró tarifa activa para zona {zona_id}")
                 return 3.0  # Tarifa por defecto: 3.0 por minuto
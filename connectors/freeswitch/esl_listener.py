@@ -2,7 +2,11 @@
 import asyncio
 import json
 import logging
+import os
+import time
+import zlib
 import aiohttp
+from collections import deque
 from datetime import datetime
 
 # Configuration
@@ -11,16 +15,365 @@ ESL_PORT = 8021
 ESL_PASSWORD = "ClueCon"
 BACKEND_URL = "http://localhost:8000/api"
 
+# Backend HTTP client (one pooled session per listener)
+HTTP_POOL_SIZE = 20          # Max concurrent connections to the backend
+HTTP_KEEPALIVE = 30          # Seconds an idle connection is kept open
+HTTP_CONNECT_TIMEOUT = 3
+HTTP_TOTAL_TIMEOUT = 10
+HTTP_STATS_INTERVAL = 60     # Seconds between latency stats log lines
+
+# Event processing: the socket reader only parses events and queues them
+ESL_WORKERS = 4              # Workers (shards by Unique-ID, one call always goes to the same worker)
+ESL_QUEUE_SIZE = 1000        # Max queued events per worker
+ESL_BACKPRESSURE = "block"   # Full queue: "block" the reader, "spill" to disk or "drop" non-billing events
+ESL_SPILL_PATH = "/tmp/esl_listener_spill.jsonl"
+BILLING_EVENTS = {"CHANNEL_HANGUP"}  # Produce the CDR: never dropped
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("ESLListener")
 
+def percentile(values, p):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 1) if ordered else 0
+
+
+class EndpointStats:
+    """Latency and error counters for one backend endpoint"""
+
+    def __init__(self, samples=1000):
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.latencies = deque(maxlen=samples)
+
+    def record(self, elapsed_ms, ok):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.latencies.append(elapsed_ms)
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else 0,
+            "p50_ms": percentile(self.latencies, 0.50),
+            "p99_ms": percentile(self.latencies, 0.99),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+class EventDispatcher:
+    """
+    Bounded queues between the ESL socket reader and the workers that call the backend.
+
+    Events are sharded by Unique-ID, so every event of a call is processed in
+    order by the same worker. When a worker queue is full, `policy` decides:
+      block  wait for room (the socket read pauses and FreeSWITCH buffers)
+      spill  append to ESL_SPILL_PATH; while the file has events everything goes
+             through it, in order, and it is replayed as the queues drain.
+             The offset of the last processed replayed event is kept (fsynced) in
+             ESL_SPILL_PATH + ".offset", so a restart resumes the replay there
+      drop   discard non-billing events (create/answer); billing events still wait
+    """
+
+    def __init__(self, handler, workers=ESL_WORKERS, queue_size=ESL_QUEUE_SIZE,
+                 policy=ESL_BACKPRESSURE, spill_path=ESL_SPILL_PATH):
+        if policy not in ("block", "spill", "drop"):
+            raise ValueError(f"Unknown backpressure policy {policy}")
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.policy = policy
+        self.spill_path = spill_path
+        self.offset_path = spill_path + ".offset"
+        self.queues = []
+        self.tasks = []
+        self.spill_file = None
+        self.spill_wakeup = None
+        self.spilling = False
+        self.offset_fd = None
+        self.replay_pending = deque()   # End offsets of replayed events not yet processed, in file order
+        self.replay_done = set()
+
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.blocked_ms = 0.0
+        self.max_depth = 0
+        self.queue_wait_ms = deque(maxlen=1000)   # Read -> worker pickup
+        self.event_age_ms = deque(maxlen=1000)    # FreeSWITCH Event-Date-Timestamp -> worker pickup
+
+    def start(self):
+        if self.tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self.queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self.tasks = [loop.create_task(self.worker(queue)) for queue in self.queues]
+        if self.policy == "spill":
+            self.spill_wakeup = asyncio.Event()
+            self.tasks.append(loop.create_task(self.drain_spill()))
+            if os.path.exists(self.spill_path) and os.path.getsize(self.spill_path) > self.load_offset():
+                # Events left over by a previous run
+                logger.warning(f"Replaying spilled events from {self.spill_path} at offset {self.load_offset()}")
+                self.terminate_spill_file()
+                self.spilling = True
+                self.spill_wakeup.set()
+            else:
+                self.remove_spill_files()
+        logger.info(f"Event dispatcher: {self.workers} workers, queue {self.queue_size}, policy {self.policy}")
+
+    async def stop(self, timeout=5.0):
+        """Gives the workers `timeout` seconds to finish queued and spilled events"""
+        if not self.tasks:
+            return
+        try:
+            await asyncio.wait_for(self.idle(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Event dispatcher stopped with {self.depth()} events queued"
+                           f"{' and a spill backlog' if self.spilling or self.replay_pending else ''}")
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.spill_file is not None:
+            self.spill_file.close()  # Pending spilled events are replayed on next start
+            self.spill_file = None
+        if self.offset_fd is not None:
+            os.close(self.offset_fd)
+            self.offset_fd = None
+
+    async def idle(self):
+        """Waits until the queues are empty and every spilled event has been processed"""
+        while True:
+            await asyncio.gather(*(queue.join() for queue in self.queues))
+            if not self.spilling and not self.replay_pending:
+                return
+            await asyncio.sleep(0.05)
+
+    def shard(self, event):
+        key = event.get("Unique-ID") or ""
+        return self.queues[zlib.crc32(key.encode()) % len(self.queues)]
+
+    def depth(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    async def put(self, event):
+        item = (time.time(), event, None)
+        if self.spilling:
+            self.spill(item)
+            return
+        queue = self.shard(event)
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.policy == "spill":
+                self.spill(item)
+                return
+            if self.policy == "drop" and event.get("Event-Name") not in BILLING_EVENTS:
+                self.dropped += 1
+                return
+            start = time.perf_counter()
+            await queue.put(item)
+            self.blocked_ms += (time.perf_counter() - start) * 1000
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, queue.qsize())
+
+    def spill(self, item):
+        if self.spill_file is None:
+            self.spill_file = open(self.spill_path, "a")
+        received, event, _ = item
+        self.spill_file.write(json.dumps({"received": received, "event": event}) + "\n")
+        self.spill_file.flush()
+        self.spilled += 1
+        if not self.spilling:
+            logger.warning(f"Event queues full, spilling to {self.spill_path}")
+            self.spilling = True
+        self.spill_wakeup.set()
+
+    def load_offset(self):
+        """Offset of the first spilled event not yet processed"""
+        try:
+            with open(self.offset_path) as f:
+                offset = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+        if not os.path.exists(self.spill_path) or offset > os.path.getsize(self.spill_path):
+            return 0  # Stale sidecar of a spill file that no longer exists
+        return offset
+
+    def save_offset(self, offset):
+        if self.offset_fd is None:
+            self.offset_fd = os.open(self.offset_path, os.O_CREAT | os.O_WRONLY, 0o600)
+        os.pwrite(self.offset_fd, f"{offset:020d}\n".encode(), 0)  # Fixed width: overwritten in place
+        os.fsync(self.offset_fd)
+
+    def terminate_spill_file(self):
+        """A crash mid-write can leave a partial last line; new events must start on a line of their own"""
+        with open(self.spill_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    def remove_spill_files(self):
+        if self.offset_fd is not None:
+            os.close(self.offset_fd)
+            self.offset_fd = None
+        # Sidecar first: a crash in between replays the whole file again instead of skipping events
+        for path in (self.offset_path, self.spill_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def replay_finished(self, offset):
+        """A replayed event was processed: advance the saved offset over the contiguous processed prefix"""
+        self.replay_done.add(offset)
+        committed = None
+        while self.replay_pending and self.replay_pending[0] in self.replay_done:
+            committed = self.replay_pending.popleft()
+            self.replay_done.discard(committed)
+        if committed is not None:
+            self.save_offset(committed)
+        if not self.replay_pending:
+            self.spill_wakeup.set()
+
+    async def drain_spill(self):
+        while True:
+            await self.spill_wakeup.wait()
+            self.spill_wakeup.clear()
+            if not os.path.exists(self.spill_path):
+                continue
+            with open(self.spill_path, "rb") as f:
+                f.seek(self.load_offset())
+                while True:
+                    line = f.readline()
+                    if line:
+                        offset = f.tell()
+                        try:
+                            item = json.loads(line)
+                        except ValueError:
+                            logger.warning(f"Skipping corrupt spilled event at offset {offset}")
+                            continue
+                        event = item["event"]
+                        self.replay_pending.append(offset)
+                        # Blocking here only slows the replay, the socket reader keeps spilling
+                        await self.shard(event).put((item["received"], event, offset))
+                        self.replayed += 1
+                        self.enqueued += 1
+                        continue
+                    # EOF with no await since the last read: back to the in-memory queues,
+                    # but the file is kept until every replayed event has been processed
+                    if self.spilling:
+                        self.spilling = False
+                        logger.info("Spilled events replayed, back to in-memory queues")
+                    if not self.replay_pending:
+                        break
+                    await self.spill_wakeup.wait()  # Set by a new spill or by the last replayed event
+                    self.spill_wakeup.clear()
+            # Nothing was spilled since EOF and every replayed event is processed
+            if self.spill_file is not None:
+                self.spill_file.close()
+                self.spill_file = None
+            self.remove_spill_files()
+            self.spill_wakeup.clear()  # Set by events that were already replayed
+
+    async def worker(self, queue):
+        while True:
+            received, event, offset = await queue.get()
+            now = time.time()
+            self.queue_wait_ms.append((now - received) * 1000)
+            created = event.get("Event-Date-Timestamp")
+            if created and created.isdigit():
+                self.event_age_ms.append(now * 1000 - int(created) / 1000)
+            try:
+                await self.handler(event)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error processing {event.get('Event-Name')} for {event.get('Unique-ID')}: {e}")
+            finally:
+                queue.task_done()
+            if offset is not None:
+                self.replay_finished(offset)  # Not reached if cancelled mid-event: it is replayed again
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "workers": self.workers,
+            "queue_depth": self.depth(),
+            "max_queue_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "spill_backlog": self.spilled - self.replayed if self.spilling else 0,
+            "blocked_ms": round(self.blocked_ms, 1),
+            "queue_wait_p50_ms": percentile(self.queue_wait_ms, 0.50),
+            "queue_wait_p99_ms": percentile(self.queue_wait_ms, 0.99),
+            "event_age_p99_ms": percentile(self.event_age_ms, 0.99),
+        }
+
+
 class ESLClient:
     def __init__(self):
         self.reader = None
         self.writer = None
         self.authenticated = False
+        self.session = None
+        self.stats_task = None
+        self.endpoint_stats = {}
+        self.dispatcher = EventDispatcher(self.process_event)
+
+    async def open_session(self):
+        """Long-lived pooled session: keep-alive connections are reused across events"""
+        if self.session is not None and not self.session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_SIZE,
+            keepalive_timeout=HTTP_KEEPALIVE,
+            ttl_dns_cache=300,
+        )
+        timeout = aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self.stats_task = asyncio.get_running_loop().create_task(self.log_stats())
+        logger.info(f"HTTP pool ready for {BACKEND_URL} (limit {HTTP_POOL_SIZE}, keep-alive {HTTP_KEEPALIVE}s)")
+
+    async def close(self):
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+            self.stats_task = None
+        if self.writer is not None:
+            self.writer.close()
+        await self.dispatcher.stop()
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+        self.log_stats_once()
+
+    def stats(self):
+        return {key: s.summary() for key, s in self.endpoint_stats.items()}
+
+    def log_stats_once(self):
+        logger.info(f"Event queues: {self.dispatcher.stats()}")
+        for key, summary in self.stats().items():
+            logger.info(f"Backend {key}: {summary}")
+
+    async def log_stats(self):
+        while True:
+            await asyncio.sleep(HTTP_STATS_INTERVAL)
+            self.log_stats_once()
 
     async def connect(self):
+        await self.open_session()
+        self.dispatcher.start()
         try:
             self.reader, self.writer = await asyncio.open_connection(ESL_HOST, ESL_PORT)
             logger.info(f"Connected to Freeswitch at {ESL_HOST}:{ESL_PORT}")
@@ -86,9 +439,10 @@ class ESLClient:
                     body_data = await self.reader.read(content_length)
                     body_str = body_data.decode()
                     
-                    # Parse body as event (it is key-value pairs)
+                    # Parse body as event (it is key-value pairs) and hand it to the workers,
+                    # so the socket keeps being read while the backend answers
                     event_data = self.parse_event_body(body_str)
-                    await self.process_event(event_data)
+                    await self.dispatcher.put(event_data)
                     
         except Exception as e:
             logger.error(f"Error in listener loop: {e}")
@@ -151,6 +505,7 @@ class ESLClient:
         
         # Send CDR
         cdr_payload = {
+            "call_uuid": event.get("Unique-ID"),
             "calling_number": event.get("Caller-Caller-ID-Number"),
             "called_number": event.get("Caller-Destination-Number"),
             "start_time": datetime.fromtimestamp(int(event.get("Caller-Channel-Created-Time")) / 1000000).isoformat(),
@@ -164,22 +519,43 @@ class ESLClient:
         await self.send_to_backend("/cdr", cdr_payload, method="POST")
         
         # Delete active call
-        await self.send_to_backend(f"/active-calls/{event.get('Unique-ID')}", {}, method="DELETE")
+        await self.send_to_backend(f"/active-calls/{event.get('Unique-ID')}", {}, method="DELETE",
+                                   route="/active-calls/{call_id}")
 
-    async def send_to_backend(self, endpoint, data, method="POST"):
+    async def send_to_backend(self, endpoint, data, method="POST", route=None):
         url = f"{BACKEND_URL}{endpoint}"
-        async with aiohttp.ClientSession() as session:
-            try:
-                if method == "POST":
-                    async with session.post(url, json=data) as resp:
-                        logger.info(f"Sent {method} to {endpoint}: {resp.status}")
-                elif method == "DELETE":
-                    async with session.delete(url) as resp:
-                        logger.info(f"Sent {method} to {endpoint}: {resp.status}")
-            except Exception as e:
-                logger.error(f"Backend request failed: {e}")
+        stats = self.endpoint_stats.setdefault(f"{method} {route or endpoint}", EndpointStats())
+        await self.open_session()
+        start = time.perf_counter()
+        ok = False
+        try:
+            if method == "POST":
+                request = self.session.post(url, json=data)
+            elif method == "DELETE":
+                request = self.session.delete(url)
+            else:
+                raise ValueError(f"Unsupported method {method}")
+            async with request as resp:
+                # Read the body so the connection goes back to the pool
+                await resp.read()
+                ok = resp.status < 500
+                logger.info(f"Sent {method} to {endpoint}: {resp.status}")
+        except Exception as e:
+            logger.error(f"Backend request failed: {e}")
+        finally:
+            stats.record((time.perf_counter() - start) * 1000, ok)
 
-if __name__ == "__main__":
+
+async def main():
     client = ESLClient()
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(client.connect())
+    try:
+        await client.connect()
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,34 @@
+# database/__init__.py
+"""
+Módulo de base de datos - Sistema Tarificador
+
+Capa asíncrona para los handlers `async def` de main.py:
+- Engine y sesiones SQLAlchemy asyncio sobre asyncpg, con dependencia FastAPI
+- Threadpool acotado para el código síncrono que queda (handlers `def` y helpers)
+- Monitor del lag del event loop para detectar bloqueos
+- Pool configurable por entorno e instrumentado (espera, overflow, fugas)
+
+Uso:
+    from database import AsyncDatabase
+    async_db = AsyncDatabase(DATABASE_URL)
+
+    @app.get("/api/algo")
+    async def algo(db: AsyncSession = Depends(async_db.get_session)):
+        rows = (await db.execute(text("SELECT ..."))).fetchall()
+"""
+
+from .async_db import AsyncDatabase, async_database_url, limitar_threadpool, run_sync
+from .loop_lag import EventLoopLagMonitor
+from .pool import PoolMetrics, instrumentar_engine, opciones_pool, pool_instrumentado
+
+__all__ = [
+    "AsyncDatabase",
+    "async_database_url",
+    "limitar_threadpool",
+    "run_sync",
+    "EventLoopLagMonitor",
+    "PoolMetrics",
+    "instrumentar_engine",
+    "opciones_pool",
+    "pool_instrumentado",
+]
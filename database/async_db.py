@@ -0,0 +1,70 @@
+# database/async_db.py
+"""
+Engine asíncrono (SQLAlchemy asyncio + asyncpg) y threadpool acotado.
+
+Los handlers `async def` que consultaban con `SessionLocal()` bloqueaban el
+event loop durante cada query, congelando a todos los clientes WebSocket.
+Ahora usan una `AsyncSession`; el código síncrono que queda corre en el
+threadpool de Starlette, cuyo tamaño se fija con `limitar_threadpool`.
+"""
+import logging
+from typing import AsyncIterator, Callable, Optional, TypeVar
+
+import anyio.to_thread
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.concurrency import run_in_threadpool
+
+from .pool import PoolMetrics, instrumentar_engine, pool_instrumentado
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_PREFIJOS_SYNC = ("postgresql+psycopg2://", "postgresql://", "postgres://")
+
+
+def async_database_url(url: str) -> str:
+    """postgresql://... -> postgresql+asyncpg://..."""
+    for prefijo in _PREFIJOS_SYNC:
+        if url.startswith(prefijo):
+            return "postgresql+asyncpg://" + url[len(prefijo):]
+    return url
+
+
+class AsyncDatabase:
+    """Engine asíncrono + fábrica de sesiones + dependencia para FastAPI"""
+
+    def __init__(self, url: str, metricas: Optional[PoolMetrics] = None, **engine_kwargs):
+        self.url = async_database_url(url)
+        self.metricas = metricas
+        if metricas is not None:
+            engine_kwargs["poolclass"] = pool_instrumentado(AsyncAdaptedQueuePool, metricas)
+        self.engine = create_async_engine(self.url, **engine_kwargs)
+        if metricas is not None:
+            instrumentar_engine(self.engine, metricas)
+        self.session_factory = async_sessionmaker(
+            self.engine, expire_on_commit=False, autoflush=False
+        )
+
+    async def get_session(self) -> AsyncIterator[AsyncSession]:
+        """Dependencia: una sesión por request, cerrada (y con rollback implícito) al terminar"""
+        async with self.session_factory() as session:
+            yield session
+
+    async def dispose(self) -> None:
+        await self.engine.dispose()
+
+
+def limitar_threadpool(max_hilos: int) -> None:
+    """
+    Acota el threadpool de Starlette/AnyIO (handlers `def`, run_in_threadpool).
+    Debe llamarse dentro del event loop (p.ej. en un evento de startup).
+    """
+    anyio.to_thread.current_default_thread_limiter().total_tokens = max_hilos
+    logger.info(f"Threadpool para código síncrono limitado a {max_hilos} hilos")
+
+
+async def run_sync(func: Callable[..., T], *args, **kwargs) -> T:
+    """Ejecuta un helper síncrono (p.ej. con SessionLocal) en el threadpool acotado"""
+    return await run_in_threadpool(func, *args, **kwargs)
@@ -0,0 +1,58 @@
+# database/loop_lag.py
+"""
+Monitor del lag del event loop.
+
+Una tarea duerme `intervalo` segundos en bucle y mide cuánto tarde se
+despierta: cualquier llamada bloqueante dentro del loop (una query síncrona,
+un fsync, un cálculo largo) aparece como lag.
+"""
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+class EventLoopLagMonitor:
+    def __init__(self, intervalo: float = 0.1, muestras: int = 600):
+        self.intervalo = intervalo
+        self._muestras: Deque[float] = deque(maxlen=muestras)
+        self._tarea: Optional[asyncio.Task] = None
+        self.maximo = 0.0
+
+    def start(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            inicio = loop.time()
+            await asyncio.sleep(self.intervalo)
+            lag = max(0.0, loop.time() - inicio - self.intervalo)
+            self._muestras.append(lag)
+            self.maximo = max(self.maximo, lag)
+
+    def reset(self) -> None:
+        self._muestras.clear()
+        self.maximo = 0.0
+
+    def stats(self) -> Dict:
+        muestras = sorted(self._muestras)
+        if not muestras:
+            return {"samples": 0}
+
+        def percentil(p: float) -> float:
+            return round(muestras[min(len(muestras) - 1, int(p * len(muestras)))] * 1000, 2)
+
+        return {
+            "samples": len(muestras),
+            "interval_ms": self.intervalo * 1000,
+            "p50_ms": percentil(0.50),
+            "p99_ms": percentil(0.99),
+            "max_window_ms": round(muestras[-1] * 1000, 2),
+            "max_ms": round(self.maximo * 1000, 2),
+        }
@@ -0,0 +1,194 @@
+# database/pool.py
+"""
+Configuración e instrumentación del pool de conexiones.
+
+Los parámetros del pool se leen de variables de entorno (DB_POOL_SIZE,
+DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING; el
+engine asíncrono acepta las mismas con prefijo DB_ASYNC_).
+
+`PoolMetrics` cuenta checkouts, tiempo de espera por una conexión, eventos
+de overflow y timeouts, y registra desde cuándo está prestada cada conexión:
+una conexión prestada por más de `umbral_fuga` segundos es candidata a fuga
+(una sesión que nunca se cerró).
+"""
+import bisect
+import os
+import threading
+import time
+from typing import Dict, List
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+BUCKETS_ESPERA = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def _env_bool(nombre: str, defecto: str) -> bool:
+    return os.getenv(nombre, defecto).strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+def opciones_pool(prefijo: str = "DB", respaldo: str = "DB") -> Dict:
+    """kwargs de create_engine para el pool; `respaldo` es el prefijo a usar si falta una variable"""
+    def valor(sufijo: str, defecto: str) -> str:
+        return os.getenv(f"{prefijo}_{sufijo}", os.getenv(f"{respaldo}_{sufijo}", defecto))
+
+    return {
+        "pool_size": int(valor("POOL_SIZE", "10")),
+        "max_overflow": int(valor("MAX_OVERFLOW", "20")),
+        "pool_timeout": float(valor("POOL_TIMEOUT", "30")),
+        "pool_recycle": int(valor("POOL_RECYCLE", "1800")),
+        "pool_pre_ping": _env_bool(f"{prefijo}_POOL_PRE_PING", valor("POOL_PRE_PING", "true")),
+    }
+
+
+class PoolMetrics:
+    """Contadores de un pool; seguros entre hilos"""
+
+    def __init__(self, nombre: str, umbral_fuga: float = 30.0):
+        self.nombre = nombre
+        self.umbral_fuga = umbral_fuga
+        self._lock = threading.Lock()
+        self._prestadas: Dict[int, float] = {}  # id(connection_record) -> instante del checkout
+
+        self.checkouts = 0
+        self.conexiones_creadas = 0
+        self.invalidaciones = 0
+        self.overflow_eventos = 0
+        self.timeouts = 0
+        self.max_prestadas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.espera_buckets = [0] * len(BUCKETS_ESPERA)
+        self.retencion_total = 0.0
+        self.retenciones_largas = 0
+
+    def registrar_espera(self, segundos: float, overflow: bool) -> None:
+        with self._lock:
+            self.espera_total += segundos
+            self.espera_max = max(self.espera_max, segundos)
+            i = bisect.bisect_left(BUCKETS_ESPERA, segundos)
+            if i < len(self.espera_buckets):
+                self.espera_buckets[i] += 1
+            if overflow:
+                self.overflow_eventos += 1
+
+    def registrar_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def checkout(self, clave: int) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self._prestadas[clave] = time.monotonic()
+            self.max_prestadas = max(self.max_prestadas, len(self._prestadas))
+
+    def checkin(self, clave: int) -> None:
+        with self._lock:
+            inicio = self._prestadas.pop(clave, None)
+            if inicio is not None:
+                retenida = time.monotonic() - inicio
+                self.retencion_total += retenida
+                if retenida >= self.umbral_fuga:
+                    self.retenciones_largas += 1
+
+    def stats(self, pool) -> Dict:
+        ahora = time.monotonic()
+        with self._lock:
+            edades = [ahora - t for t in self._prestadas.values()]
+            esperas = sum(self.espera_buckets)
+            return {
+                "engine": self.nombre,
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "max_checked_out": self.max_prestadas,
+                "checkouts": self.checkouts,
+                "connections_created": self.conexiones_creadas,
+                "invalidations": self.invalidaciones,
+                "overflow_events": self.overflow_eventos,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.espera_total / esperas * 1000, 3) if esperas else 0.0,
+                "wait_max_ms": round(self.espera_max * 1000, 3),
+                "hold_avg_ms": round(self.retencion_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "long_holds": self.retenciones_largas,
+                "oldest_checkout_seconds": round(max(edades), 3) if edades else 0.0,
+                "suspected_leaks": sum(1 for e in edades if e >= self.umbral_fuga),
+            }
+
+    def prometheus(self, pool) -> List[str]:
+        """Líneas en formato de exposición de Prometheus"""
+        s = self.stats(pool)
+        etiqueta = f'engine="{self.nombre}"'
+        lineas = []
+        for clave, nombre in (("pool_size", "db_pool_size"), ("checked_out", "db_pool_checked_out"),
+                              ("checked_in", "db_pool_checked_in"), ("overflow", "db_pool_overflow"),
+                              ("suspected_leaks", "db_pool_suspected_leaks"),
+                              ("oldest_checkout_seconds", "db_pool_oldest_checkout_seconds")):
+            lineas.append(f"{nombre}{{{etiqueta}}} {s[clave]}")
+        for clave, nombre in (("checkouts", "db_pool_checkouts_total"),
+                              ("connections_created", "db_pool_connections_created_total"),
+                              ("invalidations", "db_pool_invalidations_total"),
+                              ("overflow_events", "db_pool_overflow_events_total"),
+                              ("timeouts", "db_pool_timeouts_total"),
+                              ("long_holds", "db_pool_long_holds_total")):
+            lineas.append(f"{nombre}{{{etiqueta}}} {s[clave]}")
+
+        with self._lock:
+            acumulado = 0
+            for limite, n in zip(BUCKETS_ESPERA, self.espera_buckets):
+                acumulado += n
+                lineas.append(f'db_pool_wait_seconds_bucket{{{etiqueta},le="{limite}"}} {acumulado}')
+            lineas.append(f'db_pool_wait_seconds_bucket{{{etiqueta},le="+Inf"}} {acumulado}')
+            lineas.append(f"db_pool_wait_seconds_sum{{{etiqueta}}} {round(self.espera_total, 6)}")
+            lineas.append(f"db_pool_wait_seconds_count{{{etiqueta}}} {acumulado}")
+        return lineas
+
+
+def pool_instrumentado(base=QueuePool, metricas: PoolMetrics = None):
+    """
+    Subclase de `base` que mide la espera de cada checkout. Las métricas van
+    como atributo de clase, así sobreviven a `pool.recreate()` / `engine.dispose()`.
+    """
+    class PoolInstrumentado(base):
+        _metricas = metricas
+
+        def _do_get(self):
+            overflow_antes = self._overflow
+            inicio = time.perf_counter()
+            try:
+                registro = super()._do_get()
+            except exc.TimeoutError:
+                self._metricas.registrar_timeout()
+                raise
+            self._metricas.registrar_espera(
+                time.perf_counter() - inicio,
+                overflow=self._overflow > overflow_antes and self.overflow() > 0
+            )
+            return registro
+
+    PoolInstrumentado.__name__ = f"Instrumentado{base.__name__}"
+    return PoolInstrumentado
+
+
+def instrumentar_engine(engine, metricas: PoolMetrics) -> None:
+    """Engancha los eventos del pool (checkout/checkin/connect/invalidate) a `metricas`"""
+    engine = getattr(engine, "sync_engine", engine)  # AsyncEngine
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        with metricas._lock:
+            metricas.conexiones_creadas += 1
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        metricas.checkout(id(connection_record))
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        metricas.checkin(id(connection_record))
+
+    @event.listens_for(engine, "invalidate")
+    def _invalidate(dbapi_connection, connection_record, exception):
+        with metricas._lock:
+            metricas.invalidaciones += 1
@@ -0,0 +1,31 @@
+# ingestion/__init__.py
+"""
+Módulo de ingesta de CDRs - Sistema Tarificador
+
+Componentes para recibir CDRs sin bloquear al conector de la central en la
+latencia de Postgres:
+- Journal local append-only con group commit y checkpoint
+- Hilo de drenado del journal hacia Postgres por lotes
+- Deduplicación por clave de idempotencia (Bloom + LRU de claves recientes)
+
+Uso:
+    from ingestion import CDRJournal, JournalDrainer
+    journal = CDRJournal("data/cdr_journal")
+    journal.open()
+    JournalDrainer(journal, escribir_lote).start()
+"""
+
+from .dedupe import BloomFilter, CDRDeduplicator, NUEVO, DUPLICADO, POSIBLE
+from .journal import CDRJournal, JournalDrainer
+
+__all__ = [
+    "CDRJournal",
+    "JournalDrainer",
+
+    # Deduplicación
+    "BloomFilter",
+    "CDRDeduplicator",
+    "NUEVO",
+    "DUPLICADO",
+    "POSIBLE",
+]
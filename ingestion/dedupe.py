@@ -0,0 +1,158 @@
+# ingestion/dedupe.py
+"""
+Deduplicación en memoria de CDRs por clave de idempotencia (call_uuid).
+
+Los conectores (ESL, JTAPI) reintentan ante errores y sin una clave cada
+reintento vuelve a descontar saldo. El chequeo tiene tres niveles:
+
+1. LRU de claves recientes: acierto = duplicado seguro, sin tocar la BD.
+2. Filtro de Bloom: si la clave no está, es nueva con certeza (sin SELECT).
+3. Si el Bloom dice "quizás" y la clave no está en el LRU, el llamador
+   confirma contra el índice único de cdr.call_uuid. El índice único es
+   además la última defensa si dos procesos reciben la misma clave.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+NUEVO = "nuevo"
+DUPLICADO = "duplicado"
+POSIBLE = "posible"
+
+
+class BloomFilter:
+    """Filtro de Bloom sobre un bytearray, con doble hashing (Kirsch-Mitzenmacher)"""
+
+    def __init__(self, capacidad: int, tasa_falsos_positivos: float = 0.001):
+        self.capacidad = capacidad
+        self.bits = max(8, int(-capacidad * math.log(tasa_falsos_positivos) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.bits / capacidad * math.log(2)))
+        self._datos = bytearray((self.bits + 7) // 8)
+        self.elementos = 0
+
+    def _posiciones(self, clave: str):
+        digest = hashlib.blake2b(clave.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, clave: str) -> None:
+        for pos in self._posiciones(clave):
+            self._datos[pos >> 3] |= 1 << (pos & 7)
+        self.elementos += 1
+
+    def __contains__(self, clave: str) -> bool:
+        datos = self._datos
+        return all(datos[pos >> 3] & (1 << (pos & 7)) for pos in self._posiciones(clave))
+
+
+class CDRDeduplicator:
+    """
+    Bloom de dos generaciones + LRU de claves recientes.
+
+    Cuando la generación actual llega a su capacidad pasa a ser la anterior y
+    se empieza una nueva, así la tasa de falsos positivos no crece sin límite
+    y las claves recientes siguen cubiertas por la generación anterior.
+    """
+
+    def __init__(self, capacidad_bloom: int = 1_000_000, tasa_falsos_positivos: float = 0.001,
+                 capacidad_lru: int = 100_000):
+        self.capacidad_bloom = capacidad_bloom
+        self.tasa_falsos_positivos = tasa_falsos_positivos
+        self.capacidad_lru = capacidad_lru
+        self._bloom = BloomFilter(capacidad_bloom, tasa_falsos_positivos)
+        self._bloom_anterior: Optional[BloomFilter] = None
+        self._recientes: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.nuevos = 0
+        self.duplicados_suprimidos = 0
+        self.confirmaciones_bd = 0
+        self.falsos_positivos = 0
+
+    def _en_bloom(self, clave: str) -> bool:
+        return clave in self._bloom or (self._bloom_anterior is not None and clave in self._bloom_anterior)
+
+    def _agregar_bloom(self, clave: str) -> None:
+        if self._bloom.elementos >= self.capacidad_bloom:
+            self._bloom_anterior = self._bloom
+            self._bloom = BloomFilter(self.capacidad_bloom, self.tasa_falsos_positivos)
+        self._bloom.add(clave)
+
+    def _registrar(self, clave: str) -> None:
+        self._agregar_bloom(clave)
+        self._recientes[clave] = None
+        self._recientes.move_to_end(clave)
+        while len(self._recientes) > self.capacidad_lru:
+            self._recientes.popitem(last=False)
+
+    def reservar(self, clave: str) -> str:
+        """
+        Clasifica la clave. Si es NUEVO queda registrada de inmediato (un
+        reintento concurrente verá DUPLICADO). Si es POSIBLE, el llamador debe
+        confirmar contra la BD y luego llamar a `confirmar`.
+        """
+        with self._lock:
+            if clave in self._recientes:
+                self._recientes.move_to_end(clave)
+                self.duplicados_suprimidos += 1
+                return DUPLICADO
+            if not self._en_bloom(clave):
+                self._registrar(clave)
+                self.nuevos += 1
+                return NUEVO
+            self.confirmaciones_bd += 1
+            return POSIBLE
+
+    def confirmar(self, clave: str, existe: bool) -> str:
+        """Resultado de la confirmación en BD de una clave POSIBLE"""
+        with self._lock:
+            if existe:
+                self._registrar(clave)
+                self.duplicados_suprimidos += 1
+                return DUPLICADO
+            if clave in self._recientes:
+                # Otro hilo la reservó mientras se consultaba la BD
+                self.duplicados_suprimidos += 1
+                return DUPLICADO
+            self._registrar(clave)
+            self.falsos_positivos += 1
+            self.nuevos += 1
+            return NUEVO
+
+    def duplicado_en_bd(self, clave: str) -> None:
+        """El índice único rechazó una clave que se creía nueva"""
+        with self._lock:
+            self._registrar(clave)
+            self.duplicados_suprimidos += 1
+
+    def olvidar(self, clave: str) -> None:
+        """La inserción falló: un reintento de la misma clave no es duplicado"""
+        with self._lock:
+            self._recientes.pop(clave, None)
+
+    def precargar(self, claves: Iterable[str]) -> int:
+        """Carga claves ya guardadas (p.ej. las últimas horas de cdr) solo en el Bloom"""
+        n = 0
+        with self._lock:
+            for clave in claves:
+                if clave:
+                    self._agregar_bloom(clave)
+                    n += 1
+        return n
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "nuevos": self.nuevos,
+                "duplicados_suprimidos": self.duplicados_suprimidos,
+                "confirmaciones_bd": self.confirmaciones_bd,
+                "falsos_positivos": self.falsos_positivos,
+                "claves_recientes": len(self._recientes),
+                "bloom_elementos": self._bloom.elementos,
+                "bloom_bits": self._bloom.bits,
+                "bloom_hashes": self._bloom.hashes,
+            }
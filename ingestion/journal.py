@@ -0,0 +1,411 @@
+# ingestion/journal.py
+"""
+Journal local, append-only y durable para la ingesta asíncrona de CDRs.
+
+POST /cdr en modo asíncrono agrega el evento validado al journal y responde
+202 con su número de secuencia apenas el registro está en disco; un hilo de
+fondo drena el journal hacia Postgres por lotes.
+
+- Cada línea del journal es JSON: {"seq": n, "ts": epoch, "event": {...}}
+- Los fsync se agrupan (group commit): varios appends concurrentes comparten
+  un mismo fsync, esperando como máximo `fsync_interval` segundos.
+- El archivo `checkpoint` guarda la última secuencia confirmada en Postgres;
+  al arrancar se reproducen las entradas posteriores al checkpoint.
+- El journal se divide en segmentos; los que quedan completamente detrás
+  del checkpoint se borran.
+
+Si el proceso muere entre el commit en Postgres y la escritura del
+checkpoint, ese lote se vuelve a entregar al arrancar: el escritor debe ser
+idempotente para no cobrar dos veces.
+
+Cada directorio lo usa un solo proceso (flock sobre `lock`). Con varios
+workers, el primero toma el directorio configurado y los demás el primer
+`worker-N/` libre dentro de él; al reiniciar con la misma cantidad de
+workers se reproducen todos.
+
+Las entradas que no se pueden guardar ni de a una (ver JournalDrainer) se
+mueven a `dead-letter.log` en el mismo directorio y el checkpoint avanza.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+MAX_DIRECTORIOS_WORKER = 64
+
+
+class CDRJournal:
+    """Journal de segmentos con group commit y checkpoint"""
+
+    def __init__(self, directorio: str, fsync_interval: float = 0.005,
+                 segment_max_bytes: int = SEGMENT_MAX_BYTES):
+        self.directorio = directorio
+        self.fsync_interval = fsync_interval
+        self.segment_max_bytes = segment_max_bytes
+
+        self._lock = threading.Lock()
+        self._durable = threading.Condition(self._lock)
+        self._pendientes: Deque[Tuple[int, float, Dict]] = deque()
+        self._archivo = None
+        self._segmento_actual: Optional[str] = None
+        self._abierto = False
+        self._cerrando = False
+        self._lock_fd: Optional[int] = None
+
+        self.ultima_seq = 0        # Última secuencia asignada
+        self.seq_durable = 0       # Última secuencia con fsync
+        self.checkpoint = 0        # Última secuencia confirmada en Postgres
+        self.total_appends = 0
+        self.total_fsyncs = 0
+        self.reproducidas = 0
+        self.total_descartadas = 0  # Entradas en dead-letter.log
+
+    # ----- Arranque y recuperación -----
+
+    def _segmentos(self) -> List[str]:
+        return sorted(
+            f for f in os.listdir(self.directorio)
+            if f.startswith("journal-") and f.endswith(".log")
+        )
+
+    def _leer_checkpoint(self) -> int:
+        try:
+            with open(os.path.join(self.directorio, "checkpoint")) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _bloquear(self, directorio: str) -> bool:
+        import fcntl  # Solo Unix
+        os.makedirs(directorio, exist_ok=True)
+        fd = os.open(os.path.join(directorio, "lock"), os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd  # Se libera en close() o al morir el proceso
+        return True
+
+    def _tomar_directorio(self) -> None:
+        """Lock exclusivo del directorio; si otro worker lo tiene, el primer worker-N/ libre"""
+        base = self.directorio
+        candidatos = [base] + [os.path.join(base, f"worker-{n}") for n in range(1, MAX_DIRECTORIOS_WORKER)]
+        for directorio in candidatos:
+            if self._bloquear(directorio):
+                self.directorio = directorio
+                return
+        raise RuntimeError(f"Journal de CDRs: todos los directorios de {base} están en uso")
+
+    def open(self) -> int:
+        """Abre el journal y carga en memoria las entradas aún no confirmadas"""
+        self._tomar_directorio()
+        self.checkpoint = self._leer_checkpoint()
+        try:
+            with open(os.path.join(self.directorio, "dead-letter.log"), "rb") as f:
+                self.total_descartadas = sum(1 for _ in f)
+        except FileNotFoundError:
+            pass
+        ultima = self.checkpoint
+
+        for nombre in self._segmentos():
+            with open(os.path.join(self.directorio, nombre), "r+b") as f:
+                while True:
+                    offset = f.tell()
+                    linea = f.readline()
+                    if not linea:
+                        break
+                    try:
+                        if not linea.endswith(b"\n"):
+                            raise ValueError("registro sin fin de línea")
+                        registro = json.loads(linea)
+                    except ValueError:
+                        # Registro incompleto por una caída durante el append: nunca se confirmó
+                        logger.warning(f"Journal {nombre}: registro truncado en el byte {offset}, descartado")
+                        f.truncate(offset)
+                        break
+                    ultima = max(ultima, registro["seq"])
+                    if registro["seq"] > self.checkpoint:
+                        self._pendientes.append((registro["seq"], registro["ts"], registro["event"]))
+
+        self.ultima_seq = self.seq_durable = ultima
+        self.reproducidas = len(self._pendientes)
+        # Nunca se sigue escribiendo en un segmento viejo (podría terminar en una línea truncada)
+        self._rotar()
+        self._abierto = True
+
+        threading.Thread(target=self._fsync_loop, name="cdr-journal-fsync", daemon=True).start()
+        logger.info(
+            f"Journal de CDRs abierto en {self.directorio}: checkpoint {self.checkpoint}, "
+            f"{self.reproducidas} entradas pendientes de reproducir"
+        )
+        return self.reproducidas
+
+    def _rotar(self) -> None:
+        if self._archivo:
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+            self._archivo.close()
+        self._segmento_actual = f"journal-{self.ultima_seq + 1:016d}.log"
+        self._archivo = open(os.path.join(self.directorio, self._segmento_actual), "ab")
+
+    # ----- Escritura -----
+
+    def append(self, evento: Dict, esperar_durable: bool = True) -> int:
+        """Agrega un evento y devuelve su secuencia (por defecto, tras el fsync)"""
+        with self._lock:
+            if not self._abierto or self._cerrando:
+                raise RuntimeError("Journal de CDRs no está abierto")
+
+            self.ultima_seq += 1
+            seq = self.ultima_seq
+            ts = time.time()
+            self._archivo.write(
+                json.dumps({"seq": seq, "ts": ts, "event": evento}, separators=(",", ":")).encode() + b"\n"
+            )
+            self._pendientes.append((seq, ts, evento))
+            self.total_appends += 1
+            self._durable.notify_all()
+
+            if esperar_durable:
+                while self.seq_durable < seq:
+                    self._durable.wait()
+        return seq
+
+    def _fsync_loop(self) -> None:
+        while True:
+            with self._lock:
+                while self.seq_durable >= self.ultima_seq and not self._cerrando:
+                    self._durable.wait()
+                if self._cerrando and self.seq_durable >= self.ultima_seq:
+                    return
+
+            # Ventana para acumular appends concurrentes en el mismo fsync
+            time.sleep(self.fsync_interval)
+
+            with self._lock:
+                if self._archivo is None:
+                    return
+                objetivo = self.ultima_seq
+                self._archivo.flush()
+                fd = self._archivo.fileno()
+
+            # El fsync va fuera del lock: los appends siguen entrando mientras tanto
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                logger.error(f"Error haciendo fsync del journal de CDRs: {e}")
+                continue
+
+            with self._lock:
+                self.seq_durable = max(self.seq_durable, objetivo)
+                self.total_fsyncs += 1
+                if self._archivo is not None and self._archivo.tell() >= self.segment_max_bytes:
+                    self._rotar()
+                self._durable.notify_all()
+
+    # ----- Lectura y confirmación (drenado) -----
+
+    def peek(self, limite: int) -> List[Tuple[int, Dict]]:
+        """Primeras entradas durables aún no confirmadas, en orden"""
+        with self._lock:
+            lote = []
+            for seq, _, evento in self._pendientes:
+                if seq > self.seq_durable or len(lote) >= limite:
+                    break
+                lote.append((seq, evento))
+            return lote
+
+    def commit(self, seq: int) -> None:
+        """Marca como confirmadas en Postgres todas las entradas hasta `seq`"""
+        with self._lock:
+            while self._pendientes and self._pendientes[0][0] <= seq:
+                self._pendientes.popleft()
+            self.checkpoint = max(self.checkpoint, seq)
+            checkpoint = self.checkpoint
+            segmento_actual = self._segmento_actual
+
+        ruta = os.path.join(self.directorio, "checkpoint")
+        with open(ruta + ".tmp", "w") as f:
+            f.write(str(checkpoint))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(ruta + ".tmp", ruta)
+
+        # Un segmento se puede borrar si el siguiente empieza después del checkpoint + 1
+        segmentos = self._segmentos()
+        for nombre, siguiente in zip(segmentos, segmentos[1:]):
+            if nombre == segmento_actual:
+                break
+            primera_seq_siguiente = int(siguiente[len("journal-"):-len(".log")])
+            if primera_seq_siguiente <= checkpoint + 1:
+                os.remove(os.path.join(self.directorio, nombre))
+
+    def descartar(self, seq: int, evento: Dict, error: str) -> None:
+        """Mueve una entrada que no se puede guardar a dead-letter.log (se confirma aparte con commit)"""
+        registro = {"seq": seq, "ts": time.time(), "error": error, "event": evento}
+        with open(os.path.join(self.directorio, "dead-letter.log"), "ab") as f:
+            f.write(json.dumps(registro, separators=(",", ":"), default=str).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            self.total_descartadas += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._cerrando = True
+            self._durable.notify_all()
+            if self._archivo:
+                self._archivo.flush()
+                os.fsync(self._archivo.fileno())
+                self.seq_durable = self.ultima_seq
+                self._archivo.close()
+                self._archivo = None
+            self._abierto = False
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    # ----- Métricas -----
+
+    def profundidad(self) -> int:
+        with self._lock:
+            return len(self._pendientes)
+
+    def lag_segundos(self) -> float:
+        with self._lock:
+            if not self._pendientes:
+                return 0.0
+            return time.time() - self._pendientes[0][1]
+
+
+class JournalDrainer:
+    """
+    Hilo que drena el journal hacia Postgres por lotes.
+
+    `escribir_lote` recibe la lista de eventos (dicts) y debe hacer commit;
+    si lanza una excepción el lote se reintenta con backoff exponencial.
+
+    Los errores para los que `es_transitorio` devuelve True (p.ej. Postgres
+    caído) se reintentan sin límite. Con cualquier otro error, después de
+    `max_intentos` el lote se guarda de a una entrada: las que siguen
+    fallando van a dead-letter.log y el checkpoint avanza, así una fila
+    inválida no frena a todas las que vienen detrás.
+    """
+
+    def __init__(self, journal: CDRJournal, escribir_lote: Callable[[List[Dict]], None],
+                 batch_size: int = 500, espera_vacio: float = 0.05, max_intentos: int = 5,
+                 es_transitorio: Callable[[Exception], bool] = lambda e: False):
+        self.journal = journal
+        self.escribir_lote = escribir_lote
+        self.batch_size = batch_size
+        self.espera_vacio = espera_vacio
+        self.max_intentos = max_intentos
+        self.es_transitorio = es_transitorio
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+        self.total_drenadas = 0
+        self.total_lotes = 0
+        self.errores = 0
+        self.ultimo_error: Optional[str] = None
+        self._ventana: Deque[Tuple[float, int]] = deque()  # (instante, filas) del último minuto
+
+    def start(self) -> None:
+        self._hilo = threading.Thread(target=self._run, name="cdr-journal-drainer", daemon=True)
+        self._hilo.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def _run(self) -> None:
+        backoff = 0.5
+        intentos = 0  # Fallos no transitorios seguidos del lote en curso
+        while not self._detener.is_set():
+            lote = self.journal.peek(self.batch_size)
+            if not lote:
+                self._detener.wait(self.espera_vacio)
+                continue
+
+            try:
+                self.escribir_lote([evento for _, evento in lote])
+            except Exception as e:
+                self.errores += 1
+                self.ultimo_error = str(e)
+                if not self.es_transitorio(e):
+                    intentos += 1
+                if intentos >= self.max_intentos and self._drenar_por_entrada(lote):
+                    intentos = 0
+                    backoff = 0.5
+                    continue
+                logger.error(f"Error drenando {len(lote)} CDRs del journal, reintento en {backoff:.1f}s: {e}")
+                self._detener.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+
+            intentos = 0
+            backoff = 0.5
+            self.journal.commit(lote[-1][0])
+            self.total_drenadas += len(lote)
+            self.total_lotes += 1
+            self._ventana.append((time.time(), len(lote)))
+
+    def _drenar_por_entrada(self, lote: List[Tuple[int, Dict]]) -> bool:
+        """
+        Guarda un lote que falla siempre de a una entrada; las que fallan van a
+        dead-letter. Devuelve False si se cortó por un error transitorio (el
+        resto se reintenta como lote). Se confirma entrada por entrada: el
+        checkpoint nunca queda detrás de una entrada ya guardada.
+        """
+        logger.warning(f"Lote de {len(lote)} CDRs falla de forma persistente, se guarda de a uno")
+        for seq, evento in lote:
+            try:
+                self.escribir_lote([evento])
+            except Exception as e:
+                if self.es_transitorio(e):
+                    self.ultimo_error = str(e)
+                    return False
+                self.journal.descartar(seq, evento, str(e))
+                logger.error(f"CDR {seq} del journal movido a dead-letter: {e}")
+            else:
+                self.total_drenadas += 1
+                self._ventana.append((time.time(), 1))
+            self.journal.commit(seq)
+        self.total_lotes += 1
+        return True
+
+    def throughput(self) -> float:
+        """CDRs por segundo confirmados en Postgres durante el último minuto"""
+        limite = time.time() - 60
+        while self._ventana and self._ventana[0][0] < limite:
+            self._ventana.popleft()
+        return round(sum(n for _, n in self._ventana) / 60, 2)
+
+    def stats(self) -> Dict:
+        journal = self.journal
+        return {
+            "queue_depth": journal.profundidad(),
+            "lag_seconds": round(journal.lag_segundos(), 3),
+            "last_sequence": journal.ultima_seq,
+            "durable_sequence": journal.seq_durable,
+            "checkpoint": journal.checkpoint,
+            "replayed_on_startup": journal.reproducidas,
+            "appended": journal.total_appends,
+            "fsyncs": journal.total_fsyncs,
+            "appends_per_fsync": round(journal.total_appends / journal.total_fsyncs, 2) if journal.total_fsyncs else None,
+            "drained": self.total_drenadas,
+            "batches": self.total_lotes,
+            "throughput_per_second": self.throughput(),
+            "errors": self.errores,
+            "last_error": self.ultimo_error,
+            "dead_lettered": journal.total_descartadas,
+            "journal_dir": journal.directorio,
+        }
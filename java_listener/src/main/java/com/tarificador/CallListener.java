@@ -735,6 +735,8 @@ public class CallListener implements CallControlCallObserver {
             System.out.println("====================");
             
             Map<String, Object> cdr = new HashMap<>();
+            // Clave de idempotencia: los reintentos del mismo CDR no se cobran dos veces
+            cdr.put("call_uuid", callData.callId + "-" + callData.startTime.toEpochMilli());
             cdr.put("calling_number", callData.callingNumber);
             cdr.put("called_number", callData.calledNumber);
             cdr.put("start_time", callData.startTime.toString());
@@ -879,6 +881,11 @@ public class CallListener implements CallControlCallObserver {
                                 callData.destinationEstablishedTime.getEpochSecond();
             }
             activeCall.put("current_duration", durationSeconds);
+            // Con answer_time el backend calcula duración y costo en vivo e ignora estos valores
+            if (callData.destinationEstablishedTime != null) {
+                activeCall.put("status", "answered");
+                activeCall.put("answer_time", callData.destinationEstablishedTime.toString());
+            }
 
             double tarifaSegundo = 0.0;
             String zona = "Desconocida";
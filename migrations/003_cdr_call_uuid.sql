@@ -0,0 +1,13 @@
+-- Migration: Add call_uuid idempotency key to cdr
+-- Date: 2026-10-15
+-- Description: Clave de idempotencia para que los reintentos de los conectores no se cobren dos veces
+
+-- ============================================
+-- MODIFICAR TABLA: cdr
+-- ============================================
+
+-- Unique-ID de FreeSWITCH / callId del listener JTAPI (nullable para CDRs existentes)
+ALTER TABLE cdr ADD COLUMN IF NOT EXISTS call_uuid VARCHAR(100);
+
+-- Índice único: confirma los casos dudosos del filtro de Bloom y frena duplicados entre procesos
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cdr_call_uuid ON cdr(call_uuid);
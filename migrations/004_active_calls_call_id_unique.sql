@@ -0,0 +1,21 @@
+-- Migration: Unique call_id on active_calls
+-- Date: 2026-10-15
+-- Description: El volcado por lotes del registro en memoria hace UPSERT con ON CONFLICT (call_id), que exige un índice único
+
+-- ============================================
+-- DEPURAR DUPLICADOS: active_calls
+-- ============================================
+
+-- Conserva por call_id la fila actualizada más recientemente (a igualdad, la de id mayor)
+DELETE FROM active_calls a
+USING active_calls b
+WHERE a.call_id = b.call_id
+  AND (COALESCE(a.last_updated, a.start_time, '-infinity'), a.id)
+    < (COALESCE(b.last_updated, b.start_time, '-infinity'), b.id);
+
+-- ============================================
+-- ÍNDICE ÚNICO: active_calls(call_id)
+-- ============================================
+
+-- Árbitro del ON CONFLICT (call_id) de ActiveCallPersister; los call_id NULL no chocan entre sí
+CREATE UNIQUE INDEX IF NOT EXISTS idx_active_calls_call_id ON active_calls(call_id);
@@ -0,0 +1,40 @@
+# rating/__init__.py
+"""
+Módulo de tarificación - Sistema Tarificador
+
+Este módulo contiene las estructuras en memoria usadas para tarificar:
+- Trie de prefijos para resolver la zona de un número marcado
+- Snapshot inmutable y versionado de prefijos, zonas, tarifas y rate_cards
+- Cache LRU de decisiones por número de destino, invalidada por versión
+- Re-tarificación masiva de CDRs históricos con NumPy (rating.rerate) y
+  simulador what-if de propuestas de tarifas (rating.simulator); ambos se
+  importan aparte para no exigir numpy al resto de la aplicación
+
+Uso:
+    from rating import RatingSnapshotStore
+    rating_snapshots = RatingSnapshotStore(SessionLocal)
+    snapshot = rating_snapshots.current()
+
+    python -m rating.rerate --desde 2025-01-01 --hasta 2025-02-01 [--apply]
+    python -m rating.simulator --dias 30 --tarifa-id 42
+"""
+
+from .cache import RatingCache
+from .prefix_trie import PrefixEntry, PrefixTrie
+from .snapshot import RatingSnapshot, RatingSnapshotStore, ZonaInfo, TarifaInfo, RateCardInfo
+
+__all__ = [
+    # Trie de prefijos
+    "PrefixEntry",
+    "PrefixTrie",
+
+    # Snapshot de tarificación
+    "RatingSnapshot",
+    "RatingSnapshotStore",
+    "ZonaInfo",
+    "TarifaInfo",
+    "RateCardInfo",
+
+    # Cache de decisiones
+    "RatingCache",
+]
@@ -0,0 +1,90 @@
+# rating/cache.py
+"""
+Cache LRU de decisiones de tarificación por número de destino.
+
+El tráfico se concentra en pocos miles de destinos, así que el resultado de
+resolver un número (prefijo y zona) se guarda por número normalizado. Cada
+entrada pertenece a una versión del snapshot: cuando el `RatingSnapshotStore`
+publica una versión nueva, la cache se vacía completa en la siguiente consulta.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .prefix_trie import PrefixEntry
+from .snapshot import RatingSnapshot
+
+_SIN_PREFIJO = object()  # Marca "número sin prefijo" (None también se cachea)
+
+
+class RatingCache:
+    """LRU acotado delante de `RatingSnapshot.resolver_prefijo`, con contadores"""
+
+    def __init__(self, store, capacidad: int = 50_000):
+        self._store = store
+        self.capacidad = capacidad
+        self._entradas: "OrderedDict[str, object]" = OrderedDict()
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidaciones = 0
+
+    def resolver(self, numero) -> Tuple[RatingSnapshot, Optional[PrefixEntry]]:
+        """
+        Devuelve el snapshot vigente y el prefijo que le corresponde a `numero`
+        en ese snapshot (None si ninguno coincide).
+        """
+        snapshot = self._store.current()
+        numero_limpio = RatingSnapshot.limpiar_numero(numero)
+
+        with self._lock:
+            if snapshot.version != self._version:
+                if self._entradas:
+                    self.invalidaciones += 1
+                self._entradas.clear()
+                self._version = snapshot.version
+
+            entrada = self._entradas.get(numero_limpio)
+            if entrada is not None:
+                self._entradas.move_to_end(numero_limpio)
+                self.hits += 1
+                return snapshot, None if entrada is _SIN_PREFIJO else entrada
+            self.misses += 1
+
+        entrada = snapshot.trie.lookup(numero_limpio)
+
+        with self._lock:
+            # Si otro hilo ya invalidó por una versión nueva, no mezclar versiones
+            if snapshot.version == self._version:
+                self._entradas[numero_limpio] = _SIN_PREFIJO if entrada is None else entrada
+                self._entradas.move_to_end(numero_limpio)
+                while len(self._entradas) > self.capacidad:
+                    self._entradas.popitem(last=False)
+                    self.evictions += 1
+
+        return snapshot, entrada
+
+    def determinar_zona_y_tarifa(self, numero_marcado: str) -> Dict:
+        snapshot, entrada = self.resolver(numero_marcado)
+        return snapshot.respuesta_zona_y_tarifa(numero_marcado, entrada)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self._version = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "snapshot_version": self._version,
+                "capacidad": self.capacidad,
+                "entradas": len(self._entradas),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidaciones": self.invalidaciones,
+                "hit_ratio": round(self.hits / consultas, 4) if consultas else None,
+            }
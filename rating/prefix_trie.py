@@ -0,0 +1,97 @@
+# rating/prefix_trie.py
+"""
+Trie de dígitos para resolver la zona de un número marcado (Longest Prefix Match).
+
+Reemplaza el escaneo lineal de la tabla `prefixes` que se hacía por cada CDR.
+El trie forma parte del RatingSnapshot (ver snapshot.py) y se reconstruye
+completo junto con él cuando cambian zonas o prefijos.
+"""
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+
+class PrefixEntry(NamedTuple):
+    """Prefijo compilado dentro del trie"""
+    prefijo_id: Optional[int]
+    zona_id: int
+    prefijo: str
+    longitud_minima: Optional[int]
+    longitud_maxima: Optional[int]
+
+    def acepta_longitud(self, longitud: int) -> bool:
+        """Mismo criterio que get_zone_by_prefix: 0/None significa sin restricción"""
+        if self.longitud_minima and longitud < self.longitud_minima:
+            return False
+        if self.longitud_maxima and longitud > self.longitud_maxima:
+            return False
+        return True
+
+
+class _Nodo:
+    __slots__ = ("hijos", "entradas")
+
+    def __init__(self):
+        self.hijos = {}
+        self.entradas = ()
+
+
+class PrefixTrie:
+    """
+    Trie de dígitos inmutable una vez compilado.
+
+    Cada nodo puede tener varias entradas (el mismo prefijo registrado en
+    zonas distintas con longitudes distintas, p.ej. "9" Local/7 y "9" Movil/9);
+    se conservan en orden de inserción y gana la primera que acepte la longitud.
+    """
+
+    def __init__(self, entradas: Iterable[PrefixEntry] = ()):
+        self._raiz = _Nodo()
+        self.total_prefijos = 0
+        self.profundidad_maxima = 0
+        for entrada in entradas:
+            self.insert(entrada)
+
+    def insert(self, entrada: PrefixEntry) -> None:
+        prefijo = ''.join(filter(str.isdigit, str(entrada.prefijo or '')))
+        if not prefijo:
+            return
+
+        nodo = self._raiz
+        for digito in prefijo:
+            siguiente = nodo.hijos.get(digito)
+            if siguiente is None:
+                siguiente = _Nodo()
+                nodo.hijos[digito] = siguiente
+            nodo = siguiente
+
+        nodo.entradas = nodo.entradas + (entrada,)
+        self.total_prefijos += 1
+        self.profundidad_maxima = max(self.profundidad_maxima, len(prefijo))
+
+    def lookup(self, numero: str) -> Optional[PrefixEntry]:
+        """
+        Devuelve la entrada del prefijo más largo que coincide con `numero`
+        y cuya restricción de longitud acepta el número. O(len(numero)).
+        """
+        if not numero:
+            return None
+
+        longitud = len(numero)
+        candidatos: List[Tuple[PrefixEntry, ...]] = []
+        nodo = self._raiz
+        for digito in numero:
+            nodo = nodo.hijos.get(digito)
+            if nodo is None:
+                break
+            if nodo.entradas:
+                candidatos.append(nodo.entradas)
+
+        # Del más específico (más largo) al más general
+        for entradas in reversed(candidatos):
+            for entrada in entradas:
+                if entrada.acepta_longitud(longitud):
+                    return entrada
+        return None
+
+    def __len__(self) -> int:
+        return self.total_prefijos
+
@@ -0,0 +1,321 @@
+# rating/simulator.py
+"""
+Simulador "what-if" de tarifas sobre el tráfico reciente.
+
+Antes de activar una tarifa (/api/tarifas/{id}/activar) o cargar prefijos
+nuevos, reproduce los CDR de los últimos N días contra el snapshot actual y
+contra un snapshot candidato en una sola pasada por bloques, y devuelve la
+diferencia de costo por zona y por anexo (calling_number). No escribe nada.
+
+El snapshot candidato es el actual con la propuesta aplicada:
+- tarifa_ids: filas existentes de rate_zones tratadas como activas
+- tarifas: tarifas nuevas por zona (tarifa_segundo, billing_increment, rate_per_call)
+- prefijos: prefijos nuevos; ante el mismo prefijo tienen prioridad sobre los actuales
+
+Uso:
+    python -m rating.simulator --dias 30 --tarifa-id 42
+    python -m rating.simulator --dias 7 --tarifa 3:0.02 --prefijo 519:3:9:9
+"""
+import argparse
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from .prefix_trie import PrefixEntry
+from .rerate import DATABASE_URL, ZONA_POR_DEFECTO, ReporteZonas, TablaZonas, _resolver_zonas
+from .snapshot import RatingSnapshot, TarifaInfo
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 100_000
+LIMITE_ANEXOS = 50
+
+
+def construir_candidato(
+    db,
+    actual: RatingSnapshot,
+    tarifa_ids: Optional[List[int]] = None,
+    tarifas: Optional[List[Dict]] = None,
+    prefijos: Optional[List[Dict]] = None,
+) -> RatingSnapshot:
+    """
+    Snapshot candidato = snapshot actual + propuesta.
+
+    Raises:
+        ValueError: si una tarifa o prefijo referencia una zona/tarifa inexistente
+    """
+    nuevas_tarifas = dict(actual.tarifas)
+
+    if tarifa_ids:
+        rows = db.execute(text("""
+            SELECT id, zone_id, rate_per_minute, billing_increment, rate_per_call,
+                   effective_from, priority
+            FROM rate_zones
+            WHERE id = ANY(:ids)
+        """), {"ids": list(tarifa_ids)}).fetchall()
+
+        faltantes = set(tarifa_ids) - {row[0] for row in rows}
+        if faltantes:
+            raise ValueError(f"Tarifas no encontradas: {sorted(faltantes)}")
+
+        for row in rows:
+            nuevas_tarifas[row[1]] = TarifaInfo(
+                id=row[0],
+                zona_id=row[1],
+                rate_per_minute=float(row[2] or 0),
+                billing_increment=row[3] or 60,
+                rate_per_call=float(row[4] or 0),
+                effective_from=row[5],
+                priority=row[6] or 1,
+            )
+
+    for tarifa in tarifas or []:
+        zona_id = tarifa["zona_id"]
+        if zona_id not in actual.zonas:
+            raise ValueError(f"Zona {zona_id} no encontrada")
+        nuevas_tarifas[zona_id] = TarifaInfo(
+            id=None,
+            zona_id=zona_id,
+            rate_per_minute=float(tarifa["tarifa_segundo"]) * 60,
+            billing_increment=tarifa.get("billing_increment") or 60,
+            rate_per_call=float(tarifa.get("rate_per_call") or 0),
+            effective_from=None,
+            priority=1,
+        )
+
+    nuevos_prefijos = []
+    for prefijo in prefijos or []:
+        if prefijo["zona_id"] not in actual.zonas:
+            raise ValueError(f"Zona {prefijo['zona_id']} no encontrada")
+        nuevos_prefijos.append(PrefixEntry(
+            None,
+            prefijo["zona_id"],
+            str(prefijo["prefijo"]),
+            prefijo.get("longitud_minima"),
+            prefijo.get("longitud_maxima"),
+        ))
+
+    # Los prefijos propuestos van primero: en el trie gana la primera entrada del nodo
+    return RatingSnapshot(
+        actual.version,
+        nuevos_prefijos + list(actual.prefijos),
+        actual.zonas,
+        nuevas_tarifas,
+        actual.rate_cards,
+    )
+
+
+class _AcumuladorAnexos:
+    """Costos actual/candidato por calling_number"""
+
+    def __init__(self):
+        self.llamadas: Dict[str, int] = {}
+        self.costo_actual: Dict[str, float] = {}
+        self.costo_candidato: Dict[str, float] = {}
+
+    def acumular(self, anexos: List[str], costo_actual: np.ndarray, costo_candidato: np.ndarray) -> None:
+        unicos, inverso = np.unique(np.array(anexos, dtype=object), return_inverse=True)
+        llamadas = np.bincount(inverso, minlength=len(unicos))
+        actual = np.bincount(inverso, weights=costo_actual, minlength=len(unicos))
+        candidato = np.bincount(inverso, weights=costo_candidato, minlength=len(unicos))
+
+        for anexo, n, a, c in zip(unicos.tolist(), llamadas.tolist(), actual.tolist(), candidato.tolist()):
+            self.llamadas[anexo] = self.llamadas.get(anexo, 0) + n
+            self.costo_actual[anexo] = self.costo_actual.get(anexo, 0.0) + a
+            self.costo_candidato[anexo] = self.costo_candidato.get(anexo, 0.0) + c
+
+    def filas(self, limite: int) -> List[Dict]:
+        filas = [
+            {
+                "calling_number": anexo,
+                "llamadas": self.llamadas[anexo],
+                "costo_actual": round(self.costo_actual[anexo], 2),
+                "costo_candidato": round(self.costo_candidato[anexo], 2),
+                "delta": round(self.costo_candidato[anexo] - self.costo_actual[anexo], 2),
+            }
+            for anexo in self.llamadas
+        ]
+        filas.sort(key=lambda f: abs(f["delta"]), reverse=True)
+        return filas[:limite]
+
+
+def simular(
+    session_factory,
+    actual: RatingSnapshot,
+    candidato: RatingSnapshot,
+    dias: int = 30,
+    con_incrementos: bool = False,
+    limite_anexos: int = LIMITE_ANEXOS,
+    chunk_size: int = CHUNK_SIZE,
+) -> Dict:
+    """
+    Reproduce los CDR de los últimos `dias` días contra ambos snapshots.
+
+    Returns:
+        dict con totales, diferencias por zona (zona resultante en el
+        candidato) y los `limite_anexos` anexos con mayor diferencia absoluta
+    """
+    inicio = time.perf_counter()
+    desde = datetime.now() - timedelta(days=dias)
+
+    # Misma indexación de zonas en ambas tablas para poder comparar por posición
+    zona_ids = sorted(
+        set(actual.zonas) | set(actual.tarifas) | set(candidato.tarifas) | {ZONA_POR_DEFECTO}
+    )
+    tabla_actual = TablaZonas(actual, con_incrementos=con_incrementos, zona_ids=zona_ids)
+    tabla_candidata = TablaZonas(candidato, con_incrementos=con_incrementos, zona_ids=zona_ids)
+    reporte = ReporteZonas(tabla_candidata)
+    anexos = _AcumuladorAnexos()
+
+    db = session_factory()
+    procesadas = cambiadas = 0
+    ultimo_id = 0
+
+    try:
+        while True:
+            rows = db.execute(text("""
+                SELECT id, COALESCE(calling_number, ''), called_number, COALESCE(duration_billable, 0)
+                FROM cdr
+                WHERE id > :ultimo_id AND start_time >= :desde
+                ORDER BY id
+                LIMIT :limite
+            """), {"ultimo_id": ultimo_id, "desde": desde, "limite": chunk_size}).fetchall()
+
+            if not rows:
+                break
+
+            ids, llamantes, numeros, duraciones = zip(*rows)
+            duracion = np.array(duraciones, dtype=np.float64)
+            numeros = [actual.limpiar_numero(n) for n in numeros]
+
+            idx_actual = _resolver_zonas(actual, tabla_actual, numeros)
+            idx_candidato = _resolver_zonas(candidato, tabla_candidata, numeros)
+            costo_actual = tabla_actual.calcular_costos(idx_actual, duracion)
+            costo_candidato = tabla_candidata.calcular_costos(idx_candidato, duracion)
+
+            cambiado = np.abs(costo_candidato - costo_actual) >= 0.005
+            reporte.acumular(idx_candidato, costo_actual, costo_candidato, cambiado)
+            anexos.acumular(list(llamantes), costo_actual, costo_candidato)
+
+            procesadas += len(ids)
+            cambiadas += int(cambiado.sum())
+            ultimo_id = ids[-1]
+    finally:
+        db.close()
+
+    zonas = [
+        {
+            "zona_id": z["zona_id"],
+            "zona_nombre": z["zona_nombre"],
+            "llamadas": z["llamadas"],
+            "cambiadas": z["cambiadas"],
+            "costo_actual": z["costo_anterior"],
+            "costo_candidato": z["costo_nuevo"],
+            "delta": z["delta"],
+        }
+        for z in reporte.filas()
+    ]
+    duracion_s = time.perf_counter() - inicio
+
+    return {
+        "dias": dias,
+        "desde": desde.isoformat(),
+        "con_incrementos": con_incrementos,
+        "snapshot_version": actual.version,
+        "procesadas": procesadas,
+        "cambiadas": cambiadas,
+        "costo_actual": round(sum(z["costo_actual"] for z in zonas), 2),
+        "costo_candidato": round(sum(z["costo_candidato"] for z in zonas), 2),
+        "delta": round(sum(z["delta"] for z in zonas), 2),
+        "segundos": round(duracion_s, 2),
+        "cdrs_por_segundo": round(procesadas / duracion_s) if duracion_s > 0 else None,
+        "zonas": zonas,
+        "anexos": anexos.filas(limite_anexos),
+    }
+
+
+def simular_propuesta(
+    session_factory,
+    actual: RatingSnapshot,
+    dias: int = 30,
+    tarifa_ids: Optional[List[int]] = None,
+    tarifas: Optional[List[Dict]] = None,
+    prefijos: Optional[List[Dict]] = None,
+    con_incrementos: bool = False,
+    limite_anexos: int = LIMITE_ANEXOS,
+) -> Dict:
+    """Construye el candidato desde la propuesta y ejecuta la simulación"""
+    db = session_factory()
+    try:
+        candidato = construir_candidato(db, actual, tarifa_ids, tarifas, prefijos)
+    finally:
+        db.close()
+    return simular(session_factory, actual, candidato, dias, con_incrementos, limite_anexos)
+
+
+def _tarifa_cli(valor: str) -> Dict:
+    """ZONA:TARIFA_SEGUNDO[:BILLING_INCREMENT[:RATE_PER_CALL]]"""
+    partes = valor.split(":")
+    tarifa = {"zona_id": int(partes[0]), "tarifa_segundo": float(partes[1])}
+    if len(partes) > 2:
+        tarifa["billing_increment"] = int(partes[2])
+    if len(partes) > 3:
+        tarifa["rate_per_call"] = float(partes[3])
+    return tarifa
+
+
+def _prefijo_cli(valor: str) -> Dict:
+    """PREFIJO:ZONA[:LONGITUD_MINIMA:LONGITUD_MAXIMA]"""
+    partes = valor.split(":")
+    prefijo = {"prefijo": partes[0], "zona_id": int(partes[1])}
+    if len(partes) > 3:
+        prefijo["longitud_minima"] = int(partes[2])
+        prefijo["longitud_maxima"] = int(partes[3])
+    return prefijo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simula el impacto de una propuesta de tarifas sobre el tráfico reciente")
+    parser.add_argument("--dias", type=int, default=30)
+    parser.add_argument("--tarifa-id", type=int, action="append", default=[], help="Tarifa existente a simular como activa")
+    parser.add_argument("--tarifa", type=_tarifa_cli, action="append", default=[],
+                        help="ZONA:TARIFA_SEGUNDO[:BILLING_INCREMENT[:RATE_PER_CALL]]")
+    parser.add_argument("--prefijo", type=_prefijo_cli, action="append", default=[],
+                        help="PREFIJO:ZONA[:LONGITUD_MINIMA:LONGITUD_MAXIMA]")
+    parser.add_argument("--con-incrementos", action="store_true",
+                        help="Redondear al billing_increment y sumar rate_per_call (por defecto, como POST /cdr)")
+    parser.add_argument("--limite-anexos", type=int, default=LIMITE_ANEXOS)
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    engine = create_engine(args.database_url)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = session_factory()
+    try:
+        actual = RatingSnapshot.load(db, version=0)
+    finally:
+        db.close()
+
+    resultado = simular_propuesta(
+        session_factory,
+        actual,
+        dias=args.dias,
+        tarifa_ids=args.tarifa_id,
+        tarifas=args.tarifa,
+        prefijos=args.prefijo,
+        con_incrementos=args.con_incrementos,
+        limite_anexos=args.limite_anexos,
+    )
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# rating/snapshot.py
+"""
+Snapshot inmutable y versionado de toda la configuración de tarificación.
+
+Un `RatingSnapshot` contiene prefijos (trie), zonas, la tarifa activa de cada
+zona (rate_zones) y las rate_cards vigentes. Los endpoints tarifican contra
+el snapshot publicado sin tocar Postgres; cualquier edición de tarifas o
+prefijos programa una reconstrucción en segundo plano y el nuevo snapshot se
+publica reemplazando la referencia (copy-on-write), sin bloquear lectores.
+"""
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from .prefix_trie import PrefixEntry, PrefixTrie
+
+logger = logging.getLogger(__name__)
+
+
+class ZonaInfo(NamedTuple):
+    id: int
+    nombre: str
+    descripcion: Optional[str]
+
+
+class TarifaInfo(NamedTuple):
+    """Tarifa activa de una zona (fila de rate_zones)"""
+    id: int
+    zona_id: int
+    rate_per_minute: float
+    billing_increment: int
+    rate_per_call: float
+    effective_from: Optional[datetime]
+    priority: int
+
+    @property
+    def tarifa_segundo(self) -> float:
+        return self.rate_per_minute / 60
+
+
+class RateCardInfo(NamedTuple):
+    """Fila de rate_cards (tabla que consume el motor Rust)"""
+    id: int
+    destination_prefix: str
+    destination_name: str
+    rate_per_minute: float
+    billing_increment: int
+    connection_fee: float
+    effective_start: Optional[datetime]
+    effective_end: Optional[datetime]
+    priority: int
+
+
+class RatingSnapshot:
+    """
+    Vista inmutable de la configuración de tarificación en un instante.
+
+    No se modifica después de construida: para cambiar algo se construye otro
+    snapshot con una versión mayor y se publica en el `RatingSnapshotStore`.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        prefijos: Iterable[PrefixEntry],
+        zonas: Dict[int, ZonaInfo],
+        tarifas: Dict[int, TarifaInfo],
+        rate_cards: Dict[str, RateCardInfo],
+    ):
+        self.version = version
+        self.creado_en = datetime.now()
+        self.prefijos = tuple(prefijos)
+        self.trie = PrefixTrie(self.prefijos)
+        self.zonas = zonas
+        self.tarifas = tarifas
+        self.rate_cards = rate_cards
+
+    @staticmethod
+    def limpiar_numero(numero) -> str:
+        return ''.join(filter(str.isdigit, str(numero or '')))
+
+    def resolver_prefijo(self, numero: str) -> Optional[PrefixEntry]:
+        """Longest Prefix Match del número (ya limpio o no) contra los prefijos"""
+        return self.trie.lookup(self.limpiar_numero(numero))
+
+    def tarifa_zona(self, zona_id: Optional[int]) -> Optional[TarifaInfo]:
+        if zona_id is None:
+            return None
+        return self.tarifas.get(zona_id)
+
+    def nombre_zona(self, zona_id: Optional[int], default: str = "Desconocida") -> str:
+        zona = self.zonas.get(zona_id) if zona_id is not None else None
+        return zona.nombre if zona else default
+
+    def determinar_zona_y_tarifa(self, numero_marcado: str) -> Dict:
+        """Misma respuesta que main.determinar_zona_y_tarifa, resuelta en memoria"""
+        return self.respuesta_zona_y_tarifa(numero_marcado, self.resolver_prefijo(numero_marcado))
+
+    def respuesta_zona_y_tarifa(self, numero_marcado: str, entrada: Optional[PrefixEntry]) -> Dict:
+        """Arma la respuesta de determinar_zona_y_tarifa a partir del prefijo ya resuelto"""
+        if entrada is None:
+            numero_limpio = self.limpiar_numero(numero_marcado)
+            return {
+                'prefijo_id': None,
+                'zona_id': None,
+                'prefijo': 'UNKNOWN',
+                'zona_nombre': 'Desconocida',
+                'zona_descripcion': f'Número no reconocido: {numero_marcado} (longitud: {len(numero_limpio)})',
+                'tarifa_segundo': 0.0,
+                'tarifa_id': None,
+                'numero_valido': False
+            }
+
+        zona = self.zonas.get(entrada.zona_id)
+        zona_nombre = zona.nombre if zona else 'Desconocida'
+        zona_descripcion = zona.descripcion if zona else None
+        tarifa = self.tarifas.get(entrada.zona_id)
+
+        if tarifa is None:
+            return {
+                'prefijo_id': entrada.prefijo_id,
+                'zona_id': entrada.zona_id,
+                'prefijo': entrada.prefijo,
+                'zona_nombre': zona_nombre,
+                'zona_descripcion': f"Sin tarifa activa: {zona_descripcion}",
+                'tarifa_segundo': 0.0,
+                'tarifa_id': None,
+                'numero_valido': False
+            }
+
+        return {
+            'prefijo_id': entrada.prefijo_id,
+            'zona_id': entrada.zona_id,
+            'prefijo': entrada.prefijo,
+            'zona_nombre': zona_nombre,
+            'zona_descripcion': zona_descripcion,
+            'tarifa_segundo': float(tarifa.tarifa_segundo),
+            'tarifa_id': tarifa.id,
+            'numero_valido': True
+        }
+
+    @classmethod
+    def load(cls, db, version: int) -> "RatingSnapshot":
+        """Construye un snapshot leyendo prefixes, zones, rate_zones y rate_cards"""
+        prefijos = [
+            PrefixEntry(row[0], row[1], str(row[2]), row[3], row[3])
+            for row in db.execute(text("""
+                SELECT id, zone_id, prefix, prefix_length
+                FROM prefixes
+                ORDER BY prefix, id
+            """)).fetchall()
+        ]
+
+        zonas = {
+            row[0]: ZonaInfo(row[0], row[1], row[2])
+            for row in db.execute(text(
+                "SELECT id, zone_name, description FROM zones"
+            )).fetchall()
+        }
+
+        # Tarifa activa por zona: la habilitada más reciente (ORDER BY effective_from DESC LIMIT 1)
+        tarifas: Dict[int, TarifaInfo] = {}
+        for row in db.execute(text("""
+            SELECT id, zone_id, rate_per_minute, billing_increment, rate_per_call,
+                   effective_from, priority
+            FROM rate_zones
+            WHERE enabled = TRUE AND rate_per_minute IS NOT NULL
+            ORDER BY zone_id, effective_from DESC NULLS LAST, id DESC
+        """)).fetchall():
+            if row[1] in tarifas:
+                continue
+            tarifas[row[1]] = TarifaInfo(
+                id=row[0],
+                zona_id=row[1],
+                rate_per_minute=float(row[2]),
+                billing_increment=row[3] or 60,
+                rate_per_call=float(row[4] or 0),
+                effective_from=row[5],
+                priority=row[6] or 1,
+            )
+
+        # rate_cards vigentes, una por prefijo (mayor prioridad)
+        rate_cards: Dict[str, RateCardInfo] = {}
+        for row in db.execute(text("""
+            SELECT id, destination_prefix, destination_name, rate_per_minute,
+                   billing_increment, connection_fee, effective_start, effective_end, priority
+            FROM rate_cards
+            WHERE effective_start <= CURRENT_TIMESTAMP
+              AND (effective_end IS NULL OR effective_end > CURRENT_TIMESTAMP)
+            ORDER BY destination_prefix, priority DESC, effective_start DESC
+        """)).fetchall():
+            if row[1] in rate_cards:
+                continue
+            rate_cards[row[1]] = RateCardInfo(
+                id=row[0],
+                destination_prefix=row[1],
+                destination_name=row[2],
+                rate_per_minute=float(row[3] or 0),
+                billing_increment=row[4] or 1,
+                connection_fee=float(row[5] or 0),
+                effective_start=row[6],
+                effective_end=row[7],
+                priority=row[8] or 0,
+            )
+
+        return cls(version, prefijos, zonas, tarifas, rate_cards)
+
+
+class RatingSnapshotStore:
+    """
+    Puntero al snapshot publicado.
+
+    - `current()` solo lee una referencia: los lectores nunca esperan.
+    - `rebuild()` construye un snapshot nuevo y lo publica con un swap atómico.
+    - `schedule_rebuild()` lo hace en un hilo de fondo; varias ediciones
+      seguidas se agrupan en una sola reconstrucción.
+    """
+
+    def __init__(self, session_factory: Callable):
+        self._session_factory = session_factory
+        self._snapshot: Optional[RatingSnapshot] = None
+        self._version = 0
+        self._build_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._pending = False
+        self._worker_running = False
+
+    @property
+    def version(self) -> int:
+        snapshot = self._snapshot
+        return snapshot.version if snapshot else 0
+
+    def current(self) -> RatingSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.rebuild()
+        return snapshot
+
+    def rebuild(self, db=None) -> RatingSnapshot:
+        """Construye y publica un snapshot nuevo (síncrono)"""
+        with self._build_lock:
+            own_session = db is None
+            if own_session:
+                db = self._session_factory()
+            try:
+                inicio = datetime.now()
+                snapshot = RatingSnapshot.load(db, self._version + 1)
+            finally:
+                if own_session:
+                    db.close()
+
+            self._version = snapshot.version
+            self._snapshot = snapshot
+
+        duracion_ms = (datetime.now() - inicio).total_seconds() * 1000
+        logger.info(
+            f"Snapshot de tarificación v{snapshot.version} publicado: "
+            f"{len(snapshot.trie)} prefijos, {len(snapshot.zonas)} zonas, "
+            f"{len(snapshot.tarifas)} tarifas, {len(snapshot.rate_cards)} rate_cards "
+            f"({duracion_ms:.1f} ms)"
+        )
+        return snapshot
+
+    def schedule_rebuild(self) -> None:
+        """Programa una reconstrucción en segundo plano"""
+        with self._state_lock:
+            self._pending = True
+            if self._worker_running:
+                return
+            self._worker_running = True
+
+        threading.Thread(target=self._worker, name="rating-snapshot-rebuild", daemon=True).start()
+
+    def _worker(self) -> None:
+        while True:
+            with self._state_lock:
+                if not self._pending:
+                    self._worker_running = False
+                    return
+                self._pending = False
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.error(f"Error reconstruyendo snapshot de tarificación: {e}")
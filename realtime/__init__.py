@@ -0,0 +1,59 @@
+# realtime/__init__.py
+"""
+Módulo de tiempo real - Sistema Tarificador
+
+Llamadas activas en memoria para el monitoreo:
+- Registro autoritativo de llamadas activas con índices por extensión y dirección
+- Persistencia asíncrona por lotes a la tabla active_calls
+- Protocolo de deltas numerados para el WebSocket (call_added/updated/removed)
+- Broadcast agrupado por ticks: un frame serializado una vez por intervalo
+- Cola de salida acotada por conexión, con degradación a snapshot y expulsión de lentos
+- Duración y costo en vivo calculados en el servidor con un único timer
+- Depuración de llamadas huérfanas con una rueda de temporización
+- Bus de eventos entre workers (local, socket Unix o Redis) y réplica del registro
+- Suscripciones filtradas por conexión con índice invertido de predicados
+- Codificación opcional MessagePack (frames binarios compactos)
+
+Uso:
+    from realtime import ActiveCallRegistry, ActiveCallPersister
+    registry = ActiveCallRegistry()
+    persister = ActiveCallPersister(registry, AsyncSessionLocal)
+"""
+
+from .broadcaster import BroadcastScheduler, serializar
+from .bus import EventBus, RedisBus, UnixSocketBus, crear_bus
+from .connections import ConnectionManager, WSConnection
+from .encoding import JSON, MSGPACK, codificar, negociar
+from .protocol import PROTOCOL_VERSION, CallEventStream
+from .registry import ActiveCallPersister, ActiveCallRegistry, vista_cambios, vista_llamada
+from .reaper import StaleCallReaper
+from .replica import ActiveCallReplicator
+from .subscriptions import CallFilter, Subscription, SubscriptionIndex
+from .ticker import LiveCallTicker
+
+__all__ = [
+    "ActiveCallRegistry",
+    "ActiveCallPersister",
+    "BroadcastScheduler",
+    "CallEventStream",
+    "ConnectionManager",
+    "WSConnection",
+    "LiveCallTicker",
+    "StaleCallReaper",
+    "ActiveCallReplicator",
+    "EventBus",
+    "UnixSocketBus",
+    "RedisBus",
+    "crear_bus",
+    "CallFilter",
+    "Subscription",
+    "SubscriptionIndex",
+    "JSON",
+    "MSGPACK",
+    "codificar",
+    "negociar",
+    "PROTOCOL_VERSION",
+    "vista_cambios",
+    "serializar",
+    "vista_llamada",
+]
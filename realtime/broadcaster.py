@@ -0,0 +1,177 @@
+# realtime/broadcaster.py
+"""
+Broadcast agrupado por ticks para /ws.
+
+Los cambios del registro no se envían al llegar: se acumulan por call_id y
+cada `intervalo` segundos se emite un único frame con los deltas resultantes.
+Varios reportes de la misma llamada dentro de un tick se funden en un solo
+call_updated; una llamada que aparece y termina dentro del tick no se envía.
+El frame se serializa una vez y el mismo texto se reparte a todos los sockets:
+
+    {"type": "batch", "seq": n, "events": [delta, delta, ...]}
+
+Los deltas son idempotentes (call_added reemplaza, call_updated asigna
+campos, call_removed borra), así un cliente que recibió un snapshot con
+cambios aún no publicados puede aplicarlos de nuevo sin problema.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from .protocol import CallEventStream
+
+logger = logging.getLogger(__name__)
+
+_AGREGADA = "added"
+_ACTUALIZADA = "updated"
+_ELIMINADA = "removed"
+
+
+def serializar(mensaje: Dict) -> str:
+    return json.dumps(mensaje, separators=(",", ":"), default=str)
+
+
+class BroadcastScheduler:
+    """
+    Acumula cambios de llamadas y los publica cada `intervalo` segundos.
+
+    `enviar(texto, eventos)` reparte un frame ya serializado (los eventos van
+    aparte para las suscripciones filtradas) y devuelve a cuántas conexiones
+    se envió el frame compartido.
+    """
+
+    def __init__(self, stream: CallEventStream, enviar: Callable[[str, List[Dict]], Awaitable[int]],
+                 intervalo: float = 0.25):
+        self.stream = stream
+        self.enviar = enviar
+        self.intervalo = intervalo
+        self._pendientes: Dict[str, Tuple[str, Dict]] = {}
+        self._tarea: Optional[asyncio.Task] = None
+
+        self.cambios_recibidos = 0
+        self.eventos_emitidos = 0
+        self.frames = 0
+        self.bytes_enviados = 0
+        self.ultimo_flush_ms = 0.0
+        self._ventana: Deque[Tuple[float, int]] = deque()  # (instante, bytes) del último minuto
+
+    # ----- Acumulación -----
+
+    def agregada(self, call_id: str) -> None:
+        self.cambios_recibidos += 1
+        anterior = self._pendientes.get(call_id)
+        # Si terminó y volvió a aparecer dentro del tick, para el cliente es un reemplazo
+        if anterior is None or anterior[0] != _AGREGADA:
+            self._pendientes[call_id] = (_AGREGADA, {})
+
+    def actualizada(self, call_id: str, cambios: Dict) -> None:
+        if not cambios:
+            return
+        self.cambios_recibidos += 1
+        anterior = self._pendientes.get(call_id)
+        if anterior is None:
+            self._pendientes[call_id] = (_ACTUALIZADA, dict(cambios))
+        elif anterior[0] == _ACTUALIZADA:
+            anterior[1].update(cambios)
+        # Si ya está como agregada, el flush envía la llamada completa y vigente
+
+    def eliminada(self, call_id: str) -> None:
+        self.cambios_recibidos += 1
+        anterior = self._pendientes.get(call_id)
+        if anterior is not None and anterior[0] == _AGREGADA:
+            # Apareció y terminó dentro del mismo tick: nadie la vio
+            del self._pendientes[call_id]
+        else:
+            self._pendientes[call_id] = (_ELIMINADA, {})
+
+    def cambio(self, call_id: str, cambios: Dict, nueva: bool) -> None:
+        """Atajo para el resultado de `registry.upsert`"""
+        if nueva:
+            self.agregada(call_id)
+        else:
+            self.actualizada(call_id, cambios)
+
+    # ----- Publicación -----
+
+    def start(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error publicando cambios de llamadas activas: {e}")
+
+    def _construir_eventos(self) -> List[Dict]:
+        pendientes, self._pendientes = self._pendientes, {}
+        registry = self.stream.registry
+        eventos = []
+        for call_id, (tipo, cambios) in pendientes.items():
+            if tipo == _ELIMINADA:
+                eventos.append(self.stream.eliminada({"call_id": call_id}))
+                continue
+            llamada = registry.get(call_id)
+            if llamada is None:
+                continue  # Ya no está (p.ej. eliminada sin pasar por el scheduler)
+            if tipo == _AGREGADA:
+                eventos.append(self.stream.agregada(llamada))
+            else:
+                evento = self.stream.actualizada(call_id, cambios)
+                if evento is not None:
+                    eventos.append(evento)
+        return eventos
+
+    async def flush(self) -> int:
+        """Publica los cambios acumulados en un solo frame; devuelve la cantidad de eventos"""
+        if not self._pendientes:
+            return 0
+        inicio = time.perf_counter()
+        eventos = self._construir_eventos()
+        if not eventos:
+            return 0
+
+        texto = serializar({"type": "batch", "seq": self.stream.seq, "events": eventos})
+        conexiones = await self.enviar(texto, eventos)
+
+        self.eventos_emitidos += len(eventos)
+        self.frames += 1
+        enviados = len(texto.encode()) * conexiones
+        self.bytes_enviados += enviados
+        self._ventana.append((time.time(), enviados))
+        self.ultimo_flush_ms = round((time.perf_counter() - inicio) * 1000, 3)
+        return len(eventos)
+
+    # ----- Métricas -----
+
+    def _tasas(self) -> Tuple[float, float]:
+        limite = time.time() - 60
+        while self._ventana and self._ventana[0][0] < limite:
+            self._ventana.popleft()
+        return len(self._ventana) / 60, sum(b for _, b in self._ventana) / 60
+
+    def stats(self) -> Dict:
+        frames_s, bytes_s = self._tasas()
+        return {
+            "interval_ms": self.intervalo * 1000,
+            "pending_calls": len(self._pendientes),
+            "changes_received": self.cambios_recibidos,
+            "events_emitted": self.eventos_emitidos,
+            "coalescing_ratio": round(self.cambios_recibidos / self.eventos_emitidos, 3) if self.eventos_emitidos else None,
+            "frames": self.frames,
+            "bytes_sent": self.bytes_enviados,
+            "frames_per_second": round(frames_s, 3),
+            "bytes_per_second": round(bytes_s, 1),
+            "last_flush_ms": self.ultimo_flush_ms,
+            "sequence": self.stream.seq,
+        }
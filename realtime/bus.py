@@ -0,0 +1,403 @@
+# realtime/bus.py
+"""
+Bus de eventos entre procesos (pub/sub) para correr main.py con varios workers.
+
+Cada worker mantiene su propio registro de llamadas y sus propios clientes
+WebSocket. Lo que pasa en un worker (reporte de llamada, corte, cambio de
+saldo) se publica en el bus y los demás lo aplican localmente, así todos los
+dashboards ven todos los eventos.
+
+Implementaciones (EVENT_BUS_URL):
+
+    local (por defecto)          Un solo proceso: entrega directa a los suscriptores.
+    unix:///run/apolo/bus.sock   Varios workers en un mismo host. El que obtiene
+                                 el lock (bus.sock.lock) hace de broker y reenvía
+                                 cada mensaje a los demás; si se cae, otro toma
+                                 su lugar al reconectar.
+    redis://host:6379/0          Varios hosts. Requiere el paquete `redis`
+                                 (opcional, no está en requirements.txt).
+
+`es_lider` elige un único worker para las tareas que no deben repetirse en
+cada proceso (p. ej. depurar llamadas huérfanas): en Unix es el broker y en
+Redis quien renueva el lease `<prefijo>:lider`.
+
+`publicar()` no bloquea: entrega en el acto a los suscriptores locales y
+encola el envío remoto. Los mensajes son JSON de una línea con el canal y el
+origen (id del proceso), para que nadie procese su propio eco.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+Suscriptor = Callable[[Dict], None]
+
+
+class EventBus:
+    """Bus en proceso; base de las implementaciones entre procesos"""
+
+    tipo = "local"
+
+    def __init__(self, max_cola: int = 10000):
+        self.origen = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._suscriptores: Dict[str, List[Suscriptor]] = {}
+        self._al_conectar: List[Callable[[], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._salida: Optional["asyncio.Queue"] = None
+        self.max_cola = max_cola
+
+        self.publicados = 0
+        self.recibidos = 0
+        self.descartados = 0
+        self.errores = 0
+
+    # ----- API -----
+
+    def suscribir(self, canal: str, callback: Suscriptor) -> None:
+        self._suscriptores.setdefault(canal, []).append(callback)
+
+    def al_conectar(self, callback: Callable[[], None]) -> None:
+        """Se llama cada vez que el bus (re)conecta con los demás procesos"""
+        self._al_conectar.append(callback)
+
+    def publicar(self, canal: str, mensaje: Dict) -> None:
+        """Entrega local inmediata y envío remoto en segundo plano (desde el event loop)"""
+        self.publicados += 1
+        self._entregar(canal, mensaje)
+        if self._salida is None:
+            return
+        try:
+            self._salida.put_nowait(self._codificar(canal, mensaje))
+        except asyncio.QueueFull:
+            self.descartados += 1
+
+    def publicar_threadsafe(self, canal: str, mensaje: Dict) -> None:
+        """Para handlers sync que corren en el threadpool"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self.publicar, canal, mensaje)
+
+    @property
+    def es_lider(self) -> bool:
+        """Un solo proceso: siempre es el líder"""
+        return True
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self) -> None:
+        pass
+
+    # ----- Internos -----
+
+    def _codificar(self, canal: str, mensaje: Dict) -> str:
+        return json.dumps({"canal": canal, "origen": self.origen, "datos": mensaje},
+                          separators=(",", ":"), default=str)
+
+    def _entregar(self, canal: str, mensaje: Dict) -> None:
+        for callback in self._suscriptores.get(canal, ()):
+            try:
+                callback(mensaje)
+            except Exception as e:
+                self.errores += 1
+                logger.error(f"Error en suscriptor del canal {canal}: {e}")
+
+    def _recibir(self, texto: str) -> None:
+        """Mensaje de otro proceso"""
+        try:
+            sobre = json.loads(texto)
+        except ValueError:
+            self.errores += 1
+            return
+        if sobre.get("origen") == self.origen:
+            return
+        self.recibidos += 1
+        self._entregar(sobre.get("canal"), sobre.get("datos") or {})
+
+    def _conectado(self) -> None:
+        for callback in self._al_conectar:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error en callback de conexión del bus: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "type": self.tipo,
+            "origin": self.origen,
+            "published": self.publicados,
+            "received": self.recibidos,
+            "dropped": self.descartados,
+            "errors": self.errores,
+            "queue_depth": self._salida.qsize() if self._salida is not None else 0,
+        }
+
+
+class UnixSocketBus(EventBus):
+    """Broker sobre un socket Unix compartido por los workers de un host"""
+
+    tipo = "unix"
+
+    def __init__(self, ruta: str, max_cola: int = 10000, reconexion: float = 1.0):
+        super().__init__(max_cola)
+        self.ruta = ruta
+        self.reconexion = reconexion
+        self.es_broker = False
+        self._servidor: Optional[asyncio.AbstractServer] = None
+        self._clientes: Set[asyncio.StreamWriter] = set()
+        self._broker: Optional[asyncio.StreamWriter] = None
+        self._tareas: List[asyncio.Task] = []
+        self._lock_fd: Optional[int] = None
+        self.reconexiones = 0
+
+    @property
+    def es_lider(self) -> bool:
+        return self.es_broker
+
+    async def start(self) -> None:
+        await super().start()
+        self._salida = asyncio.Queue(maxsize=self.max_cola)
+        self._tareas = [
+            self._loop.create_task(self._mantener_conexion()),
+            self._loop.create_task(self._escritora()),
+        ]
+
+    async def stop(self) -> None:
+        for tarea in self._tareas:
+            tarea.cancel()
+        self._tareas = []
+        for writer in list(self._clientes) + ([self._broker] if self._broker else []):
+            writer.close()
+        if self._servidor is not None:
+            self._servidor.close()
+            try:
+                os.unlink(self.ruta)
+            except OSError:
+                pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # Libera el lock: otro worker pasa a ser broker
+            self._lock_fd = None
+        self.es_broker = False
+
+    async def _ser_broker(self) -> bool:
+        import fcntl  # Solo Unix
+        # Un solo broker: el lock se libera solo si el proceso muere
+        fd = os.open(self.ruta + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        try:
+            os.unlink(self.ruta)  # Socket huérfano de un broker anterior
+        except OSError:
+            pass
+        try:
+            self._servidor = await asyncio.start_unix_server(self._atender_cliente, path=self.ruta)
+        except OSError as e:
+            logger.error(f"Bus de eventos: no se pudo abrir {self.ruta}: {e}")
+            os.close(fd)
+            self._lock_fd = None
+            return False
+        self.es_broker = True
+        logger.info(f"Bus de eventos: broker en {self.ruta} (origen {self.origen})")
+        return True
+
+    async def _mantener_conexion(self) -> None:
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.ruta)
+            except (FileNotFoundError, ConnectionRefusedError):
+                # Nadie escucha: se intenta tomar el rol de broker
+                if await self._ser_broker():
+                    self._conectado()
+                    return
+                await asyncio.sleep(self.reconexion)
+                continue
+            except OSError as e:
+                logger.error(f"Bus de eventos: no se pudo conectar a {self.ruta}: {e}")
+                await asyncio.sleep(self.reconexion)
+                continue
+
+            self._broker = writer
+            self._conectado()
+            try:
+                while True:
+                    linea = await reader.readline()
+                    if not linea:
+                        break
+                    self._recibir(linea.decode())
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                self._broker = None
+                writer.close()
+            self.reconexiones += 1
+            logger.warning("Bus de eventos: se perdió el broker, reconectando")
+            await asyncio.sleep(self.reconexion)
+
+    async def _atender_cliente(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clientes.add(writer)
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                self._recibir(linea.decode())
+                self._reenviar(linea, excepto=writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clientes.discard(writer)
+            writer.close()
+
+    def _reenviar(self, linea: bytes, excepto: Optional[asyncio.StreamWriter] = None) -> None:
+        for writer in list(self._clientes):
+            if writer is excepto:
+                continue
+            if writer.transport.get_write_buffer_size() > 8 * 1024 * 1024:
+                # Worker que no lee: se lo desconecta en lugar de acumular memoria
+                logger.warning("Bus de eventos: cliente demasiado lento, desconectado")
+                self._clientes.discard(writer)
+                writer.close()
+                continue
+            writer.write(linea)
+
+    async def _escritora(self) -> None:
+        while True:
+            texto = await self._salida.get()
+            linea = (texto + "\n").encode()
+            if self.es_broker:
+                self._reenviar(linea)
+            elif self._broker is not None:
+                try:
+                    self._broker.write(linea)
+                    await self._broker.drain()
+                except (ConnectionError, RuntimeError):
+                    self.descartados += 1
+            else:
+                self.descartados += 1  # Sin broker (reconectando)
+
+    def stats(self) -> Dict:
+        return {
+            **super().stats(),
+            "path": self.ruta,
+            "broker": self.es_broker,
+            "peers": len(self._clientes) if self.es_broker else int(self._broker is not None),
+            "reconnects": self.reconexiones,
+        }
+
+
+class RedisBus(EventBus):
+    """Pub/sub de Redis, para workers en distintos hosts"""
+
+    tipo = "redis"
+
+    # Renueva el lease si es nuestro o lo toma si está libre (atómico en Redis)
+    LEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('pexpire', KEYS[1], ARGV[2])
+        end
+        if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+            return 1
+        end
+        return 0
+    """
+
+    def __init__(self, url: str, prefijo: str = "apolo", max_cola: int = 10000, lease: float = 15.0):
+        super().__init__(max_cola)
+        self.url = url
+        self.prefijo = prefijo
+        self.lease = lease
+        self._lider = False
+        self._redis = None
+        self._tareas: List[asyncio.Task] = []
+
+    @property
+    def es_lider(self) -> bool:
+        return self._lider
+
+    async def start(self) -> None:
+        try:
+            import redis.asyncio as redis_async
+        except ImportError:
+            raise RuntimeError("EVENT_BUS_URL usa Redis pero el paquete 'redis' no está instalado")
+        await super().start()
+        self._redis = redis_async.from_url(self.url)
+        self._salida = asyncio.Queue(maxsize=self.max_cola)
+        self._tareas = [
+            self._loop.create_task(self._escuchar()),
+            self._loop.create_task(self._escritora()),
+            self._loop.create_task(self._liderazgo()),
+        ]
+
+    async def stop(self) -> None:
+        for tarea in self._tareas:
+            tarea.cancel()
+        self._tareas = []
+        self._lider = False  # El lease vence solo y otro worker lo toma
+        if self._redis is not None:
+            await self._redis.close()
+
+    async def _liderazgo(self) -> None:
+        clave = f"{self.prefijo}:lider"
+        while True:
+            try:
+                renovado = await self._redis.eval(self.LEASE_SCRIPT, 1, clave, self.origen, int(self.lease * 1000))
+                if bool(renovado) != self._lider:
+                    logger.info(f"Bus de eventos Redis: {'líder' if renovado else 'deja de ser líder'} (origen {self.origen})")
+                self._lider = bool(renovado)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._lider = False  # Sin Redis no se puede garantizar un único líder
+                logger.error(f"Bus de eventos Redis: no se pudo renovar el liderazgo: {e}")
+            await asyncio.sleep(self.lease / 3)
+
+    async def _escuchar(self) -> None:
+        canal = f"{self.prefijo}:eventos"
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.subscribe(canal)
+                self._conectado()
+                async for mensaje in pubsub.listen():
+                    if mensaje.get("type") == "message":
+                        datos = mensaje["data"]
+                        self._recibir(datos.decode() if isinstance(datos, bytes) else datos)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errores += 1
+                logger.error(f"Bus de eventos Redis: {e}; reconectando")
+                await asyncio.sleep(1.0)
+
+    async def _escritora(self) -> None:
+        canal = f"{self.prefijo}:eventos"
+        while True:
+            texto = await self._salida.get()
+            try:
+                await self._redis.publish(canal, texto)
+            except Exception as e:
+                self.descartados += 1
+                logger.error(f"Bus de eventos Redis: no se pudo publicar: {e}")
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "url": self.url, "leader": self._lider}
+
+
+def crear_bus(url: Optional[str] = None) -> EventBus:
+    """Crea el bus según EVENT_BUS_URL: local, unix:///ruta.sock o redis://..."""
+    url = (url or "local").strip()
+    if url == "local":
+        return EventBus()
+    if url.startswith("unix://"):
+        return UnixSocketBus(url[len("unix://"):])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBus(url)
+    raise ValueError(f"EVENT_BUS_URL no soportada: {url}")
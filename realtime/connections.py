@@ -0,0 +1,313 @@
+# realtime/connections.py
+"""
+Conexiones WebSocket con cola de salida propia.
+
+Cada conexión tiene una cola acotada y una tarea escritora; el broadcast
+solo encola (no espera a ningún socket), así un navegador lento no demora
+a los demás. Si la cola de una conexión se llena:
+
+1. Se degrada a modo snapshot: se vacía la cola, se dejan de encolar
+   deltas y la escritora le envía un snapshot completo apenas pueda.
+2. Si se degrada más de `max_degradaciones` veces en un minuto, o un envío
+   tarda más que `timeout_envio`, se la desconecta (código 1013).
+
+Las conexiones con una suscripción filtrada (ver subscriptions.py) no reciben
+el frame compartido: reciben un frame propio con los deltas que les tocan.
+
+Cada conexión tiene su codificación (JSON o MessagePack, ver encoding.py);
+un frame compartido se codifica una sola vez por codificación en uso.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Union
+
+from starlette.websockets import WebSocket
+
+from .encoding import JSON, codificar
+from .subscriptions import CallFilter, Subscription, SubscriptionIndex
+
+logger = logging.getLogger(__name__)
+
+DELTA = "delta"
+SNAPSHOT = "snapshot"
+
+_ids = itertools.count(1)
+
+
+class WSConnection:
+    """Un cliente WebSocket con su cola de salida y contadores"""
+
+    def __init__(self, websocket: WebSocket, max_cola: int, codificacion: str = JSON):
+        self.id = next(_ids)
+        self.websocket = websocket
+        self.codificacion = codificacion
+        self.cola: "asyncio.Queue" = asyncio.Queue(maxsize=max_cola)
+        self.modo = DELTA
+        self.conectado_desde = time.time()
+        self.tarea: Optional[asyncio.Task] = None
+        self.cerrada = False
+        self.suscripcion: Optional[Subscription] = None
+
+        self.enviados = 0
+        self.bytes_enviados = 0
+        self.recibidos = 0
+        self.descartados = 0
+        self.degradaciones: Deque[float] = deque()
+        self.latencia_ms = 0.0       # EWMA de encolado -> enviado
+        self.latencia_max_ms = 0.0
+
+    def ofrecer(self, texto: Union[str, bytes]) -> bool:
+        """Encola sin esperar; False si la cola está llena"""
+        if self.cerrada or self.modo == SNAPSHOT:
+            self.descartados += 1
+            return True
+        try:
+            self.cola.put_nowait((time.perf_counter(), texto))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def degradar(self) -> int:
+        """Vacía la cola y pide un snapshot; devuelve las degradaciones del último minuto"""
+        while not self.cola.empty():
+            self.cola.get_nowait()
+            self.descartados += 1
+        self.modo = SNAPSHOT
+        self.cola.put_nowait(None)  # La escritora envía el snapshot al llegar a esta marca
+        ahora = time.time()
+        self.degradaciones.append(ahora)
+        while self.degradaciones and self.degradaciones[0] < ahora - 60:
+            self.degradaciones.popleft()
+        return len(self.degradaciones)
+
+    def registrar_envio(self, inicio: float, bytes_: int) -> None:
+        ms = (time.perf_counter() - inicio) * 1000
+        self.latencia_ms = ms if not self.enviados else self.latencia_ms * 0.9 + ms * 0.1
+        self.latencia_max_ms = max(self.latencia_max_ms, ms)
+        self.enviados += 1
+        self.bytes_enviados += bytes_
+
+    def stats(self) -> Dict:
+        cliente = self.websocket.client
+        return {
+            "id": self.id,
+            "client": f"{cliente.host}:{cliente.port}" if cliente else None,
+            "mode": self.modo,
+            "encoding": self.codificacion,
+            "filters": self.suscripcion.filtro.describir() if self.suscripcion else None,
+            "connected_seconds": round(time.time() - self.conectado_desde, 1),
+            "queue_depth": self.cola.qsize(),
+            "sent": self.enviados,
+            "bytes_sent": self.bytes_enviados,
+            "received": self.recibidos,
+            "dropped": self.descartados,
+            "downgrades_last_minute": len(self.degradaciones),
+            "latency_ms": round(self.latencia_ms, 3),
+            "latency_max_ms": round(self.latencia_max_ms, 3),
+        }
+
+
+class ConnectionManager:
+    """
+    Registro de conexiones y fan-out no bloqueante.
+
+    `snapshot()` devuelve el mensaje de snapshot (sin serializar); se usa
+    para reponer a las conexiones degradadas. `suscripciones` habilita los
+    filtros por conexión.
+    """
+
+    def __init__(self, snapshot: Callable[[], Dict], max_cola: int = 64,
+                 max_degradaciones: int = 3, timeout_envio: float = 10.0,
+                 suscripciones: Optional[SubscriptionIndex] = None):
+        self.snapshot = snapshot
+        self.suscripciones = suscripciones
+        self.max_cola = max_cola
+        self.max_degradaciones = max_degradaciones
+        self.timeout_envio = timeout_envio
+        self._conexiones: Dict[int, WSConnection] = {}
+        self._lock = asyncio.Lock()
+
+        self.total_conexiones = 0
+        self.expulsadas = 0
+        self.degradaciones = 0
+        self.desconectadas_con_pendientes = 0
+        self.frames_filtrados = 0
+        self.bytes_filtrados = 0
+        # Contadores acumulados de las conexiones ya cerradas
+        self._cerradas = {"sent": 0, "received": 0, "dropped": 0}
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._conexiones)
+
+    @property
+    def active_connections(self) -> List[WSConnection]:
+        return list(self._conexiones.values())
+
+    async def connect(self, websocket: WebSocket, codificacion: str = JSON) -> WSConnection:
+        await websocket.accept()
+        conexion = WSConnection(websocket, self.max_cola, codificacion)
+        async with self._lock:
+            self._conexiones[conexion.id] = conexion
+            self.total_conexiones += 1
+        conexion.tarea = asyncio.get_running_loop().create_task(self._escritora(conexion))
+        return conexion
+
+    async def disconnect(self, conexion: WSConnection) -> None:
+        async with self._lock:
+            if self._conexiones.pop(conexion.id, None) is None:
+                return
+        conexion.cerrada = True
+        if conexion.suscripcion is not None:
+            self.suscripciones.desuscribir(conexion.suscripcion)
+            conexion.suscripcion = None
+        self._cerradas["sent"] += conexion.enviados
+        self._cerradas["received"] += conexion.recibidos
+        self._cerradas["dropped"] += conexion.descartados
+        if not conexion.cola.empty():
+            self.desconectadas_con_pendientes += 1
+        if conexion.tarea is not None and conexion.tarea is not asyncio.current_task():
+            conexion.tarea.cancel()
+
+    async def _expulsar(self, conexion: WSConnection, motivo: str) -> None:
+        logger.warning(f"WebSocket {conexion.id} expulsado: {motivo}")
+        self.expulsadas += 1
+        await self.disconnect(conexion)
+        try:
+            await asyncio.wait_for(conexion.websocket.close(code=1013, reason=motivo), timeout=1.0)
+        except Exception:
+            pass
+
+    async def _escritora(self, conexion: WSConnection) -> None:
+        while True:
+            item = await conexion.cola.get()
+            if item is None:
+                # Snapshot construido justo antes de enviarlo: los deltas
+                # publicados desde ahora vuelven a encolarse detrás de él
+                inicio, texto = time.perf_counter(), self.snapshot_para(conexion)
+                conexion.modo = DELTA
+            else:
+                inicio, texto = item
+            if isinstance(texto, bytes):
+                envio, tamano = conexion.websocket.send_bytes(texto), len(texto)
+            else:
+                envio, tamano = conexion.websocket.send_text(texto), len(texto.encode())
+            try:
+                await asyncio.wait_for(envio, timeout=self.timeout_envio)
+            except asyncio.TimeoutError:
+                await self._expulsar(conexion, "envío demasiado lento")
+                return
+            except Exception:
+                await self.disconnect(conexion)
+                return
+            conexion.registrar_envio(inicio, tamano)
+
+    def send(self, conexion: WSConnection, texto: Union[str, bytes]) -> None:
+        """Respuesta a un solo cliente, por la misma cola (respeta el orden)"""
+        if not conexion.ofrecer(texto):
+            self._desbordada(conexion)
+
+    def responder(self, conexion: WSConnection, mensaje: Dict) -> None:
+        """Como `send`, codificando el mensaje según la conexión"""
+        self.send(conexion, codificar(mensaje, conexion.codificacion))
+
+    def _desbordada(self, conexion: WSConnection) -> None:
+        self.degradaciones += 1
+        if conexion.degradar() > self.max_degradaciones:
+            asyncio.get_running_loop().create_task(
+                self._expulsar(conexion, "consumidor lento")
+            )
+
+    # ----- Suscripciones -----
+
+    def suscribir(self, conexion: WSConnection, filtro: CallFilter) -> None:
+        """Reemplaza el filtro de la conexión y le envía el snapshot filtrado"""
+        if self.suscripciones is None:
+            raise RuntimeError("Suscripciones filtradas no habilitadas")
+        if conexion.suscripcion is not None:
+            self.suscripciones.desuscribir(conexion.suscripcion)
+        conexion.suscripcion = self.suscripciones.suscribir(conexion, filtro)
+        self.send(conexion, self.snapshot_para(conexion))
+
+    def desuscribir(self, conexion: WSConnection) -> None:
+        """Vuelve al stream completo y le envía el snapshot global"""
+        if conexion.suscripcion is not None:
+            self.suscripciones.desuscribir(conexion.suscripcion)
+            conexion.suscripcion = None
+        self.send(conexion, self.snapshot_para(conexion))
+
+    def snapshot_para(self, conexion: WSConnection) -> Union[str, bytes]:
+        if conexion.suscripcion is not None:
+            mensaje = self.suscripciones.snapshot(conexion.suscripcion)
+        else:
+            mensaje = self.snapshot()
+        return codificar(mensaje, conexion.codificacion)
+
+    # ----- Broadcast -----
+
+    def _difundir(self, conexiones: List[WSConnection], mensaje: Dict,
+                  codificados: Optional[Dict[str, Union[str, bytes]]] = None) -> int:
+        """Encola el mensaje sin esperar a ningún socket; se codifica una vez por codificación"""
+        codificados = codificados if codificados is not None else {}
+        for conexion in conexiones:
+            datos = codificados.get(conexion.codificacion)
+            if datos is None:
+                datos = codificados[conexion.codificacion] = codificar(mensaje, conexion.codificacion)
+            if not conexion.ofrecer(datos):
+                self._desbordada(conexion)
+        return len(conexiones)
+
+    async def broadcast(self, mensaje: Dict) -> int:
+        """A todas las conexiones sin filtro"""
+        return self._difundir([c for c in self._conexiones.values() if c.suscripcion is None], mensaje)
+
+    async def broadcast_extension(self, mensaje: Dict, extension: Optional[str]) -> int:
+        """Aviso de una extensión (p.ej. saldo): a los sin filtro y a los suscritos a esa extensión"""
+        conexiones = [
+            c for c in self._conexiones.values()
+            if c.suscripcion is None or c.suscripcion.filtro.extensiones is None
+            or extension in c.suscripcion.filtro.extensiones
+        ]
+        return self._difundir(conexiones, mensaje)
+
+    async def broadcast_lote(self, texto: str, eventos: List[Dict]) -> int:
+        """
+        Frame compartido para las conexiones sin filtro y un frame propio para
+        cada suscripción con deltas en este tick. Devuelve cuántas conexiones
+        recibieron el frame compartido.
+        """
+        frame = {"type": "batch", "seq": eventos[-1]["seq"], "events": eventos}
+        enviadas = self._difundir(
+            [c for c in self._conexiones.values() if c.suscripcion is None], frame, {JSON: texto}
+        )
+        if self.suscripciones is None:
+            return enviadas
+        for sub, eventos_sub in self.suscripciones.distribuir(eventos).items():
+            conexion = sub.conexion
+            datos = codificar({"type": "batch", "seq": sub.seq, "events": eventos_sub}, conexion.codificacion)
+            if not conexion.ofrecer(datos):
+                self._desbordada(conexion)
+            self.frames_filtrados += 1
+            self.bytes_filtrados += len(datos) if isinstance(datos, bytes) else len(datos.encode())
+        return enviadas
+
+    def stats(self) -> Dict:
+        conexiones = [c.stats() for c in self._conexiones.values()]
+        return {
+            "active_connections": len(conexiones),
+            "total_connections": self.total_conexiones,
+            "messages_sent": self._cerradas["sent"] + sum(c["sent"] for c in conexiones),
+            "messages_received": self._cerradas["received"] + sum(c["received"] for c in conexiones),
+            "dropped": self._cerradas["dropped"] + sum(c["dropped"] for c in conexiones),
+            "disconnected_with_pending": self.desconectadas_con_pendientes,
+            "downgrades": self.degradaciones,
+            "evicted": self.expulsadas,
+            "max_queue": self.max_cola,
+            "filtered_frames": self.frames_filtrados,
+            "filtered_bytes": self.bytes_filtrados,
+            "subscriptions": self.suscripciones.stats() if self.suscripciones is not None else None,
+            "connections": conexiones,
+        }
@@ -0,0 +1,94 @@
+# realtime/encoding.py
+"""
+Codificaciones de los mensajes de llamadas activas.
+
+    json     (por defecto) Texto, mismo formato de siempre.
+    msgpack  Frames binarios MessagePack, más chicos y más baratos de codificar:
+             - direction y status como enteros (ver DIRECCION_ENUM / ESTADO_ENUM)
+             - start_time / answer_time como epoch en milisegundos
+             - sin direction_display (el cliente lo arma a partir del enum)
+
+El cliente la elige al conectar: /ws?encoding=msgpack. Las APIs HTTP de
+llamadas activas la aceptan con `Accept: application/msgpack`. Si el
+paquete `msgpack` no está instalado se sigue usando JSON.
+
+static/js/msgpack-decoder.js decodifica los frames y los expande al formato JSON.
+"""
+import json
+from datetime import datetime
+from typing import Dict, List, Union
+
+try:
+    import msgpack
+except ImportError:  # Dependencia opcional: sin ella solo se ofrece JSON
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+MEDIA_TYPE_MSGPACK = "application/msgpack"
+
+DIRECCION_ENUM = {"unknown": 0, "inbound": 1, "outbound": 2, "internal": 3, "transit": 4}
+ESTADO_ENUM = {None: 0, "dialing": 1, "ringing": 2, "answered": 3}
+_FECHAS = ("start_time", "answer_time", "last_updated", "reaped_at", "timestamp")
+
+
+def msgpack_disponible() -> bool:
+    return msgpack is not None
+
+
+def negociar(pedida: str) -> str:
+    """Codificación a usar para lo que pidió el cliente"""
+    if (pedida or "").lower() == MSGPACK and msgpack is not None:
+        return MSGPACK
+    return JSON
+
+
+def _epoch_ms(valor):
+    if isinstance(valor, str):
+        valor = datetime.fromisoformat(valor)
+    return int(valor.timestamp() * 1000) if isinstance(valor, datetime) else valor
+
+
+def compactar_llamada(llamada: Dict) -> Dict:
+    """Vista (o cambios) de una llamada con enums enteros y fechas epoch"""
+    compacta = {}
+    for campo, valor in llamada.items():
+        if campo == "direction_display":
+            continue
+        if campo == "direction":
+            valor = DIRECCION_ENUM.get(valor, 0)
+        elif campo == "status":
+            # Estados fuera del enum (p.ej. causas de corte) viajan como texto
+            valor = ESTADO_ENUM.get(valor, valor)
+        elif campo in _FECHAS and valor is not None:
+            valor = _epoch_ms(valor)
+        compacta[campo] = valor
+    return compacta
+
+
+def compactar(mensaje: Dict) -> Dict:
+    """Aplica `compactar_llamada` a las llamadas de cualquier mensaje del protocolo"""
+    compacto = dict(mensaje)
+    if "active_calls" in mensaje:
+        compacto["active_calls"] = [compactar_llamada(c) for c in mensaje["active_calls"]]
+    if "call" in mensaje:
+        compacto["call"] = compactar_llamada(mensaje["call"])
+    if "changes" in mensaje:
+        compacto["changes"] = compactar_llamada(mensaje["changes"])
+    if "events" in mensaje:
+        compacto["events"] = [compactar(e) for e in mensaje["events"]]
+    if "timestamp" in mensaje:
+        compacto["timestamp"] = _epoch_ms(mensaje["timestamp"])
+    return compacto
+
+
+def codificar_llamadas(llamadas: List[Dict]) -> bytes:
+    """Lista de vistas de llamadas en MessagePack compacto (APIs HTTP)"""
+    return msgpack.packb([compactar_llamada(c) for c in llamadas], use_bin_type=True, default=str)
+
+
+def codificar(mensaje: Dict, codificacion: str = JSON) -> Union[str, bytes]:
+    """JSON como texto o MessagePack compacto como bytes"""
+    if codificacion == MSGPACK:
+        return msgpack.packb(compactar(mensaje), use_bin_type=True, default=str)
+    return json.dumps(mensaje, separators=(",", ":"), default=str)
@@ -0,0 +1,65 @@
+# realtime/protocol.py
+"""
+Protocolo de deltas del WebSocket de llamadas activas.
+
+En lugar de reenviar la lista completa en cada cambio, el servidor envía:
+
+    {"type": "snapshot", "seq": n, "active_calls": [...]}       al conectar / al pedir resync
+    {"type": "call_added", "seq": n, "call": {...}}
+    {"type": "call_updated", "seq": n, "call_id": "...", "changes": {...}}  solo campos cambiados
+    {"type": "call_removed", "seq": n, "call_id": "..."}
+
+Los deltas viajan agrupados en frames {"type": "batch", "seq": n, "events": [...]}
+(ver broadcaster.py). `seq` crece de a uno por cada delta. Un cliente que ve un salto en la
+secuencia envía {"action": "resync", "since": ultima_seq}: si los deltas
+siguen en el historial se reenvían, si no recibe un snapshot nuevo.
+"""
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from .registry import ActiveCallRegistry, vista_cambios, vista_llamada
+
+PROTOCOL_VERSION = 2
+
+
+class CallEventStream:
+    """Numera los deltas del registro y guarda los últimos `historial` para reenvío"""
+
+    def __init__(self, registry: ActiveCallRegistry, historial: int = 1000):
+        self.registry = registry
+        self.seq = 0
+        self._historial: Deque[Dict] = deque(maxlen=historial)
+
+    def _emitir(self, mensaje: Dict) -> Dict:
+        self.seq += 1
+        mensaje["seq"] = self.seq
+        self._historial.append(mensaje)
+        return mensaje
+
+    def agregada(self, llamada: Dict) -> Dict:
+        return self._emitir({"type": "call_added", "call": vista_llamada(llamada)})
+
+    def actualizada(self, call_id: str, cambios: Dict) -> Optional[Dict]:
+        vista = vista_cambios(cambios)
+        if not vista:  # Solo cambió last_updated: no hay nada que mostrar
+            return None
+        return self._emitir({"type": "call_updated", "call_id": call_id, "changes": vista})
+
+    def eliminada(self, llamada: Dict) -> Dict:
+        return self._emitir({"type": "call_removed", "call_id": llamada["call_id"]})
+
+    def snapshot(self) -> Dict:
+        return {
+            "type": "snapshot",
+            "protocol": PROTOCOL_VERSION,
+            "seq": self.seq,
+            "active_calls": self.registry.snapshot(),
+        }
+
+    def desde(self, seq: int) -> Optional[List[Dict]]:
+        """Deltas posteriores a `seq`, o None si ya no están en el historial"""
+        if seq >= self.seq:
+            return []
+        if not self._historial or self._historial[0]["seq"] > seq + 1:
+            return None
+        return [m for m in self._historial if m["seq"] > seq]
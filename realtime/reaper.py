@@ -0,0 +1,248 @@
+# realtime/reaper.py
+"""
+Depuración de llamadas activas huérfanas.
+
+Si se pierde el evento de corte, la llamada quedaría activa para siempre
+(en memoria, en la tabla active_calls, en cada snapshot del WebSocket).
+`StaleCallReaper` elimina las llamadas sin novedades durante un plazo:
+
+- `plazo` segundos desde `last_updated` para llamadas sin contestar.
+- `plazo_contestada` para las contestadas: con el ticker en vivo los
+  conectores ya no las reportan periódicamente, solo al cortar.
+
+Los vencimientos se guardan en una rueda de temporización (timing wheel):
+una ranura por `resolucion` segundos, con ranuras para el doble del plazo
+más largo (ver réplicas abajo). Cada tick solo recorre las ranuras que
+vencieron desde el anterior, así el costo no depende de cuántas llamadas
+haya en curso. Reprogramar una llamada (nuevo reporte) es O(1).
+
+Cada llamada depurada se publica como `call_removed` y se registra en
+`active_calls_reaped` para auditoría.
+
+Con varios workers cada uno programa todas las llamadas, pero las réplicas de
+otro worker vencen un plazo más tarde: normalmente las depura (y audita) su
+dueño y el resto recibe la baja por el bus; el plazo extra solo cubre el caso
+de que el dueño haya muerto. Las réplicas vencidas (dueño caído o filas sin
+origen cargadas al arrancar) las depura solo el worker líder del bus (`es_lider`),
+una vez; los demás las reprograman y reciben la baja por el bus.
+"""
+import asyncio
+import logging
+import math
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+from sqlalchemy import text
+
+from .broadcaster import BroadcastScheduler
+from .registry import ActiveCallRegistry, vista_llamada
+
+logger = logging.getLogger(__name__)
+
+
+class StaleCallReaper:
+    """Timing wheel de vencimientos por call_id; se usa solo desde el event loop"""
+
+    INSERT_SQL = text("""
+        INSERT INTO active_calls_reaped
+            (call_id, calling_number, called_number, direction, zone, start_time,
+             answer_time, last_updated, current_duration, current_cost, idle_seconds, reaped_at)
+        VALUES
+            (:call_id, :calling_number, :called_number, :direction, :zone, :start_time,
+             :answer_time, :last_updated, :current_duration, :current_cost, :idle_seconds, :reaped_at)
+    """)
+
+    def __init__(self, registry: ActiveCallRegistry, broadcaster: BroadcastScheduler,
+                 session_factory=None, plazo: float = 300, plazo_contestada: float = 14400,
+                 resolucion: float = 1.0, historial: int = 200,
+                 al_depurar: Optional[Callable[[str], None]] = None,
+                 es_lider: Optional[Callable[[], bool]] = None):
+        self.registry = registry
+        self.broadcaster = broadcaster
+        self.session_factory = session_factory
+        self.plazo = timedelta(seconds=plazo)
+        self.plazo_contestada = timedelta(seconds=plazo_contestada)
+        self.resolucion = resolucion
+        self.al_depurar = al_depurar
+        self.es_lider = es_lider
+
+        # Ranura i = vencimientos en [i*resolucion, (i+1)*resolucion) módulo el tamaño de la rueda
+        self._tamano = int(math.ceil(2 * max(plazo, plazo_contestada) / resolucion)) + 2
+        self._ranuras: List[Set[str]] = [set() for _ in range(self._tamano)]
+        self._ranura_de: Dict[str, int] = {}  # call_id -> índice absoluto de su ranura
+        self._cursor = self._indice(datetime.now())  # Próxima ranura a procesar
+        self._tarea: Optional[asyncio.Task] = None
+
+        self.recientes: Deque[Dict] = deque(maxlen=historial)
+        self._auditoria: Deque[Dict] = deque()  # Pendientes de escribir en la tabla
+        self.depuradas = 0
+        self.ultimo_tick_ms = 0.0
+        self.errores_auditoria = 0
+
+    def _indice(self, momento: datetime) -> int:
+        return int(momento.timestamp() // self.resolucion)
+
+    def vencimiento(self, llamada: Dict) -> datetime:
+        contestada = llamada.get("answer_time") or llamada.get("current_duration")
+        ultima = llamada.get("last_updated") or llamada.get("start_time") or datetime.now()
+        plazo = self.plazo_contestada if contestada else self.plazo
+        if not self.registry.es_propia(llamada):
+            plazo *= 2  # Réplica: la depura su dueño
+        return ultima + plazo
+
+    # ----- Programación -----
+
+    def tocar(self, call_id: str) -> None:
+        """(Re)programa el vencimiento de una llamada tras un reporte"""
+        llamada = self.registry.get(call_id)
+        if llamada is None:
+            self.olvidar(call_id)
+            return
+        self._programar(call_id, self.vencimiento(llamada))
+
+    def _programar(self, call_id: str, momento: datetime) -> None:
+        # Nunca antes del cursor (ya vencida: se procesa en el próximo tick) ni
+        # más allá de una vuelta de la rueda (se reprograma al llegar a la ranura)
+        indice = min(max(self._indice(momento), self._cursor),
+                     self._cursor + self._tamano - 1)
+        anterior = self._ranura_de.get(call_id)
+        if anterior == indice:
+            return
+        if anterior is not None:
+            self._ranuras[anterior % self._tamano].discard(call_id)
+        self._ranuras[indice % self._tamano].add(call_id)
+        self._ranura_de[call_id] = indice
+
+    def olvidar(self, call_id: str) -> None:
+        indice = self._ranura_de.pop(call_id, None)
+        if indice is not None:
+            self._ranuras[indice % self._tamano].discard(call_id)
+
+    def cargar(self) -> int:
+        """Programa todas las llamadas del registro (arranque)"""
+        n = 0
+        for llamada in self.registry.llamadas():
+            self.tocar(llamada["call_id"])
+            n += 1
+        return n
+
+    # ----- Depuración -----
+
+    def tick(self, ahora: Optional[datetime] = None) -> List[str]:
+        """Procesa las ranuras vencidas hasta `ahora`; devuelve los call_ids depurados"""
+        ahora = ahora or datetime.now()
+        hasta = self._indice(ahora)
+        if hasta < self._cursor:
+            return []
+        # Si el loop estuvo detenido más de una vuelta, basta con recorrer la rueda una vez
+        desde = max(self._cursor, hasta - self._tamano + 1)
+        self._cursor = hasta + 1
+
+        depuradas = []
+        for indice in range(desde, hasta + 1):
+            ranura = self._ranuras[indice % self._tamano]
+            if not ranura:
+                continue
+            for call_id in list(ranura):
+                ranura.discard(call_id)
+                self._ranura_de.pop(call_id, None)
+                llamada = self.registry.get(call_id)
+                if llamada is None:
+                    continue
+                if self.vencimiento(llamada) > ahora:
+                    self.tocar(call_id)  # Tuvo novedades o cayó en una vuelta posterior
+                    continue
+                if not self.registry.es_propia(llamada) and self.es_lider is not None and not self.es_lider():
+                    # Réplica vencida: la depura el líder; se revisa de nuevo por si cambia de líder
+                    self._programar(call_id, ahora + self.plazo)
+                    continue
+                self._depurar(llamada, ahora)
+                depuradas.append(call_id)
+        return depuradas
+
+    def _depurar(self, llamada: Dict, ahora: datetime) -> None:
+        call_id = llamada["call_id"]
+        ultima = llamada.get("last_updated") or llamada.get("start_time")
+        inactiva = int((ahora - ultima).total_seconds()) if ultima else None
+        self.registry.remove(call_id)
+        self.broadcaster.eliminada(call_id)
+        if self.al_depurar is not None:
+            self.al_depurar(call_id)
+        self.depuradas += 1
+
+        registro = {
+            "call_id": call_id,
+            "calling_number": llamada.get("calling_number"),
+            "called_number": llamada.get("called_number"),
+            "direction": llamada.get("direction"),
+            "zone": llamada.get("zone"),
+            "start_time": llamada.get("start_time"),
+            "answer_time": llamada.get("answer_time"),
+            "last_updated": ultima,
+            "current_duration": llamada.get("current_duration") or 0,
+            "current_cost": float(llamada.get("current_cost") or 0.0),
+            "idle_seconds": inactiva,
+            "reaped_at": ahora,
+        }
+        if self.session_factory is not None:
+            self._auditoria.append(registro)
+        self.recientes.append({
+            **vista_llamada(llamada),
+            "last_updated": ultima.isoformat() if ultima else None,
+            "idle_seconds": inactiva,
+            "reaped_at": ahora.isoformat(),
+        })
+        logger.warning(f"Llamada activa {call_id} depurada tras {inactiva}s sin novedades")
+
+    async def guardar_auditoria(self) -> None:
+        if not self._auditoria:
+            return
+        filas = list(self._auditoria)
+        self._auditoria.clear()
+        try:
+            async with self.session_factory() as db:
+                await db.execute(self.INSERT_SQL, filas)
+                await db.commit()
+        except Exception as e:
+            # Se reintenta en el próximo tick, sin crecer sin límite
+            self._auditoria.extendleft(reversed(filas[-self.recientes.maxlen:]))
+            self.errores_auditoria += 1
+            logger.error(f"Error registrando {len(filas)} llamadas depuradas: {e}")
+
+    # ----- Tarea -----
+
+    def start(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        await self.guardar_auditoria()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.resolucion)
+            inicio = loop.time()
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Error depurando llamadas activas: {e}")
+            self.ultimo_tick_ms = round((loop.time() - inicio) * 1000, 3)
+            await self.guardar_auditoria()
+
+    def stats(self) -> Dict:
+        return {
+            "tracked_calls": len(self._ranura_de),
+            "stale_after_seconds": self.plazo.total_seconds(),
+            "stale_after_answered_seconds": self.plazo_contestada.total_seconds(),
+            "resolution_seconds": self.resolucion,
+            "wheel_slots": self._tamano,
+            "reaped": self.depuradas,
+            "pending_audit": len(self._auditoria),
+            "audit_errors": self.errores_auditoria,
+            "last_tick_ms": self.ultimo_tick_ms,
+        }
@@ -0,0 +1,354 @@
+# realtime/registry.py
+"""
+Registro en memoria de las llamadas activas.
+
+Es la fuente de verdad mientras el proceso está vivo: POST/DELETE
+/api/active-calls modifican el registro y las lecturas (GET, snapshot del
+WebSocket) se sirven desde memoria, sin recorrer la tabla. La tabla
+`active_calls` se mantiene al día en segundo plano con `ActiveCallPersister`,
+por lotes, y se usa para reconstruir el registro al arrancar.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+CAMPOS = (
+    "call_id", "calling_number", "called_number", "direction", "zone",
+    "start_time", "last_updated", "current_duration", "current_cost", "connection_id",
+)
+# Solo en memoria (la tabla no tiene estas columnas): las usan el ticker en vivo
+# y, con varios workers, el bus de eventos (`origen` = worker dueño de la llamada)
+CAMPOS_MEMORIA = ("status", "answer_time", "rate_per_minute", "origen")
+# Campos que afectan a los índices
+_INDEXADOS = frozenset(("calling_number", "called_number", "direction", "connection_id", "answer_time"))
+
+DIRECCIONES = {
+    "inbound": "📱 Entrante",
+    "outbound": "📞 Saliente",
+    "internal": "🏢 Interna",
+    "transit": "🔄 Tránsito",
+}
+
+
+def vista_llamada(llamada: Dict) -> Dict:
+    """Formato JSON que esperan la API y los clientes WebSocket"""
+    direction = llamada.get("direction") or "unknown"
+    start_time = llamada.get("start_time")
+    answer_time = llamada.get("answer_time")
+    return {
+        "call_id": llamada["call_id"],
+        "calling_number": llamada.get("calling_number"),
+        "called_number": llamada.get("called_number"),
+        "direction": direction,
+        "direction_display": DIRECCIONES.get(direction, f"❓ {direction}"),
+        "start_time": start_time.isoformat() if start_time else None,
+        "current_duration": llamada.get("current_duration") or 0,
+        "current_cost": float(llamada.get("current_cost") or 0.0),
+        "zone": llamada.get("zone") or "Desconocida",
+        "connection_id": llamada.get("connection_id"),
+        "status": llamada.get("status"),
+        "answer_time": answer_time.isoformat() if answer_time else None,
+    }
+
+
+def vista_cambios(cambios: Dict) -> Dict:
+    """Solo los campos cambiados, en el mismo formato que `vista_llamada`"""
+    vista = {}
+    for campo, valor in cambios.items():
+        if campo in ("last_updated", "rate_per_minute", "origen"):
+            continue
+        if campo in ("start_time", "answer_time"):
+            valor = valor.isoformat() if valor else None
+        elif campo == "current_cost":
+            valor = float(valor or 0.0)
+        elif campo == "direction":
+            valor = valor or "unknown"
+            vista["direction_display"] = DIRECCIONES.get(valor, f"❓ {valor}")
+        vista[campo] = valor
+    return vista
+
+
+class ActiveCallRegistry:
+    """
+    Dict de llamadas por call_id con índices por extensión (origen y destino),
+    por dirección y por connection_id. No es thread-safe: se usa solo desde el
+    event loop.
+
+    `origen` identifica al worker: las llamadas que se reportaron en él son
+    propias; las demás son réplicas recibidas por el bus de eventos.
+
+    Las filas cargadas de la tabla al arrancar no traen dueño: con un solo
+    worker se adoptan (`adoptar_cargadas`); con varios quedan como réplicas
+    sin origen, así ningún worker las republica ni las depura como propias
+    (ver `StaleCallReaper`).
+    """
+
+    def __init__(self, origen: Optional[str] = None, adoptar_cargadas: bool = True):
+        self.origen = origen
+        self.adoptar_cargadas = adoptar_cargadas
+        self._llamadas: Dict[str, Dict] = {}
+        self._por_extension: Dict[str, Set[str]] = defaultdict(set)
+        self._por_direccion: Dict[str, Set[str]] = defaultdict(set)
+        self._por_connection: Dict[str, str] = {}
+        self._en_curso: Set[str] = set()  # Contestadas: duración y costo los calcula el servidor
+        # Cambios pendientes de persistir (conjuntos disjuntos)
+        self._sucias: Set[str] = set()
+        self._eliminadas: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._llamadas)
+
+    def __contains__(self, call_id: str) -> bool:
+        return call_id in self._llamadas
+
+    # ----- Índices -----
+
+    def _indexar(self, llamada: Dict) -> None:
+        call_id = llamada["call_id"]
+        for extension in (llamada.get("calling_number"), llamada.get("called_number")):
+            if extension:
+                self._por_extension[extension].add(call_id)
+        self._por_direccion[llamada.get("direction") or "unknown"].add(call_id)
+        if llamada.get("connection_id"):
+            self._por_connection[llamada["connection_id"]] = call_id
+        if llamada.get("answer_time"):
+            self._en_curso.add(call_id)
+
+    def _desindexar(self, llamada: Dict) -> None:
+        call_id = llamada["call_id"]
+        for extension in (llamada.get("calling_number"), llamada.get("called_number")):
+            ids = self._por_extension.get(extension)
+            if ids is not None:
+                ids.discard(call_id)
+                if not ids:
+                    del self._por_extension[extension]
+        ids = self._por_direccion.get(llamada.get("direction") or "unknown")
+        if ids is not None:
+            ids.discard(call_id)
+        if self._por_connection.get(llamada.get("connection_id")) == call_id:
+            del self._por_connection[llamada["connection_id"]]
+        self._en_curso.discard(call_id)
+
+    # ----- Escritura -----
+
+    def upsert(self, datos: Dict, persistir: bool = True) -> Tuple[Dict, Dict]:
+        """
+        Inserta o reemplaza una llamada. Devuelve (llamada, cambios), donde
+        `cambios` son los campos que cambiaron (todos si la llamada es nueva).
+        """
+        call_id = datos["call_id"]
+        anterior = self._llamadas.get(call_id)
+        llamada = {campo: datos.get(campo) for campo in CAMPOS + CAMPOS_MEMORIA}
+        llamada["origen"] = llamada["origen"] or self.origen
+
+        if anterior is None:
+            cambios = dict(llamada)
+        else:
+            cambios = {k: v for k, v in llamada.items() if anterior.get(k) != v}
+            self._desindexar(anterior)
+
+        self._llamadas[call_id] = llamada
+        self._indexar(llamada)
+        self._eliminadas.discard(call_id)
+        if persistir:
+            self._sucias.add(call_id)
+        return llamada, cambios
+
+    def actualizar(self, call_id: str, campos: Dict, persistir: bool = True) -> Dict:
+        """
+        Modifica algunos campos de una llamada existente; devuelve los que
+        cambiaron. Con persistir=False el cambio queda solo en memoria hasta
+        la próxima modificación persistida.
+        """
+        llamada = self._llamadas.get(call_id)
+        if llamada is None:
+            return {}
+        cambios = {k: v for k, v in campos.items() if llamada.get(k) != v}
+        if cambios:
+            reindexar = not _INDEXADOS.isdisjoint(cambios)
+            if reindexar:
+                self._desindexar(llamada)
+            llamada.update(cambios)
+            if reindexar:
+                self._indexar(llamada)
+            if persistir:
+                self._sucias.add(call_id)
+        return cambios
+
+    def resolver_id(self, call_id: str) -> Optional[str]:
+        """Busca por call_id y, si no está, por connection_id"""
+        if call_id in self._llamadas:
+            return call_id
+        return self._por_connection.get(call_id)
+
+    def remove(self, call_id: str, persistir: bool = True) -> Optional[Dict]:
+        """Elimina por call_id o connection_id; devuelve la llamada eliminada"""
+        call_id = self.resolver_id(call_id)
+        if call_id is None:
+            return None
+        llamada = self._llamadas.pop(call_id)
+        self._desindexar(llamada)
+        self._sucias.discard(call_id)
+        if persistir:
+            self._eliminadas.add(call_id)
+        return llamada
+
+    def cargar(self, filas: Iterable[Dict]) -> int:
+        """Carga las llamadas persistidas (arranque); no quedan pendientes de persistir"""
+        n = 0
+        for fila in filas:
+            llamada = {campo: fila.get(campo) for campo in CAMPOS + CAMPOS_MEMORIA}
+            if self.adoptar_cargadas:
+                llamada["origen"] = self.origen
+            self._llamadas[llamada["call_id"]] = llamada
+            self._indexar(llamada)
+            n += 1
+        return n
+
+    # ----- Lectura -----
+
+    def get(self, call_id: str) -> Optional[Dict]:
+        return self._llamadas.get(call_id)
+
+    def llamadas(self, extension: Optional[str] = None, direction: Optional[str] = None) -> List[Dict]:
+        """Llamadas (más recientes primero), filtradas por los índices"""
+        if extension is None and direction is None:
+            ids = self._llamadas.keys()
+        else:
+            ids = None
+            if extension is not None:
+                ids = set(self._por_extension.get(extension, ()))
+            if direction is not None:
+                por_dir = self._por_direccion.get(direction, set())
+                ids = por_dir if ids is None else ids & por_dir
+        llamadas = [self._llamadas[i] for i in ids]
+        llamadas.sort(key=lambda c: c.get("start_time") or datetime.min, reverse=True)
+        return llamadas
+
+    def snapshot(self, **filtros) -> List[Dict]:
+        return [vista_llamada(c) for c in self.llamadas(**filtros)]
+
+    def es_propia(self, llamada: Dict) -> bool:
+        """Reportada en este worker (o cargada de la tabla con un solo worker)"""
+        return llamada.get("origen") == self.origen
+
+    def en_curso(self) -> List[str]:
+        """call_ids de las llamadas contestadas"""
+        return list(self._en_curso)
+
+    def conteo_por_direccion(self) -> Dict[str, int]:
+        return {d: len(ids) for d, ids in self._por_direccion.items() if ids}
+
+    # ----- Persistencia -----
+
+    def tomar_pendientes(self) -> Tuple[List[Dict], List[str]]:
+        """Cambios acumulados desde la última llamada: (filas a upsert, call_ids a borrar)"""
+        upserts = [
+            {campo: self._llamadas[i][campo] for campo in CAMPOS}
+            for i in self._sucias if i in self._llamadas
+        ]
+        borrados = list(self._eliminadas)
+        self._sucias.clear()
+        self._eliminadas.clear()
+        return upserts, borrados
+
+    def devolver_pendientes(self, upserts: List[Dict], borrados: List[str]) -> None:
+        """Un lote no se pudo persistir: se reintenta sin pisar cambios más nuevos"""
+        for fila in upserts:
+            call_id = fila["call_id"]
+            if call_id in self._llamadas and call_id not in self._eliminadas:
+                self._sucias.add(call_id)
+        for call_id in borrados:
+            if call_id not in self._llamadas:
+                self._eliminadas.add(call_id)
+
+    @property
+    def pendientes(self) -> int:
+        return len(self._sucias) + len(self._eliminadas)
+
+
+class ActiveCallPersister:
+    """Tarea asyncio que vuelca los cambios del registro a `active_calls` cada `intervalo` segundos"""
+
+    UPSERT_SQL = text(f"""
+        INSERT INTO active_calls ({", ".join(CAMPOS)})
+        VALUES ({", ".join(":" + c for c in CAMPOS)})
+        ON CONFLICT (call_id) DO UPDATE SET
+        {", ".join(f"{c} = EXCLUDED.{c}" for c in CAMPOS if c != "call_id")}
+    """)
+    DELETE_SQL = text("DELETE FROM active_calls WHERE call_id = ANY(:call_ids)")
+
+    def __init__(self, registry: ActiveCallRegistry, session_factory, intervalo: float = 1.0):
+        self.registry = registry
+        self.session_factory = session_factory
+        self.intervalo = intervalo
+        self._tarea: Optional[asyncio.Task] = None
+
+        self.lotes = 0
+        self.filas_escritas = 0
+        self.filas_borradas = 0
+        self.errores = 0
+        self.ultimo_error: Optional[str] = None
+
+    async def cargar(self) -> int:
+        """Reconstruye el registro desde la tabla"""
+        async with self.session_factory() as db:
+            filas = (await db.execute(
+                text(f"SELECT {', '.join(CAMPOS)} FROM active_calls")
+            )).mappings().all()
+        return self.registry.cargar(filas)
+
+    def start(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.intervalo)
+            await self.flush()
+
+    async def flush(self) -> None:
+        upserts, borrados = self.registry.tomar_pendientes()
+        if not upserts and not borrados:
+            return
+        try:
+            async with self.session_factory() as db:
+                if borrados:
+                    await db.execute(self.DELETE_SQL, {"call_ids": borrados})
+                if upserts:
+                    await db.execute(self.UPSERT_SQL, upserts)
+                await db.commit()
+        except Exception as e:
+            self.registry.devolver_pendientes(upserts, borrados)
+            self.errores += 1
+            self.ultimo_error = str(e)
+            logger.error(f"Error persistiendo {len(upserts)} llamadas activas / {len(borrados)} borrados: {e}")
+            return
+        self.lotes += 1
+        self.filas_escritas += len(upserts)
+        self.filas_borradas += len(borrados)
+
+    def stats(self) -> Dict:
+        return {
+            "active_calls": len(self.registry),
+            "by_direction": self.registry.conteo_por_direccion(),
+            "pending_changes": self.registry.pendientes,
+            "flush_interval_seconds": self.intervalo,
+            "batches": self.lotes,
+            "rows_written": self.filas_escritas,
+            "rows_deleted": self.filas_borradas,
+            "errors": self.errores,
+            "last_error": self.ultimo_error,
+        }
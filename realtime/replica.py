@@ -0,0 +1,107 @@
+# realtime/replica.py
+"""
+Réplica del registro de llamadas activas entre workers, sobre el bus de eventos.
+
+El worker que recibe un reporte actualiza su registro, lo persiste y publica
+el estado completo de la llamada en el canal `active_calls`. Los demás lo
+aplican a su registro sin persistir y lo publican a sus propios clientes
+WebSocket con su propia secuencia de deltas. Al (re)conectar con el bus,
+cada worker republica sus llamadas propias para poner al día a los demás.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+from .broadcaster import BroadcastScheduler
+from .bus import EventBus
+from .reaper import StaleCallReaper
+from .registry import CAMPOS, CAMPOS_MEMORIA, ActiveCallRegistry
+from .ticker import LiveCallTicker
+
+logger = logging.getLogger(__name__)
+
+CANAL = "active_calls"
+_FECHAS = ("start_time", "last_updated", "answer_time")
+
+
+def _a_mensaje(llamada: Dict) -> Dict:
+    return {
+        campo: (valor.isoformat() if isinstance(valor, datetime) else valor)
+        for campo, valor in llamada.items()
+    }
+
+
+def _de_mensaje(datos: Dict) -> Dict:
+    llamada = {campo: datos.get(campo) for campo in CAMPOS + CAMPOS_MEMORIA if campo in datos}
+    for campo in _FECHAS:
+        if isinstance(llamada.get(campo), str):
+            llamada[campo] = datetime.fromisoformat(llamada[campo])
+    return llamada
+
+
+class ActiveCallReplicator:
+    """Publica los cambios locales del registro y aplica los de otros workers"""
+
+    def __init__(self, bus: EventBus, registry: ActiveCallRegistry, broadcaster: BroadcastScheduler,
+                 ticker: Optional[LiveCallTicker] = None, reaper: Optional[StaleCallReaper] = None):
+        self.bus = bus
+        self.registry = registry
+        self.broadcaster = broadcaster
+        self.ticker = ticker
+        self.reaper = reaper
+        self.aplicados = 0
+        bus.suscribir(CANAL, self._aplicar)
+        bus.al_conectar(self.republicar)
+
+    # ----- Salida -----
+
+    def publicar(self, call_id: str) -> None:
+        llamada = self.registry.get(call_id)
+        if llamada is not None:
+            self.bus.publicar(CANAL, {"op": "upsert", "emisor": self.bus.origen,
+                                      "call": _a_mensaje(llamada)})
+
+    def eliminada(self, call_id: str) -> None:
+        self.bus.publicar(CANAL, {"op": "remove", "emisor": self.bus.origen, "call_id": call_id})
+
+    def republicar(self) -> None:
+        for llamada in self.registry.llamadas():
+            if self.registry.es_propia(llamada):
+                self.publicar(llamada["call_id"])
+
+    # ----- Entrada -----
+
+    def _aplicar(self, mensaje: Dict) -> None:
+        if mensaje.get("emisor") == self.bus.origen:
+            return  # Entrega local de lo que publicó este mismo worker
+        self.aplicados += 1
+        if mensaje.get("op") == "remove":
+            llamada = self.registry.remove(mensaje["call_id"], persistir=False)
+            if llamada is not None:
+                if self.reaper is not None:
+                    self.reaper.olvidar(llamada["call_id"])
+                self.broadcaster.eliminada(llamada["call_id"])
+            return
+
+        datos = _de_mensaje(mensaje["call"])
+        call_id = datos["call_id"]
+        if call_id not in self.registry:
+            _, cambios = self.registry.upsert(datos, persistir=False)
+            nueva = True
+        else:
+            # La duración y el costo en vivo los calcula el ticker de cada worker
+            if self.registry.get(call_id).get("answer_time"):
+                for campo in ("current_duration", "current_cost"):
+                    datos.pop(campo, None)
+            cambios = self.registry.actualizar(call_id, datos, persistir=False)
+            nueva = False
+
+        llamada = self.registry.get(call_id)
+        if self.ticker is not None and llamada.get("answer_time") and llamada.get("rate_per_minute") is None:
+            cambios.update(self.ticker.contestada(call_id))
+        if self.reaper is not None:
+            self.reaper.tocar(call_id)
+        self.broadcaster.cambio(call_id, cambios, nueva)
+
+    def stats(self) -> Dict:
+        return {**self.bus.stats(), "applied": self.aplicados}
@@ -0,0 +1,296 @@
+# realtime/subscriptions.py
+"""
+Suscripciones filtradas de /ws.
+
+Un cliente puede enviar:
+
+    {"action": "subscribe", "filters": {
+        "extensions": ["1001", "1002"],
+        "area_nivel1": "Ventas", "area_nivel2": "...", "area_nivel3": "...",
+        "direction": ["outbound"], "zone": ["Celular"], "min_cost": 0.5
+    }}
+
+Las áreas se resuelven una sola vez (al suscribirse) a la lista de anexos del
+área, así el filtro queda compilado a un predicado sobre campos de la llamada.
+Cada suscripción se indexa por su dimensión más selectiva (extensión, zona o
+dirección) y por cada evento solo se evalúan las suscripciones de los
+buckets que tocan la llamada: el costo crece con los suscriptores que
+coinciden, no con el total de conexiones.
+
+Un filtro inválido (p.ej. "min_cost": "abc") se rechaza con
+{"type": "subscribe_error", "error": "...", "filters": <filtro vigente o null>}
+y la conexión conserva su suscripción anterior.
+
+Una conexión suscrita recibe solo las llamadas que cumplen el filtro, con su
+propia secuencia. Si una llamada empieza a cumplirlo (p.ej. su costo supera
+min_cost) le llega como call_added; si deja de cumplirlo, como call_removed.
+"""
+import logging
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from .registry import ActiveCallRegistry, vista_llamada
+
+logger = logging.getLogger(__name__)
+
+DIRECCIONES_VALIDAS = frozenset(("inbound", "outbound", "internal", "transit", "unknown"))
+_CLAVES_LISTA = ("extensions", "direction", "zone")
+_CLAVES_AREA = ("area_nivel1", "area_nivel2", "area_nivel3")
+
+
+def _conjunto(valor) -> Optional[frozenset]:
+    if valor is None or valor == "" or valor == []:
+        return None
+    if isinstance(valor, (list, tuple, set)):
+        return frozenset(str(v) for v in valor if v not in (None, ""))
+    return frozenset((str(valor),))
+
+
+class CallFilter:
+    """Filtro compilado; None en una dimensión significa "cualquiera" """
+
+    def __init__(self, extensiones: Optional[Iterable[str]] = None,
+                 direcciones: Optional[Iterable[str]] = None,
+                 zonas: Optional[Iterable[str]] = None,
+                 costo_minimo: Optional[float] = None):
+        self.extensiones = frozenset(extensiones) if extensiones is not None else None
+        self.direcciones = frozenset(direcciones) if direcciones is not None else None
+        self.zonas = frozenset(zonas) if zonas is not None else None
+        self.costo_minimo = float(costo_minimo) if costo_minimo is not None else None
+        self.coincide = self._compilar()
+
+    @staticmethod
+    def validar(filtros) -> None:
+        """Lanza ValueError con un mensaje para el cliente si los filtros no son válidos"""
+        if not isinstance(filtros, dict):
+            raise ValueError("filters debe ser un objeto")
+        for clave in _CLAVES_LISTA:
+            valor = filtros.get(clave)
+            valores = valor if isinstance(valor, (list, tuple)) else [valor]
+            if any(v is not None and not isinstance(v, (str, int)) for v in valores):
+                raise ValueError(f"{clave} debe ser un texto o una lista de textos")
+        direcciones = _conjunto(filtros.get("direction"))
+        if direcciones is not None and not direcciones <= DIRECCIONES_VALIDAS:
+            raise ValueError(f"direction no válida: {sorted(direcciones - DIRECCIONES_VALIDAS)}")
+        for clave in _CLAVES_AREA:
+            if filtros.get(clave) not in (None, "") and not isinstance(filtros[clave], str):
+                raise ValueError(f"{clave} debe ser un texto")
+        min_cost = filtros.get("min_cost")
+        if min_cost not in (None, ""):
+            if isinstance(min_cost, bool):
+                raise ValueError("min_cost debe ser un número")
+            try:
+                valor = float(min_cost)
+            except (TypeError, ValueError):
+                raise ValueError("min_cost debe ser un número")
+            if not math.isfinite(valor) or valor < 0:
+                raise ValueError("min_cost debe ser un número mayor o igual a 0")
+
+    @classmethod
+    def desde_mensaje(cls, filtros: Dict, extensiones_area: Optional[Iterable[str]] = None) -> "CallFilter":
+        """
+        `extensiones_area`: anexos de las áreas pedidas, ya resueltos (None si no
+        se pidió área). Con extensiones y áreas a la vez se usa la intersección.
+        Lanza ValueError si los filtros no son válidos (ver `validar`).
+        """
+        cls.validar(filtros)
+        extensiones = _conjunto(filtros.get("extensions"))
+        if extensiones_area is not None:
+            area = frozenset(extensiones_area)
+            extensiones = area if extensiones is None else extensiones & area
+        min_cost = filtros.get("min_cost")
+        return cls(
+            extensiones=extensiones,
+            direcciones=_conjunto(filtros.get("direction")),
+            zonas=_conjunto(filtros.get("zone")),
+            costo_minimo=float(min_cost) if min_cost not in (None, "") else None,
+        )
+
+    def _compilar(self) -> Callable[[Dict], bool]:
+        """Predicado con solo las comparaciones necesarias"""
+        chequeos: List[Callable[[Dict], bool]] = []
+        if self.extensiones is not None:
+            ext = self.extensiones
+            chequeos.append(lambda c: c.get("calling_number") in ext or c.get("called_number") in ext)
+        if self.direcciones is not None:
+            dirs = self.direcciones
+            chequeos.append(lambda c: (c.get("direction") or "unknown") in dirs)
+        if self.zonas is not None:
+            zonas = self.zonas
+            chequeos.append(lambda c: (c.get("zone") or "Desconocida") in zonas)
+        if self.costo_minimo is not None:
+            minimo = self.costo_minimo
+            chequeos.append(lambda c: float(c.get("current_cost") or 0.0) >= minimo)
+        if not chequeos:
+            return lambda c: True
+        if len(chequeos) == 1:
+            return chequeos[0]
+        return lambda c: all(chequeo(c) for chequeo in chequeos)
+
+    def describir(self) -> Dict:
+        return {
+            "extensions": sorted(self.extensiones) if self.extensiones is not None else None,
+            "direction": sorted(self.direcciones) if self.direcciones is not None else None,
+            "zone": sorted(self.zonas) if self.zonas is not None else None,
+            "min_cost": self.costo_minimo,
+        }
+
+
+class Subscription:
+    """Filtro de una conexión, con su secuencia y las llamadas que ya vio"""
+
+    def __init__(self, conexion, filtro: CallFilter):
+        self.conexion = conexion
+        self.filtro = filtro
+        self.seq = 0
+        self.visibles: Set[str] = set()
+        self.eventos = 0
+
+
+class SubscriptionIndex:
+    """Índice invertido de suscripciones por extensión, zona y dirección"""
+
+    def __init__(self, registry: ActiveCallRegistry):
+        self.registry = registry
+        self._por_extension: Dict[str, Set[Subscription]] = {}
+        self._por_zona: Dict[str, Set[Subscription]] = {}
+        self._por_direccion: Dict[str, Set[Subscription]] = {}
+        self._resto: Set[Subscription] = set()
+        self._visibles_por_llamada: Dict[str, Set[Subscription]] = {}
+        self.evaluaciones = 0
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._todas())
+
+    def _todas(self) -> Set[Subscription]:
+        todas = set(self._resto)
+        for indice in (self._por_extension, self._por_zona, self._por_direccion):
+            for subs in indice.values():
+                todas |= subs
+        return todas
+
+    def _buckets(self, filtro: CallFilter):
+        """(índice, claves) de la dimensión más selectiva del filtro"""
+        if filtro.extensiones is not None:
+            return self._por_extension, filtro.extensiones
+        if filtro.zonas is not None:
+            return self._por_zona, filtro.zonas
+        if filtro.direcciones is not None:
+            return self._por_direccion, filtro.direcciones
+        return None, ()
+
+    # ----- Alta / baja -----
+
+    def suscribir(self, conexion, filtro: CallFilter) -> Subscription:
+        sub = Subscription(conexion, filtro)
+        indice, claves = self._buckets(filtro)
+        if indice is None:
+            self._resto.add(sub)
+        for clave in claves:
+            indice.setdefault(clave, set()).add(sub)
+
+        # Llamadas actuales que cumplen el filtro, usando los índices del registro
+        if filtro.extensiones is not None:
+            candidatas = {}
+            for extension in filtro.extensiones:
+                for llamada in self.registry.llamadas(extension=extension):
+                    candidatas[llamada["call_id"]] = llamada
+            candidatas = candidatas.values()
+        else:
+            candidatas = self.registry.llamadas()
+        for llamada in candidatas:
+            if filtro.coincide(llamada):
+                sub.visibles.add(llamada["call_id"])
+                self._visibles_por_llamada.setdefault(llamada["call_id"], set()).add(sub)
+        return sub
+
+    def desuscribir(self, sub: Subscription) -> None:
+        indice, claves = self._buckets(sub.filtro)
+        if indice is None:
+            self._resto.discard(sub)
+        for clave in claves:
+            subs = indice.get(clave)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del indice[clave]
+        for call_id in sub.visibles:
+            subs = self._visibles_por_llamada.get(call_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._visibles_por_llamada[call_id]
+        sub.visibles.clear()
+
+    def snapshot(self, sub: Subscription) -> Dict:
+        llamadas = [self.registry.get(call_id) for call_id in sub.visibles]
+        llamadas = [c for c in llamadas if c is not None]
+        llamadas.sort(key=lambda c: c.get("start_time").isoformat() if c.get("start_time") else "", reverse=True)
+        return {
+            "type": "snapshot",
+            "seq": sub.seq,
+            "filters": sub.filtro.describir(),
+            "active_calls": [vista_llamada(c) for c in llamadas],
+        }
+
+    # ----- Reparto -----
+
+    def _candidatas(self, llamada: Dict) -> Set[Subscription]:
+        candidatas = set(self._resto)
+        for extension in (llamada.get("calling_number"), llamada.get("called_number")):
+            subs = self._por_extension.get(extension)
+            if subs:
+                candidatas |= subs
+        subs = self._por_zona.get(llamada.get("zone") or "Desconocida")
+        if subs:
+            candidatas |= subs
+        subs = self._por_direccion.get(llamada.get("direction") or "unknown")
+        if subs:
+            candidatas |= subs
+        return candidatas
+
+    def distribuir(self, eventos: List[Dict]) -> Dict[Subscription, List[Dict]]:
+        """Traduce los deltas globales de un tick a los deltas de cada suscripción"""
+        por_sub: Dict[Subscription, List[Dict]] = {}
+
+        def emitir(sub: Subscription, evento: Dict) -> None:
+            sub.seq += 1
+            sub.eventos += 1
+            evento["seq"] = sub.seq
+            por_sub.setdefault(sub, []).append(evento)
+
+        for evento in eventos:
+            tipo = evento["type"]
+            call_id = evento["call"]["call_id"] if tipo == "call_added" else evento["call_id"]
+            antes = self._visibles_por_llamada.pop(call_id, set())
+
+            llamada = None if tipo == "call_removed" else self.registry.get(call_id)
+            ahora: Set[Subscription] = set()
+            if llamada is not None:
+                for sub in self._candidatas(llamada):
+                    self.evaluaciones += 1
+                    if sub.filtro.coincide(llamada):
+                        ahora.add(sub)
+
+            for sub in antes - ahora:
+                sub.visibles.discard(call_id)
+                emitir(sub, {"type": "call_removed", "call_id": call_id})
+            for sub in ahora:
+                if sub in antes and tipo == "call_updated":
+                    emitir(sub, {"type": "call_updated", "call_id": call_id, "changes": evento["changes"]})
+                else:
+                    sub.visibles.add(call_id)
+                    emitir(sub, {"type": "call_added", "call": vista_llamada(llamada)})
+            if ahora:
+                self._visibles_por_llamada[call_id] = ahora
+        return por_sub
+
+    def stats(self) -> Dict:
+        return {
+            "subscriptions": len(self),
+            "indexed_extensions": len(self._por_extension),
+            "indexed_zones": len(self._por_zona),
+            "indexed_directions": len(self._por_direccion),
+            "unindexed": len(self._resto),
+            "predicate_evaluations": self.evaluaciones,
+        }
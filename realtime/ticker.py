@@ -0,0 +1,122 @@
+# realtime/ticker.py
+"""
+Duración y costo en vivo de las llamadas activas, calculados en el servidor.
+
+Los conectores solo informan inicio, contestación (answer_time) y corte.
+Al contestarse una llamada se resuelve una vez su tarifa por minuto (snapshot
+de tarificación en memoria) y un único timer recalcula duración y costo de
+todas las llamadas contestadas en cada tick:
+
+    duración = ahora - answer_time
+    costo    = duración / 60 * tarifa_por_minuto     (misma fórmula que /cdr)
+
+Los cambios de cada tick pasan por el broadcaster (un frame por tick). A la
+tabla active_calls se escriben solo cada `persistir_cada` ticks.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from .broadcaster import BroadcastScheduler
+from .registry import ActiveCallRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class LiveCallTicker:
+    """
+    `tarifar(numero_destino)` devuelve (nombre_zona, tarifa_por_minuto).
+    """
+
+    def __init__(self, registry: ActiveCallRegistry, broadcaster: BroadcastScheduler,
+                 tarifar: Callable[[Optional[str]], Tuple[Optional[str], float]],
+                 intervalo: float = 1.0, persistir_cada: int = 10):
+        self.registry = registry
+        self.broadcaster = broadcaster
+        self.tarifar = tarifar
+        self.intervalo = intervalo
+        self.persistir_cada = max(1, persistir_cada)
+        self._tarea: Optional[asyncio.Task] = None
+
+        self.ticks = 0
+        self.ultimo_tick_ms = 0.0
+        self.llamadas_ultimo_tick = 0
+
+    def contestada(self, call_id: str) -> Dict:
+        """Resuelve la tarifa de una llamada recién contestada y calcula sus valores actuales"""
+        llamada = self.registry.get(call_id)
+        if llamada is None or not llamada.get("answer_time"):
+            return {}
+        campos = {}
+        if llamada.get("rate_per_minute") is None:
+            try:
+                zona, tarifa = self.tarifar(llamada.get("called_number"))
+            except Exception as e:
+                logger.error(f"Error tarificando llamada activa {call_id}: {e}")
+                zona, tarifa = None, 0.0
+            campos["rate_per_minute"] = tarifa
+            if zona and (llamada.get("zone") or "Desconocida") == "Desconocida":
+                campos["zone"] = zona
+        cambios = self.registry.actualizar(call_id, campos, persistir=self.registry.es_propia(llamada))
+        cambios.update(self._recalcular(call_id, datetime.now(), persistir=True))
+        return cambios
+
+    def _recalcular(self, call_id: str, ahora: datetime, persistir: bool) -> Dict:
+        llamada = self.registry.get(call_id)
+        answer_time = llamada.get("answer_time") if llamada else None
+        if answer_time is None:
+            return {}
+        duracion = max(0, int((ahora - answer_time).total_seconds()))
+        costo = round(duracion / 60 * (llamada.get("rate_per_minute") or 0.0), 4)
+        # Con varios workers cada uno calcula sus réplicas, pero solo el dueño las escribe
+        return self.registry.actualizar(
+            call_id, {"current_duration": duracion, "current_cost": costo},
+            persistir=persistir and self.registry.es_propia(llamada)
+        )
+
+    def tick(self, ahora: Optional[datetime] = None) -> int:
+        """Recalcula todas las llamadas contestadas; devuelve cuántas cambiaron"""
+        ahora = ahora or datetime.now()
+        self.ticks += 1
+        persistir = self.ticks % self.persistir_cada == 0
+        cambiadas = 0
+        for call_id in self.registry.en_curso():
+            if self.registry.get(call_id).get("rate_per_minute") is None:
+                cambios = self.contestada(call_id)
+            else:
+                cambios = self._recalcular(call_id, ahora, persistir)
+            if cambios:
+                self.broadcaster.actualizada(call_id, cambios)
+                cambiadas += 1
+        return cambiadas
+
+    def start(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.intervalo)
+            inicio = loop.time()
+            try:
+                self.llamadas_ultimo_tick = self.tick()
+            except Exception as e:
+                logger.error(f"Error en el ticker de llamadas activas: {e}")
+            self.ultimo_tick_ms = round((loop.time() - inicio) * 1000, 3)
+
+    def stats(self) -> Dict:
+        return {
+            "interval_seconds": self.intervalo,
+            "persist_every_ticks": self.persistir_cada,
+            "answered_calls": len(self.registry.en_curso()),
+            "ticks": self.ticks,
+            "calls_changed_last_tick": self.llamadas_ultimo_tick,
+            "last_tick_ms": self.ultimo_tick_ms,
+        }
@@ -0,0 +1,188 @@
+// active-calls-ws.js - Cliente del protocolo de deltas de /ws para llamadas activas
+//
+// El servidor envía un snapshot al conectar y luego solo deltas numerados
+// (call_added, call_updated, call_removed). Si se pierde una secuencia se
+// pide {"action": "resync", "since": seq}. Mientras el socket está caído se
+// consulta /api/active-calls por AJAX.
+//
+// Con options.filters (o subscribe(filters)) el servidor envía solo las
+// llamadas que cumplen el filtro: extensions, area_nivel1/2/3, direction,
+// zone, min_cost. El filtro se vuelve a enviar al reconectar. Si el servidor
+// lo rechaza llega a options.onSubscribeError y sigue vigente el anterior.
+//
+// Con options.encoding = 'msgpack' (y msgpack-decoder.js cargado) se pide
+// la codificación binaria; si el servidor no la ofrece sigue llegando JSON.
+(() => {
+    class ActiveCallsSocket {
+        constructor(options = {}) {
+            const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+            this.encoding = options.encoding === 'msgpack' && window.MsgpackDecoder ? 'msgpack' : 'json';
+            this.url = options.url || `${scheme}://${window.location.host}/ws`;
+            if (this.encoding === 'msgpack') {
+                this.url += (this.url.includes('?') ? '&' : '?') + 'encoding=msgpack';
+            }
+            this.pollUrl = options.pollUrl || '/api/active-calls';
+            this.pollInterval = options.pollInterval || 3000;
+            this.onChange = options.onChange || (() => {});
+            this.onStatus = options.onStatus || (() => {});
+            this.onBalance = options.onBalance || (() => {});
+            this.onSubscribeError = options.onSubscribeError
+                || (msg => console.warn('Filtro de llamadas rechazado:', msg.error));
+            this.filters = options.filters || null;
+
+            this.calls = new Map();
+            this.seq = 0;
+            this.ws = null;
+            this.resyncPending = false;
+            this.reconnectDelay = 1000;
+            this.pollTimer = null;
+            this.closed = false;
+        }
+
+        connect() {
+            this.closed = false;
+            this.ws = new WebSocket(this.url);
+            this.ws.binaryType = 'arraybuffer';
+
+            this.ws.onopen = () => {
+                this.reconnectDelay = 1000;
+                this.stopPolling();
+                if (this.filters) this.send({ action: 'subscribe', filters: this.filters });
+                this.onStatus('connected');
+            };
+            this.ws.onmessage = (event) => {
+                try {
+                    this.handleMessage(typeof event.data === 'string'
+                        ? JSON.parse(event.data)
+                        : window.MsgpackDecoder.expandMessage(window.MsgpackDecoder.decode(event.data)));
+                } catch (error) {
+                    console.error('Error procesando mensaje WebSocket:', error);
+                }
+            };
+            this.ws.onclose = () => {
+                this.onStatus('disconnected');
+                if (this.closed) return;
+                this.startPolling();
+                setTimeout(() => this.connect(), this.reconnectDelay);
+                this.reconnectDelay = Math.min(this.reconnectDelay * 2, 30000);
+            };
+            this.ws.onerror = () => this.ws.close();
+        }
+
+        close() {
+            this.closed = true;
+            this.stopPolling();
+            if (this.ws) this.ws.close();
+        }
+
+        send(msg) {
+            if (this.ws && this.ws.readyState === WebSocket.OPEN) this.ws.send(JSON.stringify(msg));
+        }
+
+        subscribe(filters) {
+            this.filters = filters;
+            this.send({ action: 'subscribe', filters });
+        }
+
+        unsubscribe() {
+            this.filters = null;
+            this.send({ action: 'unsubscribe' });
+        }
+
+        handleMessage(msg) {
+            if (msg.type === 'snapshot' || msg.type === 'update') {
+                this.calls.clear();
+                (msg.active_calls || []).forEach(call => this.calls.set(call.call_id, call));
+                if (msg.seq !== undefined) this.seq = msg.seq;
+                this.resyncPending = false;
+                this.onChange(this.list());
+                return;
+            }
+            if (msg.type === 'balance_updated') {
+                this.onBalance(msg);
+                return;
+            }
+            if (msg.type === 'subscribe_error') {
+                this.filters = msg.filters;   // El que sigue vigente en el servidor (o null)
+                this.onSubscribeError(msg);
+                return;
+            }
+            if (msg.seq === undefined) return;   // p.ej. terminate_result
+
+            // Los deltas llegan agrupados por tick en un frame "batch"
+            const events = msg.type === 'batch' ? msg.events : [msg];
+            let changed = false;
+            for (const event of events) {
+                if (event.seq <= this.seq) continue;     // Duplicado (reenvío tras resync)
+                if (event.seq !== this.seq + 1) {
+                    this.resync();
+                    break;
+                }
+                this.applyDelta(event);
+                this.seq = event.seq;
+                this.resyncPending = false;
+                changed = true;
+            }
+            if (changed) this.onChange(this.list());
+        }
+
+        applyDelta(msg) {
+            switch (msg.type) {
+                case 'call_added':
+                    this.calls.set(msg.call.call_id, msg.call);
+                    break;
+                case 'call_updated': {
+                    const call = this.calls.get(msg.call_id);
+                    if (call) {
+                        Object.assign(call, msg.changes);
+                    } else {
+                        this.resync();
+                    }
+                    break;
+                }
+                case 'call_removed':
+                    this.calls.delete(msg.call_id);
+                    break;
+            }
+        }
+
+        resync(full = false) {
+            if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return;
+            if (this.resyncPending && !full) return;
+            this.resyncPending = true;
+            this.ws.send(JSON.stringify(full ? { action: 'resync' } : { action: 'resync', since: this.seq }));
+        }
+
+        list() {
+            return Array.from(this.calls.values())
+                .sort((a, b) => (b.start_time || '').localeCompare(a.start_time || ''));
+        }
+
+        poll() {
+            fetch(this.pollUrl)
+                .then(response => response.json())
+                .then(data => {
+                    if (!Array.isArray(data)) return;
+                    this.calls.clear();
+                    data.forEach(call => this.calls.set(call.call_id, call));
+                    this.onChange(this.list());
+                })
+                .catch(error => console.error('Error al obtener llamadas activas:', error));
+        }
+
+        startPolling() {
+            if (this.pollTimer) return;
+            this.poll();
+            this.pollTimer = setInterval(() => this.poll(), this.pollInterval);
+        }
+
+        stopPolling() {
+            if (this.pollTimer) {
+                clearInterval(this.pollTimer);
+                this.pollTimer = null;
+            }
+        }
+    }
+
+    window.ActiveCallsSocket = ActiveCallsSocket;
+})();
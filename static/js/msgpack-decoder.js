@@ -0,0 +1,115 @@
+// msgpack-decoder.js - Decodificador MessagePack mínimo para los frames binarios de /ws
+//
+// Con /ws?encoding=msgpack el servidor envía MessagePack compacto:
+// direction y status como enteros y fechas como epoch en milisegundos
+// (ver realtime/encoding.py). expandMessage() lo devuelve al formato JSON de
+// siempre, así el resto del código no distingue la codificación.
+(() => {
+    const textDecoder = new TextDecoder();
+
+    function decode(data) {
+        const bytes = data instanceof Uint8Array ? data : new Uint8Array(data);
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let pos = 0;
+
+        const str = (len) => {
+            const s = textDecoder.decode(bytes.subarray(pos, pos + len));
+            pos += len;
+            return s;
+        };
+        const bin = (len) => {
+            const b = bytes.slice(pos, pos + len);
+            pos += len;
+            return b;
+        };
+        const arr = (len) => {
+            const a = new Array(len);
+            for (let i = 0; i < len; i++) a[i] = read();
+            return a;
+        };
+        const map = (len) => {
+            const o = {};
+            for (let i = 0; i < len; i++) {
+                const key = read();
+                o[key] = read();
+            }
+            return o;
+        };
+        const u8 = () => view.getUint8(pos++);
+        const u16 = () => { const v = view.getUint16(pos); pos += 2; return v; };
+        const u32 = () => { const v = view.getUint32(pos); pos += 4; return v; };
+
+        function read() {
+            const b = u8();
+            if (b <= 0x7f) return b;                         // positive fixint
+            if (b >= 0xe0) return b - 0x100;                 // negative fixint
+            if ((b & 0xf0) === 0x80) return map(b & 0x0f);   // fixmap
+            if ((b & 0xf0) === 0x90) return arr(b & 0x0f);   // fixarray
+            if ((b & 0xe0) === 0xa0) return str(b & 0x1f);   // fixstr
+            let v;
+            switch (b) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return bin(u8());
+                case 0xc5: return bin(u16());
+                case 0xc6: return bin(u32());
+                case 0xca: v = view.getFloat32(pos); pos += 4; return v;
+                case 0xcb: v = view.getFloat64(pos); pos += 8; return v;
+                case 0xcc: return u8();
+                case 0xcd: return u16();
+                case 0xce: return u32();
+                case 0xcf: v = view.getUint32(pos) * 4294967296 + view.getUint32(pos + 4); pos += 8; return v;
+                case 0xd0: v = view.getInt8(pos); pos += 1; return v;
+                case 0xd1: v = view.getInt16(pos); pos += 2; return v;
+                case 0xd2: v = view.getInt32(pos); pos += 4; return v;
+                case 0xd3: v = view.getInt32(pos) * 4294967296 + view.getUint32(pos + 4); pos += 8; return v;
+                case 0xd9: return str(u8());
+                case 0xda: return str(u16());
+                case 0xdb: return str(u32());
+                case 0xdc: return arr(u16());
+                case 0xdd: return arr(u32());
+                case 0xde: return map(u16());
+                case 0xdf: return map(u32());
+            }
+            throw new Error('MessagePack: tipo no soportado 0x' + b.toString(16));
+        }
+
+        return read();
+    }
+
+    // Mismos enums que realtime/encoding.py
+    const DIRECTIONS = ['unknown', 'inbound', 'outbound', 'internal', 'transit'];
+    const DIRECTION_DISPLAY = {
+        inbound: '📱 Entrante',
+        outbound: '📞 Saliente',
+        internal: '🏢 Interna',
+        transit: '🔄 Tránsito'
+    };
+    const STATUSES = [null, 'dialing', 'ringing', 'answered'];
+    const DATES = ['start_time', 'answer_time', 'last_updated', 'reaped_at'];
+
+    function expandCall(call) {
+        const out = Object.assign({}, call);
+        if (typeof out.direction === 'number') {
+            out.direction = DIRECTIONS[out.direction] || 'unknown';
+            out.direction_display = DIRECTION_DISPLAY[out.direction] || `❓ ${out.direction}`;
+        }
+        if (typeof out.status === 'number') out.status = STATUSES[out.status] || null;
+        DATES.forEach(field => {
+            if (typeof out[field] === 'number') out[field] = new Date(out[field]).toISOString();
+        });
+        return out;
+    }
+
+    function expandMessage(msg) {
+        if (msg.active_calls) msg.active_calls = msg.active_calls.map(expandCall);
+        if (msg.call) msg.call = expandCall(msg.call);
+        if (msg.changes) msg.changes = expandCall(msg.changes);
+        if (msg.events) msg.events = msg.events.map(expandMessage);
+        if (typeof msg.timestamp === 'number') msg.timestamp = new Date(msg.timestamp).toISOString();
+        return msg;
+    }
+
+    window.MsgpackDecoder = { decode, expandCall, expandMessage };
+})();
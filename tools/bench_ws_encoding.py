@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark de codificación de los frames de /ws.
+
+Arma N llamadas activas sintéticas en un ActiveCallRegistry y compara, para
+el snapshot y para un frame batch de deltas, bytes por frame y tiempo de
+codificación de:
+  send_json  json.dumps de Starlette (lo que hacía websocket.send_json)
+  json       `serializar` (texto compacto, lo que envía hoy /ws por defecto)
+  msgpack    `codificar(..., MSGPACK)` (enums enteros y fechas epoch)
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from realtime import ActiveCallRegistry, CallEventStream, serializar
+from realtime.encoding import MSGPACK, codificar, msgpack_disponible
+
+DIRECCIONES = ["inbound", "outbound", "internal", "transit"]
+ZONAS = ["Local", "Celular", "Nacional", "Internacional"]
+
+
+def send_json(mensaje) -> str:
+    return json.dumps(mensaje, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def poblar(registry: ActiveCallRegistry, llamadas: int) -> None:
+    ahora = datetime.now()
+    for i in range(llamadas):
+        inicio = ahora - timedelta(seconds=random.randint(0, 3600))
+        registry.upsert({
+            "call_id": f"bench-{i:06d}",
+            "calling_number": str(1000 + i % 500),
+            "called_number": f"519{random.randint(10000000, 99999999)}",
+            "direction": random.choice(DIRECCIONES),
+            "zone": random.choice(ZONAS),
+            "start_time": inicio,
+            "answer_time": inicio + timedelta(seconds=random.randint(1, 20)),
+            "status": "answered",
+            "current_duration": random.randint(0, 3600),
+            "current_cost": round(random.uniform(0, 50), 4),
+        }, persistir=False)
+
+
+def batch(stream: CallEventStream, registry: ActiveCallRegistry, cambios: int) -> dict:
+    """Frame batch con `cambios` call_updated de duración y costo (un tick del ticker)"""
+    eventos = []
+    for llamada in registry.llamadas()[:cambios]:
+        evento = stream.actualizada(llamada["call_id"], {
+            "current_duration": llamada["current_duration"] + 1,
+            "current_cost": round(float(llamada["current_cost"]) + 0.0125, 4),
+        })
+        if evento is not None:
+            eventos.append(evento)
+    return {"type": "batch", "seq": stream.seq, "events": eventos}
+
+
+def medir(codificador, mensaje, repeticiones: int) -> dict:
+    frame = codificador(mensaje)
+    tamanio = len(frame.encode() if isinstance(frame, str) else frame)
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        codificador(mensaje)
+    return {"bytes": tamanio, "ms": round((time.perf_counter() - inicio) / repeticiones * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tamaño y costo de codificación de los frames de /ws")
+    parser.add_argument("--llamadas", type=int, default=1000, help="Llamadas activas sintéticas")
+    parser.add_argument("--cambios", type=int, default=500, help="call_updated por frame batch")
+    parser.add_argument("--repeticiones", type=int, default=50, help="Codificaciones por medición")
+    args = parser.parse_args()
+
+    random.seed(42)
+    registry = ActiveCallRegistry()
+    stream = CallEventStream(registry)
+    poblar(registry, args.llamadas)
+
+    codificadores = {"send_json": send_json, "json": serializar}
+    if msgpack_disponible():
+        codificadores["msgpack"] = lambda m: codificar(m, MSGPACK)
+    else:
+        print("⚠️ Paquete msgpack no instalado: solo se mide JSON\n")
+
+    frames = {
+        f"snapshot ({args.llamadas})": stream.snapshot(),
+        f"batch ({args.cambios})": batch(stream, registry, args.cambios),
+    }
+
+    print(f"{'frame':<18}{'codificación':<14}{'bytes':>10}{'vs send_json':>14}{'ms':>10}")
+    for nombre, mensaje in frames.items():
+        base = None
+        for codificacion, codificador in codificadores.items():
+            r = medir(codificador, mensaje, args.repeticiones)
+            base = base or r["bytes"]
+            print(f"{nombre:<18}{codificacion:<14}{r['bytes']:>10}{r['bytes'] / base:>13.0%}{r['ms']:>10}")
+        print()
+
+
+if __name__ == "__main__":
+    main()